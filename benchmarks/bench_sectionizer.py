@@ -0,0 +1,273 @@
+"""Benchmark the Sectionizer and TextSectionizer on synthetic clinical notes.
+
+Notes are generated from the lines of notebooks/example_discharge_summary.txt and the
+headers in the bundled pattern files, with a configurable number of sections, section
+length and subsection nesting depth.
+
+Example:
+    python benchmarks/bench_sectionizer.py --docs 200 --sections 30 --save-baseline baseline.json
+    python benchmarks/bench_sectionizer.py --docs 200 --sections 30 --compare baseline.json
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+import warnings
+from os import path
+
+warnings.simplefilter("ignore")
+
+ROOT = path.join(path.dirname(path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import spacy  # noqa: E402
+
+from clinical_sectionizer import Sectionizer, TextSectionizer  # noqa: E402
+
+EXAMPLE_FILEPATH = path.join(ROOT, "notebooks", "example_discharge_summary.txt")
+SPACY_PATTERNS_FILEPATH = path.join(ROOT, "resources", "spacy_section_patterns.jsonl")
+
+SUBSECTION_PATTERN = "Subsection level {0}:"
+
+
+def load_headers():
+    "Return a list of (section_title, header text) tuples from the spaCy patterns file."
+    patterns = Sectionizer.load_patterns_from_jsonl(SPACY_PATTERNS_FILEPATH)
+    return [(p["section_title"], p["pattern"]) for p in patterns if isinstance(p["pattern"], str)]
+
+
+def subsection_patterns(depth, top_level_titles):
+    "Create patterns for subsections nested up to depth levels below the top level sections."
+    patterns = []
+    parents = sorted(top_level_titles)
+    for level in range(1, depth + 1):
+        title = "level_{0}".format(level)
+        patterns.append(
+            {
+                "section_title": title,
+                "pattern": SUBSECTION_PATTERN.format(level),
+                "parents": parents,
+            }
+        )
+        parents = [title]
+    return patterns
+
+
+def make_notes(n_docs, n_sections, lines_per_section, depth, seed=0):
+    """Generate synthetic notes.
+
+    Args:
+        n_docs (int): The number of notes.
+        n_sections (int): The number of top level sections in each note.
+        lines_per_section (int): The number of body lines following each header.
+        depth (int): The number of nested subsection levels below each top level section.
+    """
+    rng = random.Random(seed)
+    with open(EXAMPLE_FILEPATH) as f:
+        body_lines = [line.rstrip() for line in f if line.strip()]
+    headers = load_headers()
+    notes = []
+    for _ in range(n_docs):
+        lines = []
+        for _ in range(n_sections):
+            _, header = rng.choice(headers)
+            lines.append(header)
+            lines.extend(rng.choice(body_lines) for _ in range(lines_per_section))
+            for level in range(1, depth + 1):
+                lines.append(SUBSECTION_PATTERN.format(level))
+                lines.extend(rng.choice(body_lines) for _ in range(lines_per_section))
+        notes.append("\n".join(lines))
+    return notes
+
+
+def peak_alloc_mb(run_once):
+    """The peak memory allocated by Python while calling run_once, in MB. tracemalloc slows down
+    allocation, so this is measured in a separate run from the timings."""
+    tracemalloc.start()
+    try:
+        run_once()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+def bench_sectionizer(sectionizer, docs):
+    """Run the Sectionizer over docs, returning the elapsed seconds and the time spent in
+    each stage, as recorded by its stats."""
+    sectionizer.stats.reset()
+    t0 = time.perf_counter()
+    for doc in docs:
+        sectionizer(doc)
+    seconds = time.perf_counter() - t0
+    return seconds, dict(sectionizer.stats.stage_seconds)
+
+
+def bench_text_sectionizer(sectionizer, texts):
+    """Run the TextSectionizer over texts, returning the elapsed seconds and the time spent
+    in a separate pass which only calls get_matches."""
+    t0 = time.perf_counter()
+    for text in texts:
+        sectionizer(text)
+    seconds = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for text in texts:
+        sectionizer.get_matches(text)
+    return seconds, {"get_matches": time.perf_counter() - t0}
+
+
+def summarize(seconds, stages, n_docs, n_tokens, n_chars):
+    return {
+        "seconds": seconds,
+        "docs_per_sec": n_docs / seconds if seconds else None,
+        "tokens_per_sec": n_tokens / seconds if seconds else None,
+        "chars_per_sec": n_chars / seconds if seconds else None,
+        "stages": stages,
+    }
+
+
+def run(args):
+    notes = make_notes(
+        args.docs, args.sections, args.lines_per_section, args.depth, seed=args.seed
+    )
+    n_chars = sum(len(note) for note in notes)
+    if args.model is not None:
+        nlp = spacy.load(args.model)
+    else:
+        nlp = spacy.blank("en")
+
+    t0 = time.perf_counter()
+    docs = [nlp.make_doc(note) for note in notes]
+    tokenize_seconds = time.perf_counter() - t0
+    n_tokens = sum(len(doc) for doc in docs)
+
+    sectionizer = Sectionizer(
+        nlp,
+        require_start_line=args.require_start_line,
+        require_end_line=args.require_end_line,
+        stats=True,
+        prefilter=args.prefilter,
+    )
+    sectionizer.add(subsection_patterns(args.depth, sectionizer.section_titles))
+    text_patterns = TextSectionizer.load_patterns_from_jsonl(
+        path.join(ROOT, "resources", "text_section_patterns.jsonl")
+    )
+
+    benchmarks = {"sectionizer": lambda: bench_sectionizer(sectionizer, docs)}
+    for engine in ("regex", "combined"):
+        text_sectionizer = TextSectionizer(patterns=None, engine=engine)
+        text_sectionizer.add(text_patterns)
+        text_sectionizer.add(subsection_patterns(args.depth, []))
+        benchmarks["text_sectionizer[{0}]".format(engine)] = (
+            lambda text_sectionizer=text_sectionizer: bench_text_sectionizer(text_sectionizer, notes)
+        )
+
+    # Keep the fastest of the repeated runs
+    best = {}
+    for _ in range(args.repeat):
+        for name, bench in benchmarks.items():
+            seconds, stages = bench()
+            result = summarize(seconds, stages, len(docs), n_tokens, n_chars)
+            if name == "sectionizer":
+                result["tokenize_seconds"] = tokenize_seconds
+                result["counts"] = dict(sectionizer.stats.counts)
+            if name not in best or seconds < best[name]["seconds"]:
+                best[name] = result
+    for name, bench in benchmarks.items():
+        best[name]["peak_alloc_mb"] = peak_alloc_mb(bench)
+    return {
+        "config": {
+            "docs": args.docs,
+            "sections": args.sections,
+            "lines_per_section": args.lines_per_section,
+            "depth": args.depth,
+            "require_start_line": args.require_start_line,
+            "require_end_line": args.require_end_line,
+            "prefilter": args.prefilter,
+            "tokens": n_tokens,
+            "chars": n_chars,
+        },
+        "results": best,
+    }
+
+
+def print_report(report, baseline=None):
+    print(json.dumps(report["config"]))
+    for name, result in report["results"].items():
+        print(
+            "{0:28} {1:10.1f} docs/s {2:12.0f} tokens/s  peak allocated {3:.1f} MB".format(
+                name,
+                result["docs_per_sec"],
+                result["tokens_per_sec"],
+                result["peak_alloc_mb"],
+            )
+        )
+        for stage, seconds in result["stages"].items():
+            line = "    {0:24} {1:9.4f} s".format(stage, seconds)
+            if baseline is not None and name in baseline["results"]:
+                base_seconds = baseline["results"][name]["stages"].get(stage)
+                if base_seconds:
+                    line += "  ({0:+.1%} vs baseline)".format(seconds / base_seconds - 1)
+            print(line)
+        if baseline is not None and name in baseline["results"]:
+            base = baseline["results"][name]
+            change = result["docs_per_sec"] / base["docs_per_sec"] - 1
+            print("    {0:24} {1:+.1%}".format("docs/s vs baseline", change))
+
+
+def find_regressions(report, baseline, tolerance):
+    regressions = []
+    for name, result in report["results"].items():
+        if name not in baseline["results"]:
+            continue
+        base = baseline["results"][name]["docs_per_sec"]
+        if result["docs_per_sec"] < base * (1 - tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--docs", type=int, default=100, help="Number of notes.")
+    parser.add_argument("--sections", type=int, default=20, help="Top level sections per note.")
+    parser.add_argument("--lines-per-section", type=int, default=5)
+    parser.add_argument("--depth", type=int, default=2, help="Subsection nesting depth.")
+    parser.add_argument("--require-start-line", action="store_true")
+    parser.add_argument("--require-end-line", action="store_true")
+    parser.add_argument("--prefilter", action="store_true", help="Enable the Sectionizer prefilter.")
+    parser.add_argument("--model", default=None, help="spaCy model to tokenize with.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark, keeping the fastest.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", default=None, help="Write the results to this JSON file.")
+    parser.add_argument("--compare", default=None, help="Compare with results saved by --save-baseline.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Fractional slowdown in docs/s vs the baseline reported as a regression.",
+    )
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["config"] != report["config"]:
+            print("Warning: the baseline was run with a different configuration.")
+    print_report(report, baseline)
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+    if baseline is not None:
+        regressions = find_regressions(report, baseline, args.tolerance)
+        if regressions:
+            print("Regressions: {0}".format(", ".join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
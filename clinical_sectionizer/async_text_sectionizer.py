@@ -0,0 +1,169 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from . import util
+from .text_sectionizer import TextSectionizer
+
+# Put on the queue by close to stop the dispatcher once the texts before it are batched
+_STOP = object()
+
+
+class AsyncTextSectionizer:
+    """Sectionize texts from asyncio code without blocking the event loop.
+
+    Texts passed to concurrent calls are collected into micro-batches, which are
+    sectionized in a thread or process pool. A batch is sent as soon as it has
+    max_batch_size texts, or max_wait seconds after its first text arrived. At most
+    max_queue_size texts wait to be batched; further calls wait until there is room.
+
+    Example:
+        >>> async with AsyncTextSectionizer() as sectionizer:
+        ...     sections = await sectionizer("Past Medical History: DM2")
+    """
+
+    def __init__(
+        self,
+        sectionizer=None,
+        max_batch_size=32,
+        max_wait=0.002,
+        max_queue_size=1024,
+        executor="thread",
+        n_workers=1,
+    ):
+        """Create a new AsyncTextSectionizer.
+
+        Args:
+            sectionizer (TextSectionizer or None): The sectionizer to use. If None, a TextSectionizer
+                with the default patterns is created.
+            max_batch_size (int): The maximum number of texts in a batch.
+            max_wait (float): The maximum number of seconds to wait for more texts before sending a batch.
+            max_queue_size (int): The maximum number of texts waiting to be batched.
+            executor (str): Either "thread" or "process". Threads share the sectionizer and keep the
+                event loop responsive, but run one batch at a time because of the GIL. Processes
+                receive a copy of the sectionizer once when they start and run batches in parallel.
+                They are started with the "forkserver" or "spawn" start method, since forking a
+                process with running threads can deadlock.
+            n_workers (int): The number of threads or processes, which is also the number of batches
+                which can be sectionized at once.
+        """
+        if executor not in ("thread", "process"):
+            raise ValueError(
+                "executor must be either 'thread' or 'process', not {0}".format(executor)
+            )
+        if sectionizer is None:
+            sectionizer = TextSectionizer()
+        self.sectionizer = sectionizer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue_size = max_queue_size
+        self.executor = executor
+        self.n_workers = n_workers
+        self.n_batches = 0
+        self.n_texts = 0
+        self._queue = None
+        self._pool = None
+        self._dispatcher = None
+        self._arrived = None
+        self._slots = None
+        self._running = set()
+
+    async def __call__(self, text):
+        """Sectionize a text, returning the same list of (section_title, section_header, section_text)
+        tuples as TextSectionizer.__call__."""
+        if self._dispatcher is None:
+            self._start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        self._arrived.set()
+        return await future
+
+    def _start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._arrived = asyncio.Event()
+        if self.executor == "thread":
+            self._pool = ThreadPoolExecutor(self.n_workers)
+        else:
+            self._pool = ProcessPoolExecutor(
+                self.n_workers,
+                # The event loop's process already runs other threads, so it isn't forked
+                mp_context=util.get_context(allow_fork=False),
+                initializer=util._init_worker,
+                initargs=(self.sectionizer,),
+            )
+        self._slots = asyncio.Semaphore(self.n_workers)
+        self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        stopped = False
+        while not stopped:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                while len(batch) < self.max_batch_size and not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is _STOP:
+                        stopped = True
+                        break
+                    batch.append(item)
+                timeout = deadline - loop.time()
+                if stopped or len(batch) == self.max_batch_size or timeout <= 0:
+                    break
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            # Wait for a free worker, so that batches keep growing while all workers are busy
+            await self._slots.acquire()
+            task = loop.create_task(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        texts = [text for (text, _) in batch]
+        try:
+            if self.executor == "thread":
+                results = await loop.run_in_executor(
+                    self._pool, self.sectionizer._sectionize_batch, texts
+                )
+            else:
+                results = await loop.run_in_executor(
+                    self._pool, util._call_worker, "_sectionize_batch", texts
+                )
+        except Exception as e:
+            for (_, future) in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            self.n_batches += 1
+            self.n_texts += len(texts)
+            for (_, future), sections in zip(batch, results):
+                # The caller may have been cancelled while the batch was running
+                if not future.done():
+                    future.set_result(sections)
+        finally:
+            self._slots.release()
+
+    async def close(self):
+        """Finish sectionizing the texts which have been submitted and shut down the workers."""
+        if self._dispatcher is None:
+            return
+        await self._queue.put(_STOP)
+        await self._dispatcher
+        if self._running:
+            await asyncio.gather(*self._running)
+        self._pool.shutdown()
+        self._dispatcher = None
+        self._queue = None
+        self._pool = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
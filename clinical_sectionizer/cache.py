@@ -0,0 +1,188 @@
+from collections import OrderedDict
+import hashlib
+import os
+import sqlite3
+import time
+
+import srsly
+
+
+def make_key(*parts):
+    """Return a hex digest identifying a cache entry from a sequence of str or bytes parts,
+    such as a text and a fingerprint of the patterns and settings used to sectionize it."""
+    digest = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        # Prefix each part with its length so that different splits give different keys
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class MemoryCache:
+    """A least recently used cache of sectionizer results, held in memory.
+    Each process has its own copy, including the worker processes used by pipe.
+
+    Attributes:
+        hits (int): The number of successful lookups.
+        misses (int): The number of lookups which found nothing.
+    """
+
+    def __init__(self, maxsize=10000):
+        """Create a new MemoryCache.
+
+        Args:
+            maxsize (int or None): The maximum number of results to keep. The least recently
+                used result is dropped when the cache is full. None means no limit.
+        """
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        "Return the result stored for key, or None."
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if self.maxsize is not None:
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        "Remove all results and reset the hit and miss counts."
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def info(self):
+        "Return a dict of the hits, misses, current size and maximum size of the cache."
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self),
+            "maxsize": self.maxsize,
+        }
+
+
+class SqliteCache:
+    """A least recently used cache of sectionizer results, stored in a sqlite database.
+    The same file can be used by several processes at once, so results found by one
+    worker process can be reused by the others and by later runs.
+
+    Attributes:
+        hits (int): The number of successful lookups made by this process.
+        misses (int): The number of lookups made by this process which found nothing.
+    """
+
+    PRUNE_INTERVAL = 64
+
+    def __init__(self, path, maxsize=None, timeout=30.0):
+        """Create a new SqliteCache.
+
+        Args:
+            path (str or Path): The database file. It is created if it doesn't exist.
+            maxsize (int or None): The maximum number of results to keep. The least recently
+                used results are dropped when the cache is full. The size is checked every
+                PRUNE_INTERVAL writes, so it can briefly exceed maxsize. None means no limit.
+            timeout (float): How many seconds to wait for another process to release the database.
+        """
+        self.path = str(path)
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._pid = None
+        self._writes = 0
+        self._connect()
+
+    def _connect(self):
+        # Connections can't be shared with forked worker processes, so each process opens its own
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=self.timeout)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, value BLOB, used REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        "Return the result stored for key, or None."
+        conn = self._connect()
+        row = conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        if self.maxsize is not None:
+            conn.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+        self.hits += 1
+        return srsly.msgpack_loads(row[0])
+
+    def set(self, key, value):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO results (key, value, used) VALUES (?, ?, ?)",
+            (key, srsly.msgpack_dumps(value), time.time()),
+        )
+        conn.commit()
+        self._writes += 1
+        if self.maxsize is not None and self._writes % self.PRUNE_INTERVAL == 0:
+            self.prune()
+
+    def prune(self):
+        "Drop the least recently used results until there are at most maxsize."
+        if self.maxsize is None:
+            return
+        conn = self._connect()
+        excess = len(self) - self.maxsize
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM results WHERE key IN "
+                "(SELECT key FROM results ORDER BY used LIMIT ?)",
+                (excess,),
+            )
+            conn.commit()
+
+    def clear(self):
+        "Remove all results and reset the hit and miss counts."
+        conn = self._connect()
+        conn.execute("DELETE FROM results")
+        conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def info(self):
+        "Return a dict of the hits, misses, current size and maximum size of the cache."
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self),
+            "maxsize": self.maxsize,
+        }
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_pid"] = None
+        return state
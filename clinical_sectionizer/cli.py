@@ -0,0 +1,443 @@
+import argparse
+import csv
+from itertools import islice
+import json
+import os
+from pathlib import Path
+import sys
+import time
+
+from spacy.util import minibatch
+import srsly
+
+from . import util
+
+SECTION_FIELDS = (
+    "section_title",
+    "section_parent",
+    "header_start",
+    "header_end",
+    "section_start",
+    "section_end",
+)
+
+
+def build_bundle(
+    patterns_path,
+    output_path,
+    text=False,
+    model=None,
+    lang="en",
+    phrase_matcher_attr="LOWER",
+    max_scope=None,
+    require_start_line=False,
+    require_end_line=False,
+):
+    """Compile the patterns in a jsonl file and write them to a bundle file, which can
+    be loaded with Sectionizer.from_disk or TextSectionizer.from_disk.
+
+    Args:
+        patterns_path (str): The path to a jsonl file of patterns, or for a TextSectionizer
+            a json file mapping section titles to lists of patterns.
+        output_path (str): The path of the bundle file to write.
+        text (bool): Build a bundle for the TextSectionizer instead of the Sectionizer.
+        model (str or None): The name or path of a spaCy model whose tokenizer will be used
+            for string patterns. The same tokenizer should be used when loading the bundle.
+        lang (str): The language of a blank spaCy model to use if model is None.
+        phrase_matcher_attr, max_scope, require_start_line, require_end_line:
+            Settings for the Sectionizer which will be stored in the bundle.
+
+    Returns:
+        The sectionizer which was written to the bundle.
+    """
+    if text:
+        from .text_sectionizer import TextSectionizer
+
+        sectionizer = TextSectionizer(patterns=patterns_path)
+    else:
+        import spacy
+        from .sectionizer import Sectionizer
+
+        if model is not None:
+            nlp = spacy.load(model)
+        else:
+            nlp = spacy.blank(lang)
+        sectionizer = Sectionizer(
+            nlp,
+            patterns=patterns_path,
+            phrase_matcher_attr=phrase_matcher_attr,
+            max_scope=max_scope,
+            require_start_line=require_start_line,
+            require_end_line=require_end_line,
+        )
+    sectionizer.to_disk(output_path)
+    return sectionizer
+
+
+def read_notes(input_path, text_field="text", id_field="id"):
+    """Read the notes in a directory of text files, a jsonl file or a csv file.
+
+    Files in a directory are read in sorted order, with their path relative to the directory
+    as the note id. Each line of a jsonl file and each row of a csv file is one note.
+    If a jsonl line or csv row has no id_field, the note id is its position in the file.
+
+    Args:
+        input_path (str): The directory, jsonl file or csv file.
+        text_field (str): The field of each jsonl line or csv row containing the text.
+        id_field (str): The field of each jsonl line or csv row containing the note id.
+
+    Yields:
+        (note_id, text) tuples.
+    """
+    input_path = Path(input_path)
+    if input_path.is_dir():
+        for filepath in sorted(p for p in input_path.rglob("*") if p.is_file()):
+            yield (filepath.relative_to(input_path).as_posix(), filepath.read_text())
+    elif input_path.suffix == ".jsonl":
+        for i, record in enumerate(srsly.read_jsonl(input_path)):
+            yield (record.get(id_field, i), record[text_field])
+    elif input_path.suffix == ".csv":
+        with input_path.open(newline="") as f:
+            for i, row in enumerate(csv.DictReader(f)):
+                yield (row.get(id_field, i), row[text_field])
+    else:
+        raise ValueError(
+            "Input must be a directory, a .jsonl file or a .csv file, not {0}".format(
+                input_path
+            )
+        )
+
+
+def load_sectionizer(bundle=None, patterns=None, text=False, model=None, lang="en"):
+    """Create a Sectionizer or TextSectionizer from a bundle file or a jsonl file of patterns.
+    If neither is given, the default patterns are used.
+
+    Args:
+        bundle (str or None): A bundle file written by to_disk or the bundle command.
+        patterns (str or None): A jsonl file of patterns. A TextSectionizer can also load a json file
+            mapping section titles to lists of patterns, such as resources/patrick_section_patterns.json.
+        text (bool): Create a TextSectionizer instead of a Sectionizer.
+        model (str or None): The name or path of a spaCy model to tokenize with.
+        lang (str): The language of a blank spaCy model to use if model is None.
+    """
+    if patterns is None:
+        patterns = "default"
+    if text:
+        from .text_sectionizer import TextSectionizer
+
+        if bundle is not None:
+            return TextSectionizer(patterns=None).from_disk(bundle)
+        return TextSectionizer(patterns=patterns)
+
+    import spacy
+    from .sectionizer import Sectionizer
+
+    if model is not None:
+        nlp = spacy.load(model)
+    else:
+        nlp = spacy.blank(lang)
+    if bundle is not None:
+        return Sectionizer(nlp, patterns=None).from_disk(bundle)
+    return Sectionizer(nlp, patterns=patterns)
+
+
+class _ShardRunner:
+    # Sectionizes shards of notes in the worker processes
+
+    def __init__(self, sectionizer):
+        self.sectionizer = sectionizer
+
+    def sectionize_shard(self, notes):
+        return [(note_id, self.sectionize(text)) for (note_id, text) in notes]
+
+    def profile_shard(self, notes):
+        # Workers profile each shard separately, and the profiles are added together by run_corpus
+        self.sectionizer.profile.reset()
+        return self.sectionize_shard(notes), self.sectionizer.profile.to_dict()
+
+    def sectionize(self, text):
+        "Return a list of dicts with the SECTION_FIELDS of each section of a text."
+        sections = []
+        if hasattr(self.sectionizer, "get_section_offsets"):
+            for section in self.sectionizer.get_section_offsets(text):
+                sections.append(
+                    {
+                        "section_title": section.section_title,
+                        "section_parent": None,
+                        "header_start": section.header_start,
+                        "header_end": section.header_end,
+                        "section_start": section.section_start,
+                        "section_end": section.section_end,
+                    }
+                )
+            return sections
+
+        doc = self.sectionizer(self.sectionizer.nlp.make_doc(text))
+        for (title, header, parent, span) in doc._.sections:
+            sections.append(
+                {
+                    "section_title": title,
+                    "section_parent": parent,
+                    "header_start": header.start_char if header is not None else -1,
+                    "header_end": header.end_char if header is not None else -1,
+                    "section_start": span.start_char,
+                    "section_end": span.end_char,
+                }
+            )
+        return sections
+
+
+def run_corpus(
+    input_path,
+    output_path,
+    sectionizer,
+    output_format="jsonl",
+    shard_size=100,
+    n_process=1,
+    resume=False,
+    text_field="text",
+    id_field="id",
+    log=None,
+):
+    """Sectionize a corpus of notes, writing the character offsets of each section.
+
+    Notes are split into shards of shard_size notes, which are sectionized in a pool of worker
+    processes and written in order. Progress is saved after each shard, so if the job is stopped
+    it can be run again with resume=True to continue after the last shard which was written.
+
+    Args:
+        input_path (str): The notes to read. See read_notes.
+        output_path (str): Where to write the sections. For the "jsonl" format, a file with one line
+            per note, containing its id and a list of sections. For the "columns" format, a directory
+            of json files with one for each shard, each containing a column for the note id and for each
+            of SECTION_FIELDS, with one row per section.
+        sectionizer: A Sectionizer or TextSectionizer.
+        output_format (str): Either "jsonl" or "columns".
+        shard_size (int): The number of notes in each shard.
+        n_process (int): The number of worker processes. -1 will use one process per CPU.
+        resume (bool): Continue a previous run with the same input and output instead of starting again.
+        text_field (str): The field of each jsonl line or csv row containing the text.
+        id_field (str): The field of each jsonl line or csv row containing the note id.
+        log: An optional function called with a line of progress after each shard.
+
+    If the sectionizer has a PatternProfile, the profiles of the worker processes are added to it.
+
+    Returns:
+        The number of notes sectionized by this run.
+    """
+    if output_format not in ("jsonl", "columns"):
+        raise ValueError(
+            "output_format must be either 'jsonl' or 'columns', not {0}".format(output_format)
+        )
+    output_path = Path(output_path)
+    if output_format == "columns":
+        output_path.mkdir(parents=True, exist_ok=True)
+        progress_path = output_path / "progress.json"
+    else:
+        progress_path = output_path.with_name(output_path.name + ".progress.json")
+
+    progress = {"notes": 0, "offset": 0}
+    if resume and progress_path.exists():
+        progress = srsly.read_json(progress_path)
+    elif output_format == "columns":
+        for shard_path in output_path.glob("shard-*.json"):
+            shard_path.unlink()
+
+    if output_format == "jsonl":
+        output_file = output_path.open("a+b" if resume else "wb")
+        # Drop anything written after the last saved shard
+        output_file.truncate(progress["offset"])
+        output_file.seek(progress["offset"])
+
+    notes = islice(read_notes(input_path, text_field, id_field), progress["notes"], None)
+    shards = ((None, shard) for shard in minibatch(notes, size=shard_size))
+    runner = _ShardRunner(sectionizer)
+    profile = getattr(sectionizer, "profile", None)
+    if n_process == 1:
+        results = ((None, runner.sectionize_shard(shard)) for (_, shard) in shards)
+    elif profile is not None:
+        results = _merge_profiles(
+            profile, util.map_batches(runner, "profile_shard", shards, n_process)
+        )
+    else:
+        results = util.map_batches(runner, "sectionize_shard", shards, n_process)
+
+    start_time = time.perf_counter()
+    n_notes = 0
+    try:
+        for _, shard_results in results:
+            if output_format == "jsonl":
+                for note_id, sections in shard_results:
+                    line = json.dumps({"id": note_id, "sections": sections}) + "\n"
+                    output_file.write(line.encode("utf-8"))
+                output_file.flush()
+                os.fsync(output_file.fileno())
+                progress["offset"] = output_file.tell()
+            else:
+                columns = {field: [] for field in ("id",) + SECTION_FIELDS}
+                for note_id, sections in shard_results:
+                    for section in sections:
+                        columns["id"].append(note_id)
+                        for field in SECTION_FIELDS:
+                            columns[field].append(section[field])
+                shard_path = output_path / "shard-{0:09d}.json".format(progress["notes"])
+                _write_json_atomic(shard_path, columns)
+            progress["notes"] += len(shard_results)
+            n_notes += len(shard_results)
+            _write_json_atomic(progress_path, progress)
+            if log is not None:
+                elapsed = time.perf_counter() - start_time
+                log(
+                    "{0} notes ({1} this run), {2:.1f} notes/s".format(
+                        progress["notes"], n_notes, n_notes / elapsed if elapsed else 0.0
+                    )
+                )
+    finally:
+        if output_format == "jsonl":
+            output_file.close()
+    return n_notes
+
+
+def _merge_profiles(profile, results):
+    for _, (shard_results, shard_profile) in results:
+        profile.merge(shard_profile)
+        yield None, shard_results
+
+
+def _write_json_atomic(path, data):
+    # Write to a temporary file first so a stopped job never leaves a partial file
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(data))
+    os.replace(tmp_path, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m clinical_sectionizer")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    bundle_parser = subparsers.add_parser(
+        "bundle", help="Prebuild a pattern bundle from a jsonl file of patterns."
+    )
+    bundle_parser.add_argument("patterns", help="A jsonl file of patterns.")
+    bundle_parser.add_argument("output", help="The bundle file to write.")
+    bundle_parser.add_argument(
+        "--text",
+        action="store_true",
+        help="Build a bundle for the TextSectionizer instead of the Sectionizer.",
+    )
+    bundle_parser.add_argument(
+        "--model", default=None, help="A spaCy model to tokenize string patterns with."
+    )
+    bundle_parser.add_argument(
+        "--lang", default="en", help="The language of a blank spaCy model, if no model is given."
+    )
+    bundle_parser.add_argument("--phrase-matcher-attr", default="LOWER")
+    bundle_parser.add_argument("--max-scope", type=int, default=None)
+    bundle_parser.add_argument("--require-start-line", action="store_true")
+    bundle_parser.add_argument("--require-end-line", action="store_true")
+
+    run_parser = subparsers.add_parser(
+        "run", help="Sectionize a corpus of notes and write the offsets of each section."
+    )
+    run_parser.add_argument("input", help="A directory of text files, a jsonl file or a csv file.")
+    run_parser.add_argument(
+        "output", help="The jsonl file to write, or a directory for the columns format."
+    )
+    run_parser.add_argument("--bundle", default=None, help="A bundle file to load patterns from.")
+    run_parser.add_argument("--patterns", default=None, help="A jsonl file of patterns.")
+    run_parser.add_argument(
+        "--text", action="store_true", help="Use the TextSectionizer instead of the Sectionizer."
+    )
+    run_parser.add_argument("--model", default=None, help="A spaCy model to tokenize with.")
+    run_parser.add_argument(
+        "--lang", default="en", help="The language of a blank spaCy model, if no model is given."
+    )
+    run_parser.add_argument("--format", default="jsonl", choices=["jsonl", "columns"])
+    run_parser.add_argument("--shard-size", type=int, default=100)
+    run_parser.add_argument("--n-process", type=int, default=1)
+    run_parser.add_argument(
+        "--resume", action="store_true", help="Continue a previous run which was stopped."
+    )
+    run_parser.add_argument("--text-field", default="text")
+    run_parser.add_argument("--id-field", default="id")
+    run_parser.add_argument(
+        "--profile",
+        default=None,
+        help="Write a report of the matches and matching time of each pattern to this file, "
+        "as JSON if it ends with .json. Patterns are matched one at a time, which is slower.",
+    )
+    run_parser.add_argument(
+        "--time-budget",
+        type=float,
+        default=None,
+        help="With --text, the maximum number of seconds to spend matching slow patterns in each note.",
+    )
+    run_parser.add_argument(
+        "--on-timeout",
+        default="degrade",
+        choices=["degrade", "raise"],
+        help="With --text, whether to skip the remaining slow patterns or stop when the time budget runs out.",
+    )
+    run_parser.add_argument(
+        "--profile-sort",
+        default="seconds",
+        choices=["seconds", "hits", "kept", "lost"],
+        help="How to rank the patterns in the profile report.",
+    )
+
+    args = parser.parse_args(argv)
+    if args.command == "bundle":
+        sectionizer = build_bundle(
+            args.patterns,
+            args.output,
+            text=args.text,
+            model=args.model,
+            lang=args.lang,
+            phrase_matcher_attr=args.phrase_matcher_attr,
+            max_scope=args.max_scope,
+            require_start_line=args.require_start_line,
+            require_end_line=args.require_end_line,
+        )
+        print(
+            "Wrote {0} patterns to {1}".format(len(sectionizer.patterns), args.output)
+        )
+    elif args.command == "run":
+        sectionizer = load_sectionizer(
+            bundle=args.bundle,
+            patterns=args.patterns,
+            text=args.text,
+            model=args.model,
+            lang=args.lang,
+        )
+        if args.time_budget is not None:
+            if not args.text:
+                parser.error("--time-budget can only be used with --text")
+            sectionizer.time_budget = args.time_budget
+            sectionizer.on_timeout = args.on_timeout
+        if args.profile is not None:
+            from .pattern_profile import PatternProfile
+
+            sectionizer.profile = PatternProfile()
+        start_time = time.perf_counter()
+        n_notes = run_corpus(
+            args.input,
+            args.output,
+            sectionizer,
+            output_format=args.format,
+            shard_size=args.shard_size,
+            n_process=args.n_process,
+            resume=args.resume,
+            text_field=args.text_field,
+            id_field=args.id_field,
+            log=lambda line: print(line, file=sys.stderr),
+        )
+        elapsed = time.perf_counter() - start_time
+        print(
+            "Sectionized {0} notes in {1:.1f}s ({2:.1f} notes/s)".format(
+                n_notes, elapsed, n_notes / elapsed if elapsed else 0.0
+            )
+        )
+        if args.profile is not None:
+            sectionizer.profile.write_report(args.profile, sort_by=args.profile_sort)
+            print("Wrote the pattern profile to {0}".format(args.profile))
@@ -0,0 +1,204 @@
+import re
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+# Characters which may follow a literal first character and change its meaning
+QUANTIFIERS = "*+?{"
+
+
+class CombinedPatternMatcher:
+    """Match a list of compiled regular expressions against a text with a single scan.
+
+    All patterns which share a set of compile flags are combined into one
+    zero-width alternation, grouped by their literal first character. Scanning the
+    text with this alternation finds every position where at least one pattern can
+    match. Each candidate pattern is then matched at those positions only, which
+    reproduces exactly the matches returned by calling `finditer` on every pattern
+    separately, in the same order.
+
+    Patterns which cannot safely be combined (numbered backreferences, named groups,
+    inline global flags, patterns which can match the empty string) are scanned on their own.
+    """
+
+    def __init__(self, patterns, ranks=None):
+        """Create a new CombinedPatternMatcher.
+
+        Args:
+            patterns: A list of (section_title, compiled regex) tuples. Matches will be
+                returned grouped by pattern in this order.
+            ranks: The indices in patterns of the patterns to match, if only some of them
+                should be matched. Default None, which matches all of the patterns.
+        """
+        self._patterns = list(patterns)
+        if ranks is None:
+            ranks = range(len(self._patterns))
+        self._ranks = list(ranks)
+        self._standalone = []
+        self._scanners = []
+
+        by_flags = dict()
+        for rank in self._ranks:
+            pattern = self._patterns[rank][1]
+            if _can_combine(pattern):
+                by_flags.setdefault(pattern.flags, []).append(rank)
+            else:
+                self._standalone.append(rank)
+
+        for flags, ranks in by_flags.items():
+            self._scanners.append(_CombinedScanner(self._patterns, ranks, flags))
+
+    def __call__(self, text, pos=0):
+        """Return a list of (section_title, match) tuples for every pattern match in text,
+        starting the search at index pos."""
+        found = [None] * len(self._patterns)
+        self.scan(text, found, pos)
+
+        matches = []
+        for rank in self._ranks:
+            name = self._patterns[rank][0]
+            for match in found[rank]:
+                matches.append((name, match))
+        return matches
+
+    def scan(self, text, found, pos=0):
+        """Set found[rank] to the list of matches of each pattern in text,
+        starting the search at index pos."""
+        for rank in self._standalone:
+            found[rank] = list(self._patterns[rank][1].finditer(text, pos))
+        for scanner in self._scanners:
+            scanner.scan(text, found, pos)
+
+
+class _CombinedScanner:
+    def __init__(self, patterns, ranks, flags):
+        self._patterns = patterns
+        self._ranks = ranks
+        self._flags = flags
+        # Patterns keyed by their literal first character
+        self._keyed = dict()
+        # Patterns which need to be checked at every candidate position
+        self._other = []
+
+        alternatives = []
+        for rank in ranks:
+            source = patterns[rank][1].pattern
+            key = _first_char_key(source, flags)
+            if key is None:
+                self._other.append(rank)
+                alternatives.append("(?:{0})".format(source))
+            else:
+                self._keyed.setdefault(key, []).append(rank)
+
+        keyed_alternatives = []
+        for key, key_ranks in self._keyed.items():
+            rests = "|".join(
+                "(?:{0})".format(patterns[rank][1].pattern[1:]) for rank in key_ranks
+            )
+            keyed_alternatives.append("{0}(?:{1})".format(re.escape(key), rests))
+
+        self._key_patterns = {
+            key: re.compile(re.escape(key), flags) for key in self._keyed
+        }
+        self._char_ranks = dict()
+        self._scanner = re.compile(
+            "(?=" + "|".join(keyed_alternatives + alternatives) + ")", flags
+        )
+
+    def _ranks_for_char(self, char):
+        try:
+            return self._char_ranks[char]
+        except KeyError:
+            pass
+        ranks = []
+        for key, key_ranks in self._keyed.items():
+            if self._key_patterns[key].match(char):
+                ranks.extend(key_ranks)
+        ranks = sorted(ranks + self._other)
+        self._char_ranks[char] = ranks
+        return ranks
+
+    def scan(self, text, found, pos=0):
+        for rank in self._ranks:
+            found[rank] = []
+        # Emulate the non-overlapping behavior of finditer for each pattern
+        next_start = dict()
+        for candidate in self._scanner.finditer(text, pos):
+            start = candidate.start()
+            for rank in self._ranks_for_char(text[start]):
+                if next_start.get(rank, 0) > start:
+                    continue
+                match = self._patterns[rank][1].match(text, start)
+                if match is None:
+                    continue
+                found[rank].append(match)
+                next_start[rank] = max(match.end(), start + 1)
+
+
+def _can_combine(pattern):
+    source = pattern.pattern
+    if pattern.groupindex or pattern.match("") is not None:
+        return False
+    # Patterns which can match the empty string somewhere, such as r"\b", are scanned on their own
+    try:
+        if sre_parse.parse(source, pattern.flags).getwidth()[0] == 0:
+            return False
+    except Exception:
+        return False
+    if re.search(r"\\[1-9]|\(\?\(", source):
+        return False
+    try:
+        re.compile("(?:{0})".format(source), pattern.flags)
+    except re.error:
+        return False
+    return True
+
+
+def _first_char_key(source, flags):
+    """Return the literal first character of a pattern if it can be factored out
+    of the pattern, otherwise None."""
+    if flags & re.VERBOSE or len(source) == 0:
+        return None
+    first = source[0]
+    if not first.isalnum():
+        return None
+    if source[1:2] and source[1] in QUANTIFIERS:
+        return None
+    if _has_top_level_branch(source):
+        return None
+    if flags & re.IGNORECASE:
+        lowered = first.lower()
+        if len(lowered) == 1:
+            return lowered
+    return first
+
+
+def _has_top_level_branch(source):
+    depth = 0
+    in_class = False
+    i = 0
+    while i < len(source):
+        char = source[i]
+        if char == "\\":
+            i += 2
+            continue
+        if in_class:
+            if char == "]":
+                in_class = False
+        elif char == "[":
+            in_class = True
+            # A closing bracket directly after the opening one is a literal
+            if source[i + 1 : i + 2] == "^":
+                i += 1
+            if source[i + 1 : i + 2] == "]":
+                i += 1
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return True
+        i += 1
+    return False
@@ -0,0 +1,316 @@
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+import sys
+
+import srsly
+
+Section = namedtuple(
+    "Section", field_names=["section_title", "section_header", "section_parent", "section_span"]
+)
+
+# The keys in Doc.user_data where the sections and section header candidates of a doc are stored
+USER_DATA_KEY = "clinical_sectionizer.sections"
+CANDIDATES_KEY = "clinical_sectionizer.section_candidates"
+
+# The integer columns stored for each section. Titles and parents are ids into a list of the
+# titles in the doc, and -1 means None. Headers are token offsets, or -1 if there is no header.
+COLUMNS = ("title_id", "parent_id", "header_start", "header_end", "section_start", "section_end")
+
+_BIG_ENDIAN = sys.byteorder == "big"
+
+# Offsets are stored as 4 byte integers
+TYPECODE = "i" if array("i").itemsize == 4 else "l"
+
+
+def set_doc_sections(doc, sections, token_sections=True):
+    """Store the sections of a doc in Doc.user_data as columns of integer offsets and a list of titles,
+    which can be serialized with the doc (for example by Doc.to_bytes or a DocBin with user data).
+
+    Args:
+        doc: A spaCy Doc.
+        sections: A list of (section_title, header_start, header_end, section_parent, section_start, section_end)
+            tuples sorted by section_start, where header_start and header_end are -1 if there is no header.
+        token_sections (bool): Whether tokens are in the sections. If False, the token attributes
+            are None, as for a doc without any section headers.
+    """
+    titles = []
+    title_ids = dict()
+
+    def get_id(title):
+        if title is None:
+            return -1
+        if title not in title_ids:
+            title_ids[title] = len(titles)
+            titles.append(title)
+        return title_ids[title]
+
+    columns = [array(TYPECODE) for _ in COLUMNS]
+    for (title, header_start, header_end, parent, section_start, section_end) in sections:
+        columns[0].append(get_id(title))
+        columns[1].append(get_id(parent))
+        columns[2].append(header_start)
+        columns[3].append(header_end)
+        columns[4].append(section_start)
+        columns[5].append(section_end)
+    data = array(TYPECODE)
+    for column in columns:
+        data.extend(column)
+    # Stored as little-endian so that docs can be moved between machines
+    if _BIG_ENDIAN:
+        data.byteswap()
+    doc.user_data[USER_DATA_KEY] = {
+        "titles": titles,
+        "columns": data.tobytes(),
+        "itemsize": data.itemsize,
+        "token_sections": token_sections,
+    }
+
+
+class DocSections:
+    """A read-only view of the sections of a doc, as returned by Doc._.sections.
+
+    Sections are stored in Doc.user_data as integer columns (see set_doc_sections).
+    Indexing or iterating creates Section namedtuples with Spans of the doc,
+    and the titles, headers, parents and spans can be accessed as columns without
+    creating the other fields.
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        data = doc.user_data.get(USER_DATA_KEY)
+        if data is None:
+            self._titles = []
+            self._columns = [[] for _ in COLUMNS]
+            self._token_sections = False
+            return
+        self._titles = data["titles"]
+        self._token_sections = data["token_sections"]
+        typecode = "q" if data["itemsize"] == 8 else TYPECODE
+        if _BIG_ENDIAN:
+            values = array(typecode)
+            values.frombytes(data["columns"])
+            values.byteswap()
+        else:
+            # A view of the bytes, so no copy is made
+            values = memoryview(data["columns"]).cast(typecode)
+        n = len(values) // len(COLUMNS)
+        self._columns = [values[i * n : (i + 1) * n] for i in range(len(COLUMNS))]
+
+    def __len__(self):
+        return len(self._columns[0])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("section index out of range")
+        return Section(self.title(i), self.header(i), self.parent(i), self.span(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def title(self, i):
+        title_id = self._columns[0][i]
+        return self._titles[title_id] if title_id >= 0 else None
+
+    def parent(self, i):
+        parent_id = self._columns[1][i]
+        return self._titles[parent_id] if parent_id >= 0 else None
+
+    def header(self, i):
+        header_start = self._columns[2][i]
+        if header_start < 0:
+            return None
+        return self.doc[header_start : self._columns[3][i]]
+
+    def span(self, i):
+        return self.doc[self._columns[4][i] : self._columns[5][i]]
+
+    @property
+    def titles(self):
+        return SectionColumn(self, self.title)
+
+    @property
+    def parents(self):
+        return SectionColumn(self, self.parent)
+
+    @property
+    def headers(self):
+        return SectionColumn(self, self.header)
+
+    @property
+    def spans(self):
+        return SectionColumn(self, self.span)
+
+    def token_section(self, i):
+        """Return the index of the section containing the token at index i, or None."""
+        if not self._token_sections:
+            return None
+        starts = self._columns[4]
+        j = bisect_right(starts, i) - 1
+        # Tokens after the max_scope of a section are not in a section
+        if j < 0 or i >= self._columns[5][j]:
+            return None
+        return j
+
+    def token_sections(self, indices):
+        """Return the index of the section containing each token index in indices, or None,
+        as token_section does for each index. The indices are sorted and assigned to sections
+        in a single pass, which is faster than a search for each index when there are many.
+        """
+        result = [None] * len(indices)
+        if not self._token_sections:
+            return result
+        starts = self._columns[4]
+        ends = self._columns[5]
+        n_sections = len(starts)
+        j = -1
+        for k in sorted(range(len(indices)), key=indices.__getitem__):
+            i = indices[k]
+            while j + 1 < n_sections and starts[j + 1] <= i:
+                j += 1
+            # Tokens after the max_scope of a section are not in a section
+            if j >= 0 and i < ends[j]:
+                result[k] = j
+        return result
+
+    def to_offsets(self):
+        """Return a list of (section_title, header_start, header_end, section_parent, section_start, section_end)
+        tuples, in the format used by set_doc_sections."""
+        return [
+            (
+                self.title(i),
+                self._columns[2][i],
+                self._columns[3][i],
+                self.parent(i),
+                self._columns[4][i],
+                self._columns[5][i],
+            )
+            for i in range(len(self))
+        ]
+
+
+class SectionColumn:
+    """A read-only sequence of one field of each section in a DocSections, created when it is accessed."""
+
+    def __init__(self, sections, get):
+        self._sections = sections
+        self._get = get
+
+    def __len__(self):
+        return len(self._sections)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("section index out of range")
+        return self._get(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get(i)
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def get_doc_sections(doc):
+    return DocSections(doc)
+
+
+def set_doc_sections_from_tuples(doc, sections):
+    """Setter for Doc._.sections, which takes a list of (section_title, section_header, section_parent, section_span)
+    tuples, where section_header may be None."""
+    if isinstance(sections, DocSections):
+        set_doc_sections(doc, sections.to_offsets(), token_sections=sections._token_sections)
+        return
+    offsets = []
+    for (title, header, parent, span) in sections:
+        if header is None:
+            offsets.append((title, -1, -1, parent, span.start, span.end))
+        else:
+            offsets.append((title, header.start, header.end, parent, span.start, span.end))
+    set_doc_sections(doc, offsets)
+
+
+def sections_to_bytes(doc):
+    """Serialize the sections of a doc, for storing them separately from the doc
+    (for example when a DocBin doesn't store user data).
+
+    Returns:
+        The serialized sections as bytes, which only contain integer offsets and titles.
+    """
+    return srsly.msgpack_dumps(doc.user_data.get(USER_DATA_KEY))
+
+
+def sections_from_bytes(doc, bytes_data):
+    """Set the sections of a doc from bytes created by sections_to_bytes. The doc must have
+    the same tokens as the doc the sections were serialized from.
+
+    Returns:
+        The Doc.
+    """
+    data = srsly.msgpack_loads(bytes_data)
+    if data is None:
+        doc.user_data.pop(USER_DATA_KEY, None)
+    else:
+        doc.user_data[USER_DATA_KEY] = data
+    return doc
+
+
+def get_section_candidates(doc):
+    "Getter for Doc._.section_candidates, which returns a list of (match_id, start, end) tuples or None."
+    data = doc.user_data.get(CANDIDATES_KEY)
+    if data is None:
+        return None
+    match_ids = array("Q")
+    match_ids.frombytes(data["match_ids"])
+    offsets = array(TYPECODE)
+    offsets.frombytes(data["offsets"])
+    if _BIG_ENDIAN:
+        match_ids.byteswap()
+        offsets.byteswap()
+    return [
+        (match_id, offsets[2 * i], offsets[2 * i + 1]) for (i, match_id) in enumerate(match_ids)
+    ]
+
+
+def set_section_candidates(doc, matches):
+    "Setter for Doc._.section_candidates, which stores the matches as bytes so they serialize compactly."
+    if matches is None:
+        doc.user_data.pop(CANDIDATES_KEY, None)
+        return
+    match_ids = array("Q", [match[0] for match in matches])
+    offsets = array(TYPECODE)
+    for match in matches:
+        offsets.append(match[1])
+        offsets.append(match[2])
+    if _BIG_ENDIAN:
+        match_ids.byteswap()
+        offsets.byteswap()
+    doc.user_data[CANDIDATES_KEY] = {
+        "match_ids": match_ids.tobytes(),
+        "offsets": offsets.tobytes(),
+    }
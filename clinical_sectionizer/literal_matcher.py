@@ -0,0 +1,299 @@
+from functools import lru_cache
+import re
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+# Patterns are only matched with the trie if every string they can match starts with one
+# of at most MAX_PREFIXES literal prefixes, each at least MIN_PREFIX_LENGTH characters long
+MIN_PREFIX_LENGTH = 3
+MAX_PREFIXES = 32
+
+# A fragment matching any character, for characters which can't be matched more precisely
+ANY_CHAR = "(?s:.)"
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: r"\d",
+    sre_constants.CATEGORY_NOT_DIGIT: r"\D",
+    sre_constants.CATEGORY_SPACE: r"\s",
+    sre_constants.CATEGORY_NOT_SPACE: r"\S",
+    sre_constants.CATEGORY_WORD: r"\w",
+    sre_constants.CATEGORY_NOT_WORD: r"\W",
+}
+
+_ZERO_WIDTH = (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT)
+_REPEATS = tuple(
+    getattr(sre_constants, name)
+    for name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+    if hasattr(sre_constants, name)
+)
+
+
+class LiteralMatcher:
+    """Match the patterns in a list of compiled regular expressions which start with a literal
+    header, with a single scan of the text whose cost doesn't depend on the number of headers.
+
+    When the matcher is created, the literal prefixes of each pattern are found, such as
+    "past medical history:" for the pattern "past medical history:" and both "past history"
+    and "history" for "(past )?history". Patterns with short or too many prefixes are left
+    to be matched as regular expressions, and are listed in `other_ranks`.
+
+    The prefixes of patterns which share a set of compile flags are added to a trie, which is
+    compiled into a single zero-width regular expression and scanned over the text to find
+    every position where some prefix starts. At each of these positions, the trie is walked
+    character by character to find the patterns with a prefix there, and only those patterns
+    are matched. Since each pattern is still matched by its own regular expression, the
+    matches are exactly those returned by calling `finditer` on every pattern separately.
+    """
+
+    def __init__(self, patterns, ranks=None):
+        """Create a new LiteralMatcher.
+
+        Args:
+            patterns: A list of (section_title, compiled regex) tuples. Patterns are referred to
+                by their index in this list.
+            ranks: The indices in patterns of the patterns to match, if only some of them
+                should be matched. Default None, which matches all of the patterns.
+        """
+        self._patterns = list(patterns)
+        if ranks is None:
+            ranks = range(len(self._patterns))
+        self.ranks = []
+        self.other_ranks = []
+        tries = dict()
+        for rank in ranks:
+            pattern = self._patterns[rank][1]
+            prefixes = literal_prefixes(pattern)
+            if prefixes is None:
+                self.other_ranks.append(rank)
+                continue
+            self.ranks.append(rank)
+            trie = tries.setdefault(pattern.flags, _TrieNode())
+            for prefix in prefixes:
+                if pattern.flags & re.IGNORECASE:
+                    # Share trie nodes between upper and lower case ASCII letters
+                    prefix = tuple(
+                        fragment.lower() if len(fragment) == 1 and fragment.isascii() else fragment
+                        for fragment in prefix
+                    )
+                trie.add(prefix, rank)
+        self._scanners = [_TrieScanner(trie, flags) for (flags, trie) in tries.items()]
+
+    def scan(self, text, found, pos=0):
+        """Set found[rank] to the list of matches of each literal pattern in text,
+        starting the search at index pos."""
+        for rank in self.ranks:
+            found[rank] = []
+        # Emulate the non-overlapping behavior of finditer for each pattern
+        next_start = dict()
+        for scanner in self._scanners:
+            for start, ranks in scanner.candidates(text, pos):
+                for rank in ranks:
+                    if next_start.get(rank, 0) > start:
+                        continue
+                    match = self._patterns[rank][1].match(text, start)
+                    if match is None:
+                        continue
+                    found[rank].append(match)
+                    next_start[rank] = max(match.end(), start + 1)
+
+
+class _TrieNode:
+    def __init__(self):
+        self.children = dict()
+        # The patterns with a prefix ending at this node
+        self.ranks = set()
+
+    def add(self, prefix, rank):
+        node = self
+        for fragment in prefix:
+            node = node.children.setdefault(fragment, _TrieNode())
+        node.ranks.add(rank)
+
+    def to_regex(self):
+        # Once a prefix has matched there is a candidate, so longer prefixes can be ignored
+        if self.ranks:
+            return ""
+        alternatives = [
+            fragment + child.to_regex() for (fragment, child) in self.children.items()
+        ]
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return "(?:{0})".format("|".join(alternatives))
+
+
+class _TrieScanner:
+    def __init__(self, trie, flags):
+        self._flags = flags
+        self._scanner = re.compile("(?={0})".format(trie.to_regex()), flags)
+        self._fragments = dict()
+        # States of the walk are sets of trie nodes, since a character can match more than
+        # one fragment (for example "s" and "\s" both match " " under some flags). Transitions
+        # are added the first time a character is seen in a state.
+        self._start = self._state(frozenset([trie]))
+
+    def _state(self, nodes):
+        # A state is a (nodes, ranks, transitions, is_leaf) tuple
+        ranks = set()
+        for node in nodes:
+            ranks.update(node.ranks)
+        is_leaf = not any(node.children for node in nodes)
+        return (nodes, ranks, dict(), is_leaf)
+
+    def _matches_fragment(self, fragment, char):
+        try:
+            compiled = self._fragments[fragment]
+        except KeyError:
+            compiled = self._fragments[fragment] = re.compile(fragment, self._flags)
+        return compiled.fullmatch(char) is not None
+
+    def _next_state(self, state, char):
+        nodes, _, transitions, _ = state
+        try:
+            return transitions[char]
+        except KeyError:
+            pass
+        next_nodes = frozenset(
+            child
+            for node in nodes
+            for (fragment, child) in node.children.items()
+            if self._matches_fragment(fragment, char)
+        )
+        next_state = self._state(next_nodes) if next_nodes else None
+        transitions[char] = next_state
+        return next_state
+
+    def candidates(self, text, pos=0):
+        """Yield (start, ranks) tuples for each position where at least one prefix starts,
+        with the sorted ranks of the patterns which have a prefix there."""
+        for candidate in self._scanner.finditer(text, pos):
+            start = candidate.start()
+            state = self._start
+            ranks = set()
+            i = start
+            while i < len(text):
+                state = self._next_state(state, text[i])
+                if state is None:
+                    break
+                ranks.update(state[1])
+                if state[3]:
+                    break
+                i += 1
+            yield start, sorted(ranks)
+
+
+@lru_cache(maxsize=None)
+def literal_prefixes(pattern):
+    """Return a tuple of literal prefixes which every match of a compiled regular expression
+    starts with, or None if the pattern should be matched as a regular expression. Results are
+    cached, so patterns shared by several sectionizers are only parsed once.
+
+    Each prefix is a tuple of regular expression fragments which each match a single character,
+    for example ("p", "a", "s", "t", "\\s"). Zero-width assertions such as "\\b" are skipped,
+    since the full pattern is always matched at the start of a prefix.
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+    prefixes = _sequence_prefixes(parsed)
+    if prefixes is None or len(prefixes) == 0:
+        return None
+    if any(len(prefix) < MIN_PREFIX_LENGTH for (prefix, _) in prefixes):
+        return None
+    return tuple(prefix for (prefix, _) in prefixes)
+
+
+# The functions below return lists of (prefix, complete) tuples, where complete is False
+# if the prefix can be followed by text which isn't known, so nothing can be appended to it.
+
+
+def _sequence_prefixes(items):
+    prefixes = [((), True)]
+    for (op, av) in items:
+        item_prefixes = _item_prefixes(op, av)
+        if item_prefixes is None:
+            return None
+        prefixes = _concatenate(prefixes, item_prefixes)
+        if prefixes is None:
+            return None
+        if not any(complete for (_, complete) in prefixes):
+            break
+    return prefixes
+
+
+def _concatenate(left, right):
+    prefixes = []
+    for (prefix, complete) in left:
+        if not complete:
+            prefixes.append((prefix, False))
+            continue
+        for (suffix, suffix_complete) in right:
+            prefixes.append((prefix + suffix, suffix_complete))
+    prefixes = list(dict.fromkeys(prefixes))
+    if len(prefixes) > MAX_PREFIXES:
+        return None
+    return prefixes
+
+
+def _item_prefixes(op, av):
+    if op is sre_constants.LITERAL:
+        return [((re.escape(chr(av)),), True)]
+    if op is sre_constants.NOT_LITERAL:
+        return [(("[^{0}]".format(re.escape(chr(av))),), True)]
+    if op is sre_constants.IN:
+        return [((_class_fragment(av),), True)]
+    if op is sre_constants.ANY:
+        return [((ANY_CHAR,), True)]
+    if op in _ZERO_WIDTH:
+        return [((), True)]
+    if op is sre_constants.SUBPATTERN:
+        (_, add_flags, del_flags, items) = av
+        # Fragments are matched with the flags of the whole pattern
+        if add_flags or del_flags:
+            return [((), False)]
+        return _sequence_prefixes(items)
+    if op is sre_constants.BRANCH:
+        prefixes = []
+        for items in av[1]:
+            branch_prefixes = _sequence_prefixes(items)
+            if branch_prefixes is None:
+                return None
+            prefixes.extend(branch_prefixes)
+        prefixes = list(dict.fromkeys(prefixes))
+        if len(prefixes) > MAX_PREFIXES:
+            return None
+        return prefixes
+    if op in _REPEATS:
+        (min_count, max_count, items) = av
+        item_prefixes = _sequence_prefixes(items)
+        if item_prefixes is None:
+            return None
+        if max_count != 1:
+            # Whatever follows the first repetition isn't known
+            item_prefixes = [(prefix, False) for (prefix, _) in item_prefixes]
+        if min_count == 0:
+            item_prefixes = [((), True)] + item_prefixes
+        return item_prefixes
+    # Backreferences, conditionals and anything else
+    return [((), False)]
+
+
+def _class_fragment(items):
+    parts = []
+    for (op, av) in items:
+        if op is sre_constants.NEGATE:
+            parts.append("^")
+        elif op is sre_constants.LITERAL:
+            parts.append(re.escape(chr(av)))
+        elif op is sre_constants.RANGE:
+            parts.append("{0}-{1}".format(re.escape(chr(av[0])), re.escape(chr(av[1]))))
+        elif op is sre_constants.CATEGORY and av in _CATEGORIES:
+            parts.append(_CATEGORIES[av])
+        else:
+            return ANY_CHAR
+    return "[{0}]".format("".join(parts))
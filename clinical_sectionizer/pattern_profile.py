@@ -0,0 +1,180 @@
+import json
+
+# The stages where a match can be dropped, in the order they are applied
+LOSS_STAGES = ("duplicate", "line_filters", "overlap", "parents")
+
+SORT_KEYS = ("seconds", "hits", "kept", "lost")
+
+
+class PatternProfile:
+    """Hit counts and matching time recorded for each pattern of a Sectionizer or TextSectionizer.
+    Values accumulate across docs until reset is called.
+
+    While profiling, each pattern is matched on its own so that its time can be measured, which
+    is slower than normal matching. The matches, and so the sections, are the same.
+
+    For each pattern, the profile records:
+        hits: The number of matches of the pattern.
+        lost: The number of matches dropped at each of LOSS_STAGES:
+            "duplicate": The same span was already matched for the same section title by another pattern.
+            "line_filters": The match was removed by require_start_line or require_end_line.
+            "overlap": The match overlapped a match which was kept, in prune_overlapping_matches
+                or TextSectionizer._dedup_matches.
+            "parents": The section required a parent which wasn't found.
+        kept: The number of matches which became section headers.
+        seconds: The total time spent matching the pattern.
+
+    Patterns are identified by their section title and pattern, so the profiles of several
+    sectionizers or worker processes with the same patterns can be merged.
+
+    Example:
+        >>> sectionizer = TextSectionizer(profile=True)
+        >>> for text in texts:
+        ...     sectionizer(text)
+        >>> sectionizer.profile.write_report("profile.txt")
+        >>> sectionizer.profile.dead_patterns()
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        "Remove all recorded values."
+        self.docs = 0
+        self._rows = dict()
+
+    @staticmethod
+    def key(section_title, pattern):
+        "Return the key of a pattern, which is passed to record and lose."
+        if not isinstance(pattern, str):
+            pattern = json.dumps(pattern, sort_keys=True)
+        return (section_title, pattern)
+
+    def _row(self, key):
+        try:
+            return self._rows[key]
+        except KeyError:
+            row = self._rows[key] = {
+                "hits": 0,
+                "seconds": 0.0,
+                "lost": dict.fromkeys(LOSS_STAGES, 0),
+            }
+            return row
+
+    def record(self, key, hits, seconds):
+        "Add the matches and time of one pattern in one doc."
+        row = self._row(key)
+        row["hits"] += hits
+        row["seconds"] += seconds
+
+    def lose(self, key, stage, n=1):
+        "Count matches of a pattern which were dropped at a stage."
+        self._row(key)["lost"][stage] += n
+
+    def add_doc(self):
+        self.docs += 1
+
+    def rows(self, sort_by="seconds"):
+        """Return a list of dicts with the section_title, pattern, hits, kept, lost and seconds
+        of each pattern, with the highest values of sort_by first.
+
+        Args:
+            sort_by (str): One of SORT_KEYS. "lost" sorts by the total number of matches lost.
+        """
+        if sort_by not in SORT_KEYS:
+            raise ValueError(
+                "sort_by must be one of {0}, not {1}".format(SORT_KEYS, sort_by)
+            )
+        rows = []
+        for ((section_title, pattern), row) in self._rows.items():
+            lost = sum(row["lost"].values())
+            rows.append(
+                {
+                    "section_title": section_title,
+                    "pattern": pattern,
+                    "hits": row["hits"],
+                    "kept": row["hits"] - lost,
+                    "lost": dict(row["lost"]),
+                    "seconds": row["seconds"],
+                }
+            )
+        if sort_by == "lost":
+            sort_key = lambda row: sum(row["lost"].values())
+        else:
+            sort_key = lambda row: row[sort_by]
+        return sorted(rows, key=sort_key, reverse=True)
+
+    def dead_patterns(self):
+        "Return a list of the (section_title, pattern) tuples of patterns which never matched."
+        return [
+            (row["section_title"], row["pattern"])
+            for row in self.rows()
+            if row["hits"] == 0
+        ]
+
+    def merge(self, other):
+        """Add the values of another PatternProfile, or of a dict returned by its to_dict method."""
+        if isinstance(other, PatternProfile):
+            other = other.to_dict()
+        self.docs += other["docs"]
+        for other_row in other["patterns"]:
+            key = (other_row["section_title"], other_row["pattern"])
+            row = self._row(key)
+            row["hits"] += other_row["hits"]
+            row["seconds"] += other_row["seconds"]
+            for stage, n in other_row["lost"].items():
+                row["lost"][stage] += n
+
+    def to_dict(self, sort_by="seconds"):
+        return {"docs": self.docs, "patterns": self.rows(sort_by)}
+
+    def to_json(self, sort_by="seconds", **kwargs):
+        "Return the profile as a JSON string. Keyword arguments are passed to json.dumps."
+        return json.dumps(self.to_dict(sort_by), **kwargs)
+
+    def report(self, sort_by="seconds", top=None):
+        """Return a table of the patterns ranked by sort_by, as a string.
+
+        Args:
+            sort_by (str): One of SORT_KEYS.
+            top (int or None): The number of patterns to include. Default None, which includes all of them.
+        """
+        rows = self.rows(sort_by)
+        if top is not None:
+            rows = rows[:top]
+        total_seconds = sum(row["seconds"] for row in self._rows.values())
+        lines = [
+            "{0} docs, {1} patterns, {2:.3f}s matching".format(
+                self.docs, len(self._rows), total_seconds
+            ),
+            "\t".join(
+                ("rank", "seconds", "hits", "kept")
+                + LOSS_STAGES
+                + ("section_title", "pattern")
+            ),
+        ]
+        for rank, row in enumerate(rows, start=1):
+            lines.append(
+                "\t".join(
+                    [str(rank), "{0:.6f}".format(row["seconds"]), str(row["hits"]), str(row["kept"])]
+                    + [str(row["lost"][stage]) for stage in LOSS_STAGES]
+                    + [str(row["section_title"]), row["pattern"]]
+                )
+            )
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path, sort_by="seconds", top=None):
+        """Write the report to a file. If the path ends with ".json", the rows are written as JSON
+        instead of a table."""
+        path = str(path)
+        with open(path, "w") as f:
+            if path.endswith(".json"):
+                rows = self.rows(sort_by)
+                if top is not None:
+                    rows = rows[:top]
+                json.dump({"docs": self.docs, "patterns": rows}, f, indent=2)
+            else:
+                f.write(self.report(sort_by, top))
+
+    def __repr__(self):
+        return "PatternProfile(docs={0}, patterns={1})".format(self.docs, len(self._rows))
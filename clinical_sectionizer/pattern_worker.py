@@ -0,0 +1,135 @@
+import re
+import threading
+import time
+import weakref
+
+from . import util
+
+
+class PatternWorker:
+    """Match a list of compiled regular expressions in a separate process, which is killed if it
+    doesn't finish by a deadline.
+
+    Python regular expressions can't be interrupted in the middle of a search, so a pattern which
+    backtracks catastrophically can only be stopped by stopping the process running it. The worker
+    process is started once and reused for every text. After it is killed, a new one is started
+    the next time a text is matched.
+
+    The process is forked when this is the only thread in the process. Otherwise, since forking
+    a process with running threads can deadlock, it is started with util.get_context(allow_fork=False).
+
+    A PatternWorker can be shared by several threads. Their calls are run one at a time, and the
+    time spent waiting for other calls isn't counted against the deadline. Copies made by pickle
+    start their own process.
+    """
+
+    def __init__(self, patterns, start_timeout=60.0):
+        """Create a new PatternWorker. The process is started by start, or by the first call to match.
+
+        Args:
+            patterns: A list of compiled regular expressions.
+            start_timeout (float): The number of seconds to wait for the process to start.
+        """
+        self._patterns = [(pattern.pattern, pattern.flags) for pattern in patterns]
+        self.start_timeout = start_timeout
+        self._lock = threading.Lock()
+        self._process = None
+        self._conn = None
+        self._finalizer = None
+
+    @property
+    def running(self):
+        return self._process is not None
+
+    def start(self):
+        "Start the worker process and wait until it is ready to match texts."
+        with self._lock:
+            self._start()
+
+    def stop(self):
+        "Kill the worker process, if it is running."
+        with self._lock:
+            self._stop()
+
+    def match(self, text, pos, deadline):
+        """Match each pattern against text, starting the search at index pos.
+
+        Args:
+            text (str): The text to match.
+            pos (int): The index to start the search at.
+            deadline (float): The time.perf_counter() value to stop at. The time spent starting
+                the process or waiting for other calls to finish is added to it.
+
+        Returns:
+            A list with a list of the (start, end) offsets of the matches of each pattern, as returned
+            by finditer. Patterns which weren't matched by the deadline are missing from the end of the list.
+        """
+        wait_start = time.perf_counter()
+        with self._lock:
+            self._start()
+            deadline += time.perf_counter() - wait_start
+            results = []
+            if deadline - time.perf_counter() <= 0:
+                return results
+            self._conn.send((text, pos))
+            while len(results) < len(self._patterns):
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining <= 0 or not self._conn.poll(remaining):
+                        self._stop()
+                        break
+                    results.append(self._conn.recv())
+                except (EOFError, OSError):
+                    # The process stopped unexpectedly
+                    self._stop()
+                    break
+            return results
+
+    def _start(self):
+        if self.running:
+            return
+        context = util.get_context(allow_fork=threading.active_count() == 1)
+        conn, child_conn = context.Pipe()
+        process = context.Process(target=_serve, args=(child_conn, self._patterns), daemon=True)
+        process.start()
+        child_conn.close()
+        if not conn.poll(self.start_timeout):
+            _stop_process(process, conn)
+            raise RuntimeError("The pattern worker process didn't start.")
+        conn.recv()
+        self._process = process
+        self._conn = conn
+        self._finalizer = weakref.finalize(self, _stop_process, process, conn)
+
+    def _stop(self):
+        if self.running:
+            self._finalizer()
+            self._process = None
+            self._conn = None
+            self._finalizer = None
+
+    def __getstate__(self):
+        return {"_patterns": self._patterns, "start_timeout": self.start_timeout}
+
+    def __setstate__(self, state):
+        self.__init__([], state["start_timeout"])
+        self._patterns = state["_patterns"]
+
+
+def _serve(conn, patterns):
+    compiled = [re.compile(pattern, flags) for (pattern, flags) in patterns]
+    try:
+        conn.send(None)
+        while True:
+            (text, pos) = conn.recv()
+            for pattern in compiled:
+                conn.send([match.span() for match in pattern.finditer(text, pos)])
+    except (EOFError, OSError):
+        # The parent closed its end of the pipe
+        return
+
+
+def _stop_process(process, conn):
+    conn.close()
+    process.kill()
+    process.join()
@@ -0,0 +1,96 @@
+import numpy
+from spacy.attrs import LOWER, NORM, ORTH
+
+# Token pattern keys which the prefilter can check, and the attribute they compare
+PREFILTER_ATTRS = {"ORTH": ORTH, "TEXT": ORTH, "LOWER": LOWER, "NORM": NORM}
+
+
+class HeaderPrefilter:
+    """Find the windows of a doc which could contain a match for a list of token patterns.
+
+    The possible values of the first token of each pattern are collected when the prefilter
+    is created. A match can only start at a token with one of these values, and can be at
+    most as long as the longest pattern, so running a Matcher over only these windows finds
+    the same matches as running it over the whole doc.
+
+    If any pattern can start with a token whose value can't be known in advance (for example
+    a wildcard, an optional first token, or a first token matched by a regular expression),
+    or can match an unlimited number of tokens, the prefilter is disabled and every doc is
+    one window.
+    """
+
+    def __init__(self, vocab, patterns):
+        """Create a new HeaderPrefilter.
+
+        Args:
+            vocab: The spaCy Vocab of the docs which will be filtered.
+            patterns: A list of spaCy Matcher patterns, each a list of token dicts.
+        """
+        self.enabled = True
+        self.max_length = 0
+        values = dict()
+        for pattern in patterns:
+            length = max_pattern_length(pattern)
+            first = _first_token_values(pattern)
+            if length is None or first is None:
+                self.enabled = False
+                break
+            self.max_length = max(self.max_length, length)
+            attr, strings = first
+            values.setdefault(attr, set()).update(vocab.strings.add(s) for s in strings)
+        self._attrs = sorted(values)
+        self._values = [
+            numpy.array(sorted(values[attr]), dtype="uint64") for attr in self._attrs
+        ]
+
+    def windows(self, doc):
+        """Return a list of non-overlapping (start, end) token offsets of the windows of doc
+        which can contain a match, sorted by start."""
+        if not self.enabled:
+            return [(0, len(doc))]
+        if len(doc) == 0 or not self._attrs:
+            return []
+        array = doc.to_array(self._attrs).reshape(len(doc), len(self._attrs))
+        mask = numpy.zeros(len(doc), dtype=bool)
+        for i, values in enumerate(self._values):
+            mask |= numpy.isin(array[:, i], values)
+        starts = numpy.flatnonzero(mask)
+        if len(starts) == 0:
+            return []
+        ends = numpy.minimum(starts + self.max_length, len(doc))
+        # Merge windows which overlap the previous one
+        new_window = numpy.ones(len(starts), dtype=bool)
+        new_window[1:] = starts[1:] >= ends[:-1]
+        window_starts = starts[new_window]
+        window_ends = numpy.append(ends[numpy.flatnonzero(new_window)[1:] - 1], ends[-1])
+        return list(zip(window_starts.tolist(), window_ends.tolist()))
+
+
+def _first_token_values(pattern):
+    # Return an (attr, strings) tuple for the possible values of the first token of a pattern,
+    # or None if they can't be known
+    if len(pattern) == 0:
+        return None
+    token = pattern[0]
+    if token.get("OP", "1") != "1":
+        return None
+    for key, attr in PREFILTER_ATTRS.items():
+        if key not in token:
+            continue
+        value = token[key]
+        if isinstance(value, str):
+            return (attr, [value])
+        if isinstance(value, dict) and list(value.keys()) == ["IN"]:
+            return (attr, value["IN"])
+    return None
+
+
+def max_pattern_length(pattern):
+    # Return the maximum number of tokens a pattern can match, or None if it is unlimited
+    length = 0
+    for token in pattern:
+        op = token.get("OP", "1")
+        if op in ("*", "+"):
+            return None
+        length += 1
+    return length
@@ -0,0 +1,206 @@
+from functools import lru_cache
+import re
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+from .literal_matcher import ANY_CHAR, _class_fragment
+
+# Repeats with a maximum count of at least this many are treated as unbounded
+LONG_REPEAT = 32
+
+# The characters which are tested to decide whether two character sets overlap
+_SAMPLE_CHARS = "".join(chr(i) for i in range(0x250)) + "  　﻿"
+
+# Repeats which backtrack. Possessive repeats and atomic groups don't.
+_BACKTRACKING_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+_ZERO_WIDTH = (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT)
+
+
+@lru_cache(maxsize=None)
+def lint_pattern(pattern):
+    """Find the parts of a compiled regular expression which can make it backtrack super-linearly,
+    so that matching it against some texts, such as long runs of whitespace, takes a very long time.
+    Results are cached, so patterns shared by several sectionizers are only checked once.
+
+    The checks are heuristics which look for the common causes of catastrophic backtracking:
+        - A repeat inside another repeat, such as "(\\s*\\w+)*", unless each repetition of the outer
+          repeat must contain a character which the inner repeats can't match, as in "(\\w+:)+".
+        - A repeat of an alternation whose branches can start with the same character, such as "(a|ab)*".
+        - Adjacent repeats which can match the same characters, such as "\\s*\\s*" or "\\s*.\\s*".
+
+    Returns:
+        A tuple of messages describing each problem, which is empty if none were found.
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return ()
+    problems = []
+    _check_sequence(list(parsed), pattern.flags, problems, in_repeat=False)
+    return tuple(dict.fromkeys(problems))
+
+
+def _check_sequence(items, flags, problems, in_repeat):
+    # The characters of the last unbounded repeat, which a following repeat could also match
+    open_chars = None
+    for (op, av) in items:
+        if op in _BACKTRACKING_REPEATS:
+            (min_count, max_count, body) = av
+            body = list(body)
+            chars = _single_char_set(body, flags)
+            if _is_long(max_count):
+                if chars is not None and open_chars is not None and open_chars & chars:
+                    problems.append(
+                        "adjacent repeats match the same characters, such as {0!r}".format(
+                            _describe(open_chars & chars)
+                        )
+                    )
+                # Every repeat nested inside the outermost one is checked with its body
+                if not in_repeat:
+                    _check_repeat_body(body, flags, problems)
+                _check_sequence(body, flags, problems, in_repeat=True)
+                if chars is not None:
+                    open_chars = chars if open_chars is None or min_count > 0 else open_chars | chars
+                else:
+                    open_chars = None
+                continue
+            _check_sequence(body, flags, problems, in_repeat)
+            if min_count == 0 or (chars is not None and open_chars is not None and chars & open_chars):
+                # Optional items, or items which can match the same characters as the open repeat, keep it open
+                continue
+            open_chars = None
+        elif op in _ZERO_WIDTH:
+            continue
+        elif op is sre_constants.SUBPATTERN:
+            _check_sequence(list(av[3]), flags, problems, in_repeat)
+            open_chars = None
+        elif op is sre_constants.BRANCH:
+            for branch in av[1]:
+                _check_sequence(list(branch), flags, problems, in_repeat)
+            open_chars = None
+        else:
+            chars = _char_set(op, av, flags)
+            if chars is not None and open_chars is not None and chars & open_chars:
+                # A single character between repeats, as in "\s*.\s*", doesn't separate them
+                continue
+            open_chars = None
+
+
+def _check_repeat_body(body, flags, problems):
+    # Check the body of a repeat which isn't nested in another repeat
+    inner_chars = set()
+    for (op, av) in _flatten(body):
+        if op in _BACKTRACKING_REPEATS and _is_long(av[1]):
+            chars = _single_char_set(list(av[2]), flags)
+            # Unknown characters could be anything
+            inner_chars |= chars if chars is not None else set(_SAMPLE_CHARS)
+    if inner_chars and not _has_separator(body, flags, inner_chars):
+        problems.append("a repeat is nested inside another repeat")
+
+    for (op, av) in _flatten(body):
+        if op is sre_constants.BRANCH:
+            firsts = [_first_chars(list(branch), flags) for branch in av[1]]
+            for i, chars in enumerate(firsts):
+                if chars is not None and any(
+                    other is not None and chars & other for other in firsts[i + 1 :]
+                ):
+                    problems.append(
+                        "a repeated alternation has branches which start with the same character"
+                    )
+                    break
+
+
+def _has_separator(body, flags, inner_chars):
+    # Whether each repetition must match a character which the inner repeats can't
+    for (op, av) in body:
+        if op is sre_constants.SUBPATTERN:
+            if _has_separator(list(av[3]), flags, inner_chars):
+                return True
+            continue
+        if op in _BACKTRACKING_REPEATS:
+            (min_count, _, repeat_body) = av
+            chars = _single_char_set(list(repeat_body), flags)
+        else:
+            min_count = 1
+            chars = _char_set(op, av, flags)
+        if min_count > 0 and chars is not None and not chars & inner_chars:
+            return True
+    return False
+
+
+def _flatten(items):
+    # Yield every item in a sequence and in the groups, branches and repeats inside it
+    for (op, av) in items:
+        yield (op, av)
+        if op is sre_constants.SUBPATTERN:
+            for item in _flatten(av[3]):
+                yield item
+        elif op is sre_constants.BRANCH:
+            for branch in av[1]:
+                for item in _flatten(branch):
+                    yield item
+        elif op in _BACKTRACKING_REPEATS:
+            for item in _flatten(av[2]):
+                yield item
+
+
+def _first_chars(items, flags):
+    for (op, av) in items:
+        if op in _ZERO_WIDTH:
+            continue
+        if op is sre_constants.SUBPATTERN:
+            return _first_chars(list(av[3]), flags)
+        if op in _BACKTRACKING_REPEATS:
+            if av[0] == 0:
+                return None
+            return _first_chars(list(av[2]), flags)
+        return _char_set(op, av, flags)
+    return None
+
+
+def _single_char_set(items, flags):
+    # The characters matched by a sequence which is a single character, such as "\s" or "[a-z]"
+    items = [(op, av) for (op, av) in items if op not in _ZERO_WIDTH]
+    if len(items) != 1:
+        return None
+    (op, av) = items[0]
+    if op is sre_constants.SUBPATTERN:
+        return _single_char_set(list(av[3]), flags)
+    return _char_set(op, av, flags)
+
+
+def _char_set(op, av, flags):
+    if op is sre_constants.LITERAL:
+        fragment = re.escape(chr(av))
+    elif op is sre_constants.NOT_LITERAL:
+        fragment = "[^{0}]".format(re.escape(chr(av)))
+    elif op is sre_constants.IN:
+        fragment = _class_fragment(av)
+    elif op is sre_constants.ANY:
+        fragment = ANY_CHAR if flags & re.DOTALL else "."
+    else:
+        return None
+    return _sample_matches(fragment, flags)
+
+
+@lru_cache(maxsize=None)
+def _sample_matches(fragment, flags):
+    # Characters of the sample are used rather than every code point, which is enough to
+    # tell whether two character sets overlap in practice
+    return frozenset(re.findall(fragment, _SAMPLE_CHARS, flags))
+
+
+def _is_long(max_count):
+    return max_count >= LONG_REPEAT
+
+
+def _describe(chars):
+    for char in " a0:":
+        if char in chars:
+            return char
+    return min(chars)
@@ -0,0 +1,180 @@
+from bisect import bisect_right
+
+from spacy.tokens import Span
+from spacy.util import minibatch
+
+from .doc_sections import set_doc_sections
+
+
+class SectionFilter:
+    """Run a downstream pipeline component only over the sections of a doc with some titles.
+
+    The Sectionizer must run before this component. For each doc, the token ranges of the
+    selected sections are found (with neighboring selected sections joined into one range), and
+    each range is copied into a new Doc with Span.as_doc and processed by the component. The
+    results are then merged back into the original doc:
+        - Entities found in a range replace the entities which were in that range.
+          Entities outside of every range are kept.
+        - Span and Token extension values set by the component are copied to the same text
+          in the original doc. Doc extension values are not copied.
+        - The token attributes in attrs, such as "TAG" or "LEMMA", are copied.
+    The copy of each range has the sections of the range, so the component can use them.
+
+    Example:
+        >>> nlp = spacy.load("en_core_web_sm")
+        >>> (_, ner) = nlp.remove_pipe("ner")
+        >>> nlp.add_pipe(Sectionizer(nlp))
+        >>> nlp.add_pipe(SectionFilter(ner, sections=["medications", "problem_list"]))
+    """
+
+    name = "section_filter"
+
+    def __init__(self, component, sections=None, exclude=None, attrs=None, batch_size=50):
+        """Create a new SectionFilter.
+
+        Args:
+            component: The pipeline component to run, which takes and returns a Doc. If it has
+                a pipe method, it is used to process the ranges of a batch of docs together.
+            sections (list or None): The section titles to process. None is the title of text which isn't
+                in a section, such as text before the first header.
+            exclude (list or None): The section titles not to process, if sections is None. All other
+                sections are processed.
+            attrs (list or None): Token attributes set by the component, such as "TAG" and "LEMMA",
+                to copy back to the original doc. Default None.
+            batch_size (int): The number of docs whose ranges are processed together by pipe.
+        """
+        if (sections is None) == (exclude is None):
+            raise ValueError("Exactly one of sections or exclude must be given.")
+        self.component = component
+        self.sections = set(sections) if sections is not None else None
+        self.exclude = set(exclude) if exclude is not None else None
+        self.attrs = list(attrs) if attrs else []
+        self.batch_size = batch_size
+        self.name = getattr(component, "name", self.name)
+
+    def is_selected(self, section_title):
+        if self.sections is not None:
+            return section_title in self.sections
+        return section_title not in self.exclude
+
+    def get_ranges(self, doc):
+        """Return a list of the (start, end) token offsets of the ranges of doc to process."""
+        sections = doc._.sections
+        if len(sections) == 0:
+            raise ValueError(
+                "The sections of the doc have not been set. The Sectionizer must run before the SectionFilter."
+            )
+        # Tokens after the max_scope of a section have no title
+        parts = []
+        prev_end = 0
+        for (title, _, _, _, start, end) in sections.to_offsets():
+            if start > prev_end:
+                parts.append((prev_end, start, None))
+            parts.append((start, end, title))
+            prev_end = end
+        if prev_end < len(doc):
+            parts.append((prev_end, len(doc), None))
+
+        ranges = []
+        for (start, end, title) in parts:
+            if start == end or not self.is_selected(title):
+                continue
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return ranges
+
+    def __call__(self, doc):
+        for doc in self.pipe([doc], batch_size=1):
+            return doc
+
+    def pipe(self, docs, batch_size=None):
+        """Process a stream of docs, yielding them in order."""
+        if batch_size is None:
+            batch_size = self.batch_size
+        for batch in minibatch(docs, size=batch_size):
+            subdocs = []
+            # The (doc, start, end) of each subdoc
+            owners = []
+            for doc in batch:
+                ranges = self.get_ranges(doc)
+                if ranges == [(0, len(doc))]:
+                    # The whole doc is processed, so there is nothing to merge
+                    subdocs.append(doc)
+                    owners.append((doc, None, None))
+                    continue
+                for (start, end) in ranges:
+                    subdocs.append(_range_as_doc(doc, start, end))
+                    owners.append((doc, start, end))
+
+            if hasattr(self.component, "pipe"):
+                processed = list(self.component.pipe(subdocs, batch_size=batch_size))
+            else:
+                processed = [self.component(subdoc) for subdoc in subdocs]
+
+            merged = dict()
+            for (doc, start, end), subdoc in zip(owners, processed):
+                if start is not None:
+                    merged.setdefault(id(doc), (doc, []))[1].append((start, end, subdoc))
+            for (doc, results) in merged.values():
+                self._merge(doc, results)
+            for doc in batch:
+                yield doc
+
+    def _merge(self, doc, results):
+        ranges = [(start, end) for (start, end, _) in results]
+        range_starts = [start for (start, _) in ranges]
+        ents = [
+            ent for ent in doc.ents if not _overlaps_any(ent.start, ent.end, ranges, range_starts)
+        ]
+        if self.attrs:
+            array = doc.to_array(self.attrs)
+        for (start, end, subdoc) in results:
+            char_offset = doc[start].idx
+            for ent in subdoc.ents:
+                ents.append(
+                    Span(doc, ent.start + start, ent.end + start, label=ent.label, kb_id=ent.kb_id)
+                )
+            for (key, value) in subdoc.user_data.items():
+                # Span and Token extension values are keyed by their character offsets
+                if not (isinstance(key, tuple) and len(key) == 4 and key[0] == "._."):
+                    continue
+                (_, name, start_char, end_char) = key
+                if start_char is None:
+                    continue
+                if end_char is not None:
+                    end_char += char_offset
+                doc.user_data[("._.", name, start_char + char_offset, end_char)] = value
+            if self.attrs:
+                array[start:end] = subdoc.to_array(self.attrs)
+        if self.attrs:
+            doc.from_array(self.attrs, array)
+        doc.ents = sorted(ents, key=lambda ent: ent.start)
+
+
+def _range_as_doc(doc, start, end):
+    # Copy a range of a doc into a new Doc with the sections of the range. Ranges start and
+    # end at section boundaries, so each section is either inside the range or outside of it.
+    subdoc = doc[start:end].as_doc()
+    sections = []
+    for (title, header_start, header_end, parent, section_start, section_end) in doc._.sections.to_offsets():
+        if section_start < start or section_end > end:
+            continue
+        if header_start >= 0:
+            header_start -= start
+            header_end -= start
+        sections.append(
+            (title, header_start, header_end, parent, section_start - start, section_end - start)
+        )
+    if len(sections) == 0:
+        set_doc_sections(subdoc, [(None, -1, -1, None, 0, len(subdoc))], token_sections=False)
+    else:
+        set_doc_sections(subdoc, sections, token_sections=doc._.sections._token_sections)
+    return subdoc
+
+
+def _overlaps_any(start, end, ranges, range_starts):
+    # The ranges are sorted and don't overlap, so only the last range starting before end can overlap
+    i = bisect_right(range_starts, end - 1) - 1
+    return i >= 0 and ranges[i][1] > start
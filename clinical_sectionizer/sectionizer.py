@@ -1,15 +1,40 @@
 from spacy.tokens import Doc, Token, Span
 from spacy.matcher import Matcher, PhraseMatcher
+from spacy.attrs import IDX
+from spacy.util import ensure_path, minibatch
+import srsly
 
 # Filepath to default rules which are included in package
 from os import path
 from pathlib import Path
 import re
+import time
 import warnings
 
+import numpy
+
 from . import util
+from .doc_sections import (
+    Section,
+    get_doc_sections,
+    get_section_candidates,
+    set_doc_sections,
+    set_doc_sections_from_tuples,
+    set_section_candidates,
+)
+from .cache import make_key
+from .prefilter import HeaderPrefilter, max_pattern_length
+from .stats import SectionizerStats, NULL_STATS
+from .pattern_profile import PatternProfile
+from .text_sectionizer import (
+    DEFAULT_RULES_FILEPATH as TEXT_RULES_FILEPATH,
+    TextSectionizer,
+    compile_pattern,
+)
 
-Doc.set_extension("sections", default=list(), force=True)
+Doc.set_extension(
+    "sections", getter=get_doc_sections, setter=set_doc_sections_from_tuples, force=True
+)
 Doc.set_extension("section_titles", getter=util.get_section_titles, force=True)
 Doc.set_extension(
     "section_headers", getter=util.get_section_headers, force=True
@@ -19,10 +44,26 @@ Doc.set_extension(
     "section_parents", getter=util.get_section_parents, force=True
 )
 
-Token.set_extension("section_span", default=None, force=True)
-Token.set_extension("section_title", default=None, force=True)
-Token.set_extension("section_header", default=None, force=True)
-Token.set_extension("section_parent", default=None, force=True)
+# The header matches of a doc before overlapping matches were pruned, used by Sectionizer.update
+Doc.set_extension(
+    "section_candidates",
+    getter=get_section_candidates,
+    setter=set_section_candidates,
+    force=True,
+)
+
+Token.set_extension(
+    "section_span", getter=util.get_token_section_span, force=True
+)
+Token.set_extension(
+    "section_title", getter=util.get_token_section_title, force=True
+)
+Token.set_extension(
+    "section_header", getter=util.get_token_section_header, force=True
+)
+Token.set_extension(
+    "section_parent", getter=util.get_token_section_parent, force=True
+)
 
 # Set span attributes to the attribute of the first token
 # in case there is some overlap between a span and a new section header
@@ -36,7 +77,7 @@ Span.set_extension(
     "section_header", getter=lambda x: x[0]._.section_header, force=True
 )
 Span.set_extension(
-    "section_parent", getter=lambda x: x[0]._.section_header, force=True
+    "section_parent", getter=lambda x: x[0]._.section_parent, force=True
 )
 
 DEFAULT_RULES_FILEPATH = path.join(
@@ -53,11 +94,6 @@ DEFAULT_ATTRS = {
     "education": {"is_hypothetical": True},
     "allergy": {"is_hypothetical": True},
 }
-from collections import namedtuple
-Section = namedtuple("Section", field_names=["section_title",
-                                            "section_header",
-                                            "section_parent",
-                                            "section_span"])
 
 
 class Sectionizer:
@@ -73,6 +109,13 @@ class Sectionizer:
         require_start_line=False,
         require_end_line=False,
         newline_pattern=r"[\n\r]+[\s]*$",
+        prune_strategy="longest",
+        stats=False,
+        cache=None,
+        prefilter=False,
+        engine="token",
+        profile=False,
+        keep_candidates=False,
     ):
         """Create a new Sectionizer component. The sectionizer will search for spans in the text which
         match section header patterns, such as 'Past Medical History:'. Sections will be represented
@@ -85,12 +128,14 @@ class Sectionizer:
                 scope. Example: 'Past Medical History: Type II DM'
 
         Section attributes will be registered for each Doc, Span, and Token in the following attributes:
-            Doc._.sections: A list of namedtuples of type Section with 4 elements:
+            Doc._.sections: A sequence of namedtuples of type Section with 4 elements:
                 - section_title
                 - section_header
                 - section_parent
                 - section_span.
-            A Doc will also have attributes corresponding to lists of each
+                The sections are stored in Doc.user_data as integer offsets, and the sequence
+                (a DocSections) creates the Section tuples when they are accessed.
+            A Doc will also have attributes corresponding to sequences of each
                 (ie., Doc._.section_titles, Doc._.section_headers, Doc._.section_parents, Doc._.section_spans)
             (Span|Token)._.section_title
             (Span|Token)._.section_header
@@ -107,6 +152,8 @@ class Sectionizer:
                         {"section_title": "problem_list", "pattern": [{"TEXT": "PROBLEM"}, {"TEXT": "LIST"}, {"TEXT": ":"}]}
                     ]
                 If a string other than "default", should be a path to a jsonl file containing patterns.
+                If engine is "text", string patterns are regular expressions, the default patterns are those of
+                the TextSectionizer, and the path can also be a json file read with TextSectionizer.load_patterns_from_json.
             max_scope (None or int): Optional argument specifying the maximum number of tokens following a section header
                 which can be included in a section. This can be useful if you think your section patterns are incomplete
                 and want to prevent sections from running too long in the note. Default is None, meaning that the scope
@@ -117,22 +164,85 @@ class Sectionizer:
             require_end_line (bool): Optionally require a section header to end with a new line. Default False.
             newline_pattern (str): Regular expression to match the new line either preceding or following a header
                 if either require_start_line or require_end_line are True.
+            prune_strategy (str): How to choose between overlapping section headers. Either "longest" (default),
+                "first", or "priority". "priority" keeps the header whose section title has the highest
+                optional "priority" value in its pattern dicts. See prune_overlapping_matches.
+            stats (bool or SectionizerStats): Whether to record the time spent in each stage of sectionizing
+                and the number of matches and sections found. If True, a new SectionizerStats is created,
+                which is available as Sectionizer.stats. A SectionizerStats can also be passed to share it
+                between several sectionizers. Default False, which records nothing.
+            cache (MemoryCache, SqliteCache or None): Optional cache of the section headers found in each doc,
+                keyed by a hash of the doc's text and tokenization, the patterns and the matching settings.
+                Docs which have already been sectionized with the same patterns are not matched again.
+                Default None.
+            prefilter (bool): Whether to run the token pattern Matcher only on the windows of a doc
+                which start with a token that can begin one of the token patterns. This finds the
+                same matches as matching the whole doc. If the token patterns don't allow it
+                (see HeaderPrefilter), the whole doc is matched. Default False.
+            engine (str): How string patterns are matched. "token" (default) matches them as phrases of tokens
+                with the PhraseMatcher. "text" treats them as regular expressions, as in the TextSectionizer,
+                which are matched on doc.text and then aligned to the tokens they overlap. Token patterns
+                are matched with the Matcher in both cases.
+            profile (bool or PatternProfile): Whether to record the matches of each pattern, the matches of each
+                pattern which are dropped before they become sections, and the time spent matching it. If True,
+                a new PatternProfile is created, which is available as Sectionizer.profile. While profiling, each
+                pattern is also matched on its own to time it and attribute matches to it, which is slower. The
+                sections are still found by the usual matchers, so they don't change. Docs found in the
+                cache are not profiled. Default False.
+            keep_candidates (bool): Whether to store the header matches found before overlapping headers are
+                pruned in Doc._.section_candidates, which update uses to only match again around an edit.
+                Default False, which keeps docs smaller; update then sectionizes the whole edited doc.
         """
         self.nlp = nlp
         self.add_attrs = add_attrs
         self.matcher = Matcher(nlp.vocab)
         self.max_scope = max_scope
+        self.phrase_matcher_attr = phrase_matcher_attr
         self.phrase_matcher = PhraseMatcher(
             nlp.vocab, attr=phrase_matcher_attr
         )
         self.require_start_line = require_start_line
         self.require_end_line = require_end_line
         self.newline_pattern = re.compile(newline_pattern)
+        if prune_strategy not in PRUNE_STRATEGIES:
+            raise ValueError(
+                "prune_strategy must be one of {0}, not {1}".format(
+                    PRUNE_STRATEGIES, prune_strategy
+                )
+            )
+        self.prune_strategy = prune_strategy
+        if engine not in ("token", "text"):
+            raise ValueError(
+                "engine must be either 'token' or 'text', not {0}".format(engine)
+            )
+        self.engine = engine
+        # The regular expressions matched on the doc text by the text engine
+        self._text_matcher = (
+            TextSectionizer(patterns=None, engine="combined") if engine == "text" else None
+        )
+        if stats is True:
+            stats = SectionizerStats()
+        elif stats is False:
+            stats = None
+        self.stats = stats
+        if profile is True:
+            profile = PatternProfile()
+        elif profile is False:
+            profile = None
+        self.profile = profile
+        self._profile_matchers = None
+        self.keep_candidates = keep_candidates
+        self.cache = cache
+        self._patterns_fingerprint = None
+        self.prefilter = prefilter
+        self._prefilter = None
+        self._max_header_length = None
         self.assertion_attributes_mapping = None
         self._patterns = []
         self._section_titles = set()
         self._parent_sections = {}
         self._parent_required = {}
+        self._match_priorities = {}
 
         if patterns is not None:
             if patterns == "default":
@@ -144,7 +254,10 @@ class Sectionizer:
                         "add patterns manually or add a jsonl file to the following location: ",
                         DEFAULT_RULES_FILEPATH,
                     )
-                self.add(self.load_patterns_from_jsonl(DEFAULT_RULES_FILEPATH))
+                if self.engine == "text":
+                    self.add(self.load_patterns_from_jsonl(TEXT_RULES_FILEPATH))
+                else:
+                    self.add(self.load_patterns_from_jsonl(DEFAULT_RULES_FILEPATH))
             # If a list, add each of the patterns in the list
             elif isinstance(patterns, list):
                 self.add(patterns)
@@ -152,7 +265,10 @@ class Sectionizer:
                 import os
 
                 assert os.path.exists(patterns)
-                self.add(self.load_patterns_from_jsonl(patterns))
+                if self.engine == "text" and patterns.endswith(".json"):
+                    self.add(TextSectionizer.load_patterns_from_json(patterns))
+                else:
+                    self.add(self.load_patterns_from_jsonl(patterns))
 
         if add_attrs is False:
             self.add_attrs = False
@@ -222,6 +338,8 @@ class Sectionizer:
            'pattern': The spaCy pattern matching a span of text.
                Either a string for exact matching (case insensitive)
                or a list of dicts.
+           'priority' (optional): A number used to choose between overlapping headers
+               if prune_strategy is "priority". Higher values take precedence.
 
        Example:
        >>> patterns = [ \
@@ -233,7 +351,11 @@ class Sectionizer:
            {"section_title": "assessment_and_plan", "pattern": "a/p:"}\
            ]
        >>> clinical_sectionizer.add(patterns)
+
+       If the engine is "text", string patterns are regular expressions.
        """
+        # Regular expressions are added to the text matcher together, so that it is only rebuilt once
+        text_patterns = []
         for pattern_dict in patterns:
             name = pattern_dict["section_title"]
             pattern = pattern_dict["pattern"]
@@ -251,12 +373,27 @@ class Sectionizer:
                     )
                 parent_required = pattern_dict["parent_required"]
 
-            if isinstance(pattern, str):
+            if isinstance(pattern, str) and self.engine == "text":
+                # The matchers add the other titles, and matches are found by their hash in other processes
+                self.nlp.vocab.strings.add(name)
+                text_patterns.append(pattern_dict)
+            elif isinstance(pattern, str):
                 self.phrase_matcher.add(name, None, self.nlp.make_doc(pattern))
             else:
                 self.matcher.add(name, [pattern])
             self._patterns.append(pattern_dict)
             self._section_titles.add(name)
+            self._patterns_fingerprint = None
+            self._prefilter = None
+            self._max_header_length = None
+            self._profile_matchers = None
+
+            if "priority" in pattern_dict.keys():
+                match_id = self.nlp.vocab.strings[name]
+                self._match_priorities[match_id] = max(
+                    pattern_dict["priority"],
+                    self._match_priorities.get(match_id, pattern_dict["priority"]),
+                )
 
             if name in self._parent_sections.keys() and parents != []:
                 warnings.warn(
@@ -282,142 +419,494 @@ class Sectionizer:
                 self._parent_required[name] = False
             else:
                 self._parent_required[name] = parent_required
+        if text_patterns:
+            self._text_matcher.add(text_patterns)
 
     def set_parent_sections(self, sections):
         """Determine the legal parent-child section relationships from the list
         of in-order sections of a document and the possible parents of each
         section as specified during rule creation.
 
+        A section can be the parent of a new section if it is reachable by walking
+        backwards from the previous section through its siblings and ancestors.
+        The titles reachable from each section are kept as it is added, so that
+        finding the parent of a section does not walk back through the document.
+
         Args:
             sections: a list of spacy match tuples found in the doc
         """
         sections_final = []
-        removed_sections = 0
-        for i, (match_id, start, end) in enumerate(sections):
+        # The section title and the titles reachable from each section in sections_final
+        final_titles = []
+        reachable_titles = []
+        for (match_id, start, end) in sections:
             name = self.nlp.vocab.strings[match_id]
             required = self._parent_required[name]
-            i_a = i - removed_sections  # adjusted index for removed values
-            if required and i_a == 0:
-                removed_sections += 1
+            identified_parent = None
+            if final_titles:
+                reachable = reachable_titles[-1]
+                # if multiple parents are reachable, the last one in the set is used
+                for parent in self._parent_sections.get(name, ()):
+                    if parent in reachable:
+                        identified_parent = parent
+            # if parent is not identified and required, do not add the section
+            if required and identified_parent is None:
                 continue
-            elif i_a == 0 or name not in self._parent_sections.keys():
-                sections_final.append((match_id, start, end, None))
+            sections_final.append((match_id, start, end, identified_parent))
+
+            # The previous section is reachable from this one if it is this section's parent
+            # or a sibling of it
+            if identified_parent is not None and (
+                final_titles[-1] == identified_parent
+                or sections_final[-2][3] == identified_parent
+            ):
+                reachable = reachable_titles[-1]
+                if name not in reachable:
+                    reachable = reachable | {name}
             else:
-                parents = self._parent_sections[name]
-                identified_parent = None
-                for parent in parents:
-                    # go backwards through the section "tree" until you hit a root or the start of the list
-                    candidate = self.nlp.vocab.strings[
-                        sections_final[i_a - 1][0]
-                    ]
-                    candidates_parent = sections_final[i_a - 1][3]
-                    candidate_i = i_a - 1
-                    while candidate:
-                        if candidate == parent:
-                            identified_parent = parent
-                            candidate = None
-                        else:
-                            # if you are at the end of the list... no parent
-                            if candidate_i < 1:
-                                candidate = None
-                                continue
-                            # if the current candidate has no parent... no parent exists
-                            if not candidates_parent:
-                                candidate = None
-                                continue
-                            # otherwise get the previous item in the list
-                            temp = self.nlp.vocab.strings[
-                                sections_final[candidate_i - 1][0]
-                            ]
-                            temp_parent = sections_final[candidate_i - 1][3]
-                            # if the previous item is the parent of the current item
-                            # OR if the previous item is a sibling of the current item
-                            # continue to search
-                            if (
-                                temp == candidates_parent
-                                or temp_parent == candidates_parent
-                            ):
-                                candidate = temp
-                                candidates_parent = temp_parent
-                                candidate_i -= 1
-                            # otherwise, there is no further tree traversal
-                            else:
-                                candidate = None
-
-                # if a parent is required, then add
-                if identified_parent or not required:
-                    # if the parent is identified, add section
-                    # if the parent is not required, add section
-                    # if parent is not identified and required, do not add the section
-                    sections_final.append(
-                        (match_id, start, end, identified_parent)
-                    )
-                else:
-                    removed_sections += 1
+                reachable = frozenset([name])
+            final_titles.append(name)
+            reachable_titles.append(reachable)
         return sections_final
 
     def set_assertion_attributes(self, ents):
         """Add Span-level attributes to entities based on which section they occur in.
 
-        Args:
-            edges: the edges to modify
+        Spans are assigned to sections in one pass over the sorted spans and the sections of the doc,
+        rather than looking up the section of each span's first token separately.
 
+        Args:
+            ents: The spans to modify, such as doc.ents or any other list of spans from the same doc.
         """
-        for ent in ents:
-            if ent._.section_title in self.assertion_attributes_mapping:
-                attr_dict = self.assertion_attributes_mapping[
-                    ent._.section_title
-                ]
-                for (attr_name, attr_value) in attr_dict.items():
-                    setattr(ent._, attr_name, attr_value)
+        spans = list(ents)
+        if len(spans) == 0:
+            return
+        sections = spans[0].doc._.sections
+        # The attributes to set for each section, and for spans which aren't in a section
+        section_attrs = [
+            self.assertion_attributes_mapping.get(title) for title in sections.titles
+        ]
+        no_section_attrs = self.assertion_attributes_mapping.get(None)
+
+        spans_by_attrs = dict()
+        for span, i in zip(spans, sections.token_sections([span.start for span in spans])):
+            attr_dict = section_attrs[i] if i is not None else no_section_attrs
+            if attr_dict:
+                spans_by_attrs.setdefault(id(attr_dict), (attr_dict, []))[1].append(span)
+
+        for (attr_dict, attr_spans) in spans_by_attrs.values():
+            for (attr_name, attr_value) in attr_dict.items():
+                for span in attr_spans:
+                    setattr(span._, attr_name, attr_value)
 
     def __call__(self, doc):
-        matches = self.matcher(doc)
-        matches += self.phrase_matcher(doc)
+        matches = self.get_section_matches(doc)
+        self.set_sections(doc, matches)
+        return doc
+
+    def pipe(self, docs, batch_size=50, n_process=1):
+        """Sectionize a stream of docs, yielding them in order.
+
+        Args:
+            docs: An iterable of spaCy Docs.
+            batch_size (int): The number of docs to process together.
+            n_process (int): The number of worker processes to match with. Workers receive
+                a copy of this sectionizer once when they start, and docs are sent to them
+                in batches. Sections are then set on the original docs in this process.
+                -1 will use one process per CPU.
+        """
+        if n_process == 1:
+            for batch in minibatch(docs, size=batch_size):
+                for doc in batch:
+                    yield self(doc)
+            return
+
+        # Workers record stats for each batch separately, which are added to the stats here
+        payloads = (
+            (batch, [doc.to_bytes(exclude=["tensor", "user_data"]) for doc in batch])
+            for batch in minibatch(docs, size=batch_size)
+        )
+        for batch, (batch_matches, batch_stats, batch_profile) in util.map_batches(
+            self, "_match_batch", payloads, n_process
+        ):
+            if batch_stats is not None:
+                self.stats.merge(batch_stats)
+            if batch_profile is not None:
+                self.profile.merge(batch_profile)
+            for doc, matches in zip(batch, batch_matches):
+                self.set_sections(doc, matches)
+                yield doc
+
+    def _match_batch(self, docs_bytes):
+        if self.stats is not None:
+            self.stats.reset()
+        if self.profile is not None:
+            self.profile.reset()
+        batch_matches = [
+            self.get_section_matches(Doc(self.nlp.vocab).from_bytes(doc_bytes))
+            for doc_bytes in docs_bytes
+        ]
+        batch_stats = self.stats.to_dict() if self.stats is not None else None
+        batch_profile = self.profile.to_dict() if self.profile is not None else None
+        return batch_matches, batch_stats, batch_profile
+
+    def get_section_matches(self, doc):
+        """Find the section headers in a doc.
+
+        Args:
+            doc: a spaCy Doc
+
+        Returns:
+            A list of (match_id, start, end, parent) tuples for each section header in the doc,
+            sorted by their position in the doc.
+        """
+        stats = self.stats if self.stats is not None else NULL_STATS
+        if self.cache is None:
+            return self._find_section_matches(doc, stats)
+
+        key = self._cache_key(doc)
+        cached = self.cache.get(key)
+        if cached is not None:
+            stats.count("cache_hits", 1)
+            return [
+                (self.nlp.vocab.strings.add(name), start, end, parent)
+                for (name, start, end, parent) in cached
+            ]
+        stats.count("cache_misses", 1)
+        matches = self._find_section_matches(doc, stats)
+        self.cache.set(
+            key,
+            [
+                (self.nlp.vocab.strings[match_id], start, end, parent)
+                for (match_id, start, end, parent) in matches
+            ],
+        )
+        return matches
+
+    def _find_section_matches(self, doc, stats):
+        with stats.timer("matching"):
+            matches = self._match_token_patterns(doc)
+            # An empty matcher still iterates over the doc
+            if len(self.phrase_matcher):
+                matches += self.phrase_matcher(doc)
+            if self.engine == "text":
+                matches += self._match_text_patterns(doc)
+        # The profile key of the pattern which found each remaining match, while profiling.
+        # The matches themselves always come from the matchers above, so profiling doesn't change them.
+        match_keys = None
+        if self.profile is not None:
+            match_keys = self._profile_patterns(doc)
+        stats.count("matches", len(matches))
+        if self.require_start_line or self.require_end_line:
+            with stats.timer("line_filters"):
+                line_boundaries = util.LineBoundaries(doc, self.newline_pattern)
+                if self.require_start_line:
+                    matches = self.filter_start_lines(doc, matches, line_boundaries)
+                if self.require_end_line:
+                    matches = self.filter_end_lines(doc, matches, line_boundaries)
+            if match_keys is not None:
+                self._profile_losses(matches, match_keys, "line_filters")
+        stats.count("matches_after_line_filters", len(matches))
+        if self.keep_candidates:
+            doc._.section_candidates = matches
+        with stats.timer("pruning"):
+            matches = prune_overlapping_matches(
+                matches, strategy=self.prune_strategy, priorities=self._match_priorities
+            )
+        if match_keys is not None:
+            self._profile_losses(matches, match_keys, "overlap")
+        stats.count("matches_after_pruning", len(matches))
+        with stats.timer("parents"):
+            matches = self.set_parent_sections(matches)
+        if match_keys is not None:
+            self._profile_losses(matches, match_keys, "parents")
+        stats.count("matches_after_parents", len(matches))
+        return matches
+
+    def _get_profile_matchers(self):
+        # A (profile key, match function) tuple for each pattern, where the function takes a doc and
+        # its text and returns the (start, end) token offsets of the matches of the pattern
+        if self._profile_matchers is not None:
+            return self._profile_matchers
+        self._profile_matchers = []
+        for pattern_dict in self._patterns:
+            name = pattern_dict["section_title"]
+            pattern = pattern_dict["pattern"]
+            if isinstance(pattern, str) and self.engine == "text":
+                match_pattern = self._profile_text_pattern(compile_pattern(pattern, re.I))
+            elif isinstance(pattern, str):
+                matcher = PhraseMatcher(self.nlp.vocab, attr=self.phrase_matcher_attr)
+                matcher.add(name, None, self.nlp.make_doc(pattern))
+                match_pattern = self._profile_token_pattern(matcher)
+            else:
+                matcher = Matcher(self.nlp.vocab)
+                matcher.add(name, [pattern])
+                match_pattern = self._profile_token_pattern(matcher)
+            self._profile_matchers.append(
+                (name, PatternProfile.key(name, pattern), match_pattern)
+            )
+        return self._profile_matchers
+
+    @staticmethod
+    def _profile_token_pattern(matcher):
+        def match_pattern(doc, text):
+            return [(start, end) for (_, start, end) in matcher(doc)]
+
+        return match_pattern
+
+    @staticmethod
+    def _profile_text_pattern(compiled):
+        def match_pattern(doc, text):
+            spans = [match.span() for match in compiled.finditer(text)]
+            return [span for span in util.align_char_spans(doc, spans) if span is not None]
+
+        return match_pattern
+
+    def _profile_patterns(self, doc):
+        # Match each pattern on its own to time it. Returns a dict mapping each (match_id, start, end)
+        # match to the profile key of the first pattern which found it, in the order patterns were added.
+        profile = self.profile
+        text = doc.text if self.engine == "text" else None
+        match_keys = dict()
+        for (name, key, match_pattern) in self._get_profile_matchers():
+            start_time = time.perf_counter()
+            spans = match_pattern(doc, text)
+            profile.record(key, len(spans), time.perf_counter() - start_time)
+            match_id = self.nlp.vocab.strings.add(name)
+            for (start, end) in spans:
+                match = (match_id, start, end)
+                if match in match_keys:
+                    profile.lose(key, "duplicate")
+                    continue
+                match_keys[match] = key
+        profile.add_doc()
+        return match_keys
+
+    def _profile_losses(self, matches, match_keys, stage):
+        # Count the matches which were dropped at a stage against their patterns
+        remaining = set(match[:3] for match in matches)
+        for match in list(match_keys):
+            if match not in remaining:
+                self.profile.lose(match_keys.pop(match), stage)
+
+    def update(self, doc, start_char, end_char, replacement, new_doc=None):
+        """Sectionize an edited version of a doc which has already been sectionized. Section headers
+        are only matched again in a window of tokens around the edit. Headers found in the rest of
+        the doc are reused from the previous result, and overlapping headers and parents are then
+        resolved again, giving the same sections as calling the sectionizer on the new doc.
+
+        The previous headers are only stored if the sectionizer was created with keep_candidates=True.
+        If they aren't available (for example if keep_candidates is False, or doc was sectionized by a
+        worker process or came from the cache), or a token pattern can match an unlimited number of
+        tokens, the whole new doc is sectionized.
+
+        Args:
+            doc: A spaCy Doc which was processed by this sectionizer.
+            start_char (int): The start of the edited text in doc.text.
+            end_char (int): The end of the edited text in doc.text.
+            replacement (str): The text which replaces doc.text[start_char:end_char].
+            new_doc: Optionally, the Doc of the edited text. If None, it is created with nlp.make_doc.
+                Creating the Doc from the edited text directly is faster for long docs, since
+                doc.text doesn't need to be joined from the tokens.
+
+        Returns:
+            The new Doc, with its sections set.
+        """
+        delta = len(replacement) - (end_char - start_char)
+        if new_doc is None:
+            text = doc.text
+            new_doc = self.nlp.make_doc(text[:start_char] + replacement + text[end_char:])
+        elif _text_length(new_doc) != _text_length(doc) + delta:
+            raise ValueError("new_doc must contain the text of doc with the edit applied.")
+
+        candidates = doc._.section_candidates if self.keep_candidates else None
+        max_length = self._get_max_header_length()
+        if candidates is None or max_length is None or len(doc) == 0 or len(new_doc) == 0:
+            return self(new_doc)
+
+        # Tokenization can only change within the whitespace separated chunks touching the edit
+        new_offsets = new_doc.to_array([IDX]).reshape(-1)
+        first = max(int(numpy.searchsorted(new_offsets, start_char, "right")) - 1, 0)
+        while first > 0 and new_doc[first - 1].whitespace_ == "" and not new_doc[first - 1].is_space:
+            first -= 1
+        last = int(numpy.searchsorted(new_offsets, start_char + len(replacement), "left"))
+        while (
+            0 < last < len(new_doc)
+            and new_doc[last - 1].whitespace_ == ""
+            and not new_doc[last].is_space
+        ):
+            last += 1
+
+        # Headers can only be changed by the edit if they are within a header length of these tokens
+        margin = max_length + 2
+        window_start = max(first - margin, 0)
+        window_end = min(last + margin, len(new_doc))
+
+        # Tokens before the window are the same in both docs, and tokens after it are shifted
+        if window_end < len(new_doc):
+            old_offsets = doc.to_array([IDX]).reshape(-1)
+            old_char = new_offsets[window_end] - delta
+            old_end = int(numpy.searchsorted(old_offsets, old_char, "left"))
+            if (
+                old_end >= len(doc)
+                or old_offsets[old_end] != old_char
+                or doc[old_end].text != new_doc[window_end].text
+            ):
+                return self(new_doc)
+        else:
+            old_end = len(doc)
+        shift = window_end - old_end
+
+        before = [m for m in candidates if m[1] < window_start]
+        after = [
+            (match_id, start + shift, end + shift)
+            for (match_id, start, end) in candidates
+            if end > old_end
+        ]
+        window = new_doc[window_start:window_end].as_doc()
+        window_matches = self._match_token_patterns(window)
+        if len(self.phrase_matcher):
+            window_matches += self.phrase_matcher(window)
+        window_matches = [
+            (match_id, start + window_start, end + window_start)
+            for (match_id, start, end) in window_matches
+        ]
         if self.require_start_line:
-            matches = self.filter_start_lines(doc, matches)
+            window_matches = [
+                m for m in window_matches if util.is_start_line(m[1], new_doc, self.newline_pattern)
+            ]
         if self.require_end_line:
-            matches = self.filter_end_lines(doc, matches)
-        matches = prune_overlapping_matches(matches)
-        matches = self.set_parent_sections(matches)
-        # If this has already been processed by the sectionizer, reset the sections
-        doc._.sections = []
+            window_matches = [
+                m for m in window_matches if util.is_end_line(m[2] - 1, new_doc, self.newline_pattern)
+            ]
+
+        matches = before + window_matches + after
+        if self.keep_candidates:
+            new_doc._.section_candidates = matches
+        matches = prune_overlapping_matches(
+            matches, strategy=self.prune_strategy, priorities=self._match_priorities
+        )
+        self.set_sections(new_doc, self.set_parent_sections(matches))
+        return new_doc
+
+    def _get_max_header_length(self):
+        # The maximum number of tokens matched by any pattern, or None if it is unlimited
+        if self._max_header_length is None:
+            lengths = [0]
+            for pattern_dict in self._patterns:
+                pattern = pattern_dict["pattern"]
+                if isinstance(pattern, str) and self.engine == "text":
+                    # A regular expression can match any number of tokens
+                    lengths.append(None)
+                elif isinstance(pattern, str):
+                    lengths.append(len(self.nlp.make_doc(pattern)))
+                else:
+                    lengths.append(max_pattern_length(pattern))
+            if None in lengths:
+                return None
+            self._max_header_length = max(lengths)
+        return self._max_header_length
+
+    def _match_token_patterns(self, doc):
+        if len(self.matcher) == 0:
+            return []
+        if not self.prefilter:
+            return self.matcher(doc)
+        if self._prefilter is None:
+            self._prefilter = HeaderPrefilter(
+                self.nlp.vocab,
+                [
+                    pattern_dict["pattern"]
+                    for pattern_dict in self._patterns
+                    if not isinstance(pattern_dict["pattern"], str)
+                ],
+            )
+        if not self._prefilter.enabled:
+            return self.matcher(doc)
+        matches = []
+        for (window_start, window_end) in self._prefilter.windows(doc):
+            for (match_id, start, end) in self.matcher(doc[window_start:window_end]):
+                matches.append((match_id, start + window_start, end + window_start))
+        return matches
+
+    def _match_text_patterns(self, doc):
+        # Match the regular expressions on the text of the doc and align the matches to tokens
+        if len(self._text_matcher.patterns) == 0:
+            return []
+        text_matches = self._text_matcher.get_matches(doc.text)
+        aligned = util.align_char_spans(doc, [match.span() for (_, match) in text_matches])
+        matches = []
+        for (name, _), span in zip(text_matches, aligned):
+            if span is not None:
+                matches.append((self.nlp.vocab.strings.add(name), span[0], span[1]))
+        return matches
+
+    def _cache_key(self, doc):
+        if self._patterns_fingerprint is None:
+            self._patterns_fingerprint = make_key(srsly.msgpack_dumps(self._patterns))
+        cfg = (
+            self.phrase_matcher_attr,
+            self.require_start_line,
+            self.require_end_line,
+            self.newline_pattern.pattern,
+            self.prune_strategy,
+            self.engine,
+        )
+        return make_key(
+            self._patterns_fingerprint,
+            repr(cfg),
+            doc.text,
+            doc.to_array([IDX]).tobytes(),
+        )
+
+    def set_sections(self, doc, matches):
+        """Set the section attributes of a doc and its tokens.
+
+        Args:
+            doc: a spaCy Doc
+            matches: a list of (match_id, start, end, parent) tuples returned by get_section_matches
+        """
+        stats = self.stats if self.stats is not None else NULL_STATS
+        with stats.timer("sections"):
+            self._set_section_spans(doc, matches)
+
+        # If it is specified to add assertion attributes,
+        # iterate through the entities in doc and add them
+        if self.add_attrs is True:
+            with stats.timer("assertion_attributes"):
+                self.set_assertion_attributes(doc.ents)
+        stats.add_doc(len(doc._.sections))
+
+    def _set_section_spans(self, doc, matches):
+        # Sections are stored as token offsets and Spans are only created when they are accessed.
+        # If this has already been processed by the sectionizer, the sections are replaced
         if len(matches) == 0:
-            doc._.sections.append((None, None, None, doc[0:]))
-            return doc
+            set_doc_sections(doc, [(None, -1, -1, None, 0, len(doc))], token_sections=False)
+            return
 
         first_match = matches[0]
-        section_spans = []
+        sections = []
         if first_match[1] != 0:
-            section_spans.append(Section(None, None, None, doc[0 : first_match[1]]))
+            sections.append((None, -1, -1, None, 0, first_match[1]))
         for i, match in enumerate(matches):
             (match_id, start, end, parent) = match
-            section_header = doc[start:end]
             name = self.nlp.vocab.strings[match_id]
             # If this is the last match, it should include the rest of the doc
             if i == len(matches) - 1:
                 if self.max_scope is None:
-                    section_spans.append(
-                        Section(name, section_header, parent, doc[start:])
-                    )
+                    section_end = len(doc)
                 else:
-                    scope_end = min(end + self.max_scope, doc[-1].i)
-                    section_spans.append(
-                        Section(name, section_header, parent, doc[start:scope_end])
-                    )
+                    section_end = min(end + self.max_scope, doc[-1].i)
             # Otherwise, go until the next section header
             else:
                 next_match = matches[i + 1]
                 _, next_start, _, _ = next_match
                 if self.max_scope is None:
-                    section_spans.append(
-                        Section(name, section_header, parent, doc[start:next_start])
-                    )
+                    section_end = next_start
                 else:
-                    scope_end = min(end + self.max_scope, next_start)
-                    section_spans.append(
-                        Section(name, section_header, parent, doc[start:scope_end])
-                    )
+                    section_end = min(end + self.max_scope, next_start)
+            # A section can't end before it starts, as when slicing the doc
+            sections.append((name, start, end, parent, start, max(section_end, start)))
 
         # section_spans_with_parent = self.set_parent_sections(section_spans)
 
@@ -426,75 +915,217 @@ class Sectionizer:
         #     doc._.sections.append((None, None, None, doc[0:]))
         #     return doc
 
-        for section_tuple in section_spans:
-            name, header, parent, section = section_tuple
-            doc._.sections.append(section_tuple)
-            for token in section:
-                token._.section_span = section
-                token._.section_title = name
-                token._.section_header = header
-                token._.section_parent = parent
+        set_doc_sections(doc, sections)
 
-        # If it is specified to add assertion attributes,
-        # iterate through the entities in doc and add them
-        if self.add_attrs is True:
-            self.set_assertion_attributes(doc.ents)
-        return doc
+    def to_bytes(self, exclude=tuple(), **kwargs):
+        """Serialize the patterns and settings of the sectionizer to a bytestring.
+        String patterns are stored already tokenized, so that loading them does not
+        need to run the tokenizer again.
+
+        Returns:
+            The serialized sectionizer as bytes.
+        """
+        phrase_words = []
+        for pattern_dict in self._patterns:
+            if isinstance(pattern_dict["pattern"], str) and self.engine == "text":
+                phrase_words.append(None)
+            elif isinstance(pattern_dict["pattern"], str):
+                doc = self.nlp.make_doc(pattern_dict["pattern"])
+                words = [token.text for token in doc]
+                spaces = [bool(token.whitespace_) for token in doc]
+                phrase_words.append((words, spaces))
+            else:
+                phrase_words.append(None)
+        cfg = {
+            "max_scope": self.max_scope,
+            "phrase_matcher_attr": self.phrase_matcher_attr,
+            "require_start_line": self.require_start_line,
+            "require_end_line": self.require_end_line,
+            "newline_pattern": self.newline_pattern.pattern,
+            "prune_strategy": self.prune_strategy,
+            "prefilter": self.prefilter,
+            "engine": self.engine,
+            "keep_candidates": self.keep_candidates,
+        }
+        data = {
+            "cfg": cfg,
+            "patterns": self._patterns,
+            "phrase_words": phrase_words,
+            "parent_sections": {
+                name: sorted(parents) for (name, parents) in self._parent_sections.items()
+            },
+            "parent_required": self._parent_required,
+            "priorities": {
+                self.nlp.vocab.strings[match_id]: priority
+                for (match_id, priority) in self._match_priorities.items()
+            },
+        }
+        return srsly.msgpack_dumps(data)
+
+    def from_bytes(self, bytes_data, exclude=tuple(), **kwargs):
+        """Load the patterns and settings of the sectionizer from a bytestring created
+        by to_bytes. Any patterns which were previously added are removed.
+
+        Returns:
+            The Sectionizer.
+        """
+        data = srsly.msgpack_loads(bytes_data)
+        cfg = data["cfg"]
+        self.max_scope = cfg["max_scope"]
+        self.phrase_matcher_attr = cfg["phrase_matcher_attr"]
+        self.require_start_line = cfg["require_start_line"]
+        self.require_end_line = cfg["require_end_line"]
+        self.newline_pattern = re.compile(cfg["newline_pattern"])
+        self.prune_strategy = cfg["prune_strategy"]
+        self.prefilter = cfg.get("prefilter", False)
+        self.engine = cfg.get("engine", "token")
+        self.keep_candidates = cfg.get("keep_candidates", False)
+
+        self.matcher = Matcher(self.nlp.vocab)
+        self.phrase_matcher = PhraseMatcher(
+            self.nlp.vocab, attr=self.phrase_matcher_attr
+        )
+        # Only lexical attributes can be set from the words without the tokenizer
+        retokenize = self.phrase_matcher_attr not in ("ORTH", "TEXT", "LOWER")
+        token_patterns = dict()
+        phrase_patterns = dict()
+        text_patterns = []
+        for pattern_dict, words in zip(data["patterns"], data["phrase_words"]):
+            name = pattern_dict["section_title"]
+            if isinstance(pattern_dict["pattern"], str) and self.engine == "text":
+                self.nlp.vocab.strings.add(name)
+                text_patterns.append(pattern_dict)
+            elif words is None:
+                token_patterns.setdefault(name, []).append(pattern_dict["pattern"])
+            elif retokenize:
+                phrase_patterns.setdefault(name, []).append(
+                    self.nlp.make_doc(pattern_dict["pattern"])
+                )
+            else:
+                phrase_patterns.setdefault(name, []).append(
+                    Doc(self.nlp.vocab, words=words[0], spaces=words[1])
+                )
+        for name, patterns in token_patterns.items():
+            self.matcher.add(name, patterns)
+        for name, docs in phrase_patterns.items():
+            self.phrase_matcher.add(name, None, *docs)
+        self._text_matcher = None
+        if self.engine == "text":
+            self._text_matcher = TextSectionizer(patterns=None, engine="combined")
+            self._text_matcher.add(text_patterns)
+
+        self._patterns = data["patterns"]
+        self._patterns_fingerprint = None
+        self._prefilter = None
+        self._max_header_length = None
+        self._profile_matchers = None
+        self._section_titles = set(
+            pattern_dict["section_title"] for pattern_dict in self._patterns
+        )
+        self._parent_sections = {
+            name: set(parents) for (name, parents) in data["parent_sections"].items()
+        }
+        self._parent_required = data["parent_required"]
+        self._match_priorities = {
+            self.nlp.vocab.strings.add(name): priority
+            for (name, priority) in data["priorities"].items()
+        }
+        return self
+
+    def to_disk(self, path, exclude=tuple(), **kwargs):
+        """Write the sectionizer to a single bundle file which can be loaded with from_disk."""
+        path = ensure_path(path)
+        with path.open("wb") as f:
+            f.write(self.to_bytes())
+
+    def from_disk(self, path, exclude=tuple(), **kwargs):
+        """Load the sectionizer from a bundle file written by to_disk.
 
-    def filter_start_lines(self, doc, matches):
+        Returns:
+            The Sectionizer.
+        """
+        path = ensure_path(path)
+        with path.open("rb") as f:
+            return self.from_bytes(f.read())
+
+    def filter_start_lines(self, doc, matches, line_boundaries=None):
         "Filter a list of matches to only contain spans where the start token is the beginning of a new line."
-        return [
-            m
-            for m in matches
-            if util.is_start_line(m[1], doc, self.newline_pattern)
-        ]
+        if line_boundaries is None:
+            line_boundaries = util.LineBoundaries(doc, self.newline_pattern)
+        return [m for m in matches if line_boundaries.is_start_line(m[1])]
 
-    def filter_end_lines(self, doc, matches):
+    def filter_end_lines(self, doc, matches, line_boundaries=None):
         "Filter a list of matches to only contain spans where the start token is followed by a new line."
-        return [
-            m
-            for m in matches
-            if util.is_end_line(m[2] - 1, doc, self.newline_pattern)
-        ]
+        if line_boundaries is None:
+            line_boundaries = util.LineBoundaries(doc, self.newline_pattern)
+        return [m for m in matches if line_boundaries.is_end_line(m[2] - 1)]
 
 
-def prune_overlapping_matches(matches, strategy="longest"):
-    if strategy != "longest":
-        raise NotImplementedError()
+PRUNE_STRATEGIES = ("longest", "first", "priority")
 
-    # Make a copy and sort
-    unpruned = sorted(matches, key=lambda x: (x[1], x[2]))
-    pruned = []
-    num_matches = len(matches)
-    if num_matches == 0:
-        return matches
-    curr_match = unpruned.pop(0)
-
-    while True:
-        if len(unpruned) == 0:
-            pruned.append(curr_match)
-            break
-        next_match = unpruned.pop(0)
-
-        # Check if they overlap
-        if overlaps(curr_match, next_match):
-            # Choose the larger span
-            longer_span = max(
-                curr_match, next_match, key=lambda x: (x[2] - x[1])
-            )
-            pruned.append(longer_span)
-            if len(unpruned) == 0:
-                break
-            curr_match = unpruned.pop(0)
-        else:
-            pruned.append(curr_match)
-            curr_match = next_match
-    # Recursive base point
-    if len(pruned) == num_matches:
+
+def _text_length(doc):
+    if len(doc) == 0:
+        return 0
+    return doc[-1].idx + len(doc[-1].text_with_ws)
+
+
+def prune_overlapping_matches(matches, strategy="longest", priorities=None):
+    """Remove overlapping matches so that each token is covered by at most one match.
+
+    Args:
+        matches: A list of (match_id, start, end) tuples. Any additional elements are kept.
+        strategy (str): How to choose between overlapping matches:
+            "longest": Keep the longest match. Ties are broken by the earlier start, then by the input order.
+            "first": Keep the match which starts first. Ties are broken by the longer match.
+            "priority": Keep the match whose match_id has the highest value in priorities.
+                Ties are broken as in "longest".
+            For "longest" and "priority", matches are kept greedily in ranked order, so a match is only
+            dropped if it overlaps a better ranked match which was kept. This differs from the earlier recursive
+            "longest", which paired up adjacent overlapping matches and could also drop a match which only
+            overlapped a match that was dropped later.
+        priorities (dict): A mapping from match_id to a number, used by the "priority" strategy.
+            Match ids which are not in priorities have a priority of 0.
+
+    Returns:
+        The list of non-overlapping matches, sorted by start.
+    """
+    if strategy == "first":
+        pruned = []
+        last_end = None
+        for match in sorted(matches, key=lambda x: (x[1], -x[2])):
+            if last_end is None or match[1] >= last_end:
+                pruned.append(match)
+                last_end = match[2]
         return pruned
-    # Recursive function call
+
+    if strategy == "longest":
+        ranked = sorted(matches, key=lambda x: (x[1] - x[2], x[1]))
+    elif strategy == "priority":
+        if priorities is None:
+            priorities = {}
+        ranked = sorted(
+            matches, key=lambda x: (-priorities.get(x[0], 0), x[1] - x[2], x[1])
+        )
     else:
-        return prune_overlapping_matches(pruned)
+        raise ValueError(
+            "strategy must be one of {0}, not {1}".format(PRUNE_STRATEGIES, strategy)
+        )
+
+    # Greedily keep the best ranked matches which don't overlap an already kept match, marking
+    # the tokens of kept matches. Checking a match costs its length, not the number of kept matches.
+    if len(ranked) == 0:
+        return []
+    occupied = bytearray(max(match[2] for match in ranked))
+    pruned = []
+    for match in ranked:
+        _, start, end = match[:3]
+        if occupied.find(1, start, end) != -1:
+            continue
+        occupied[start:end] = b"\x01" * (end - start)
+        pruned.append(match)
+    pruned.sort(key=lambda x: x[1])
+    return pruned
 
 
 def overlaps(a, b):
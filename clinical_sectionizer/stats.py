@@ -0,0 +1,110 @@
+from contextlib import contextmanager, nullcontext
+import json
+import time
+
+STAGES = (
+    "matching",
+    "line_filters",
+    "pruning",
+    "parents",
+    "sections",
+    "assertion_attributes",
+)
+
+COUNTS = (
+    "matches",
+    "matches_after_line_filters",
+    "matches_after_pruning",
+    "matches_after_parents",
+    "sections",
+    "cache_hits",
+    "cache_misses",
+)
+
+
+class SectionizerStats:
+    """Timings and counts recorded by a Sectionizer while it processes docs.
+    Values accumulate across calls to the sectionizer and its pipe method until reset is called.
+
+    Attributes:
+        docs (int): The number of docs processed.
+        stage_seconds (dict): The total wall time spent in each stage, keyed by the names in STAGES.
+        counts (dict): The total number of matches remaining after each stage and the total
+            number of sections, keyed by the names in COUNTS.
+        sections_per_doc (dict): A histogram mapping a number of sections to the number of docs with
+            that many sections.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        "Set all timings and counts to zero."
+        self.docs = 0
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        self.counts = dict.fromkeys(COUNTS, 0)
+        self.sections_per_doc = dict()
+
+    @contextmanager
+    def timer(self, stage):
+        "Add the wall time spent in the body of a with statement to a stage."
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[stage] += time.perf_counter() - start
+
+    def count(self, name, n):
+        self.counts[name] += n
+
+    def add_doc(self, n_sections):
+        self.docs += 1
+        self.counts["sections"] += n_sections
+        self.sections_per_doc[n_sections] = self.sections_per_doc.get(n_sections, 0) + 1
+
+    def merge(self, other):
+        """Add the timings and counts of another SectionizerStats, or of a dict returned by its to_dict method."""
+        if isinstance(other, SectionizerStats):
+            other = other.to_dict()
+        self.docs += other["docs"]
+        for stage, seconds in other["stage_seconds"].items():
+            self.stage_seconds[stage] += seconds
+        for name, n in other["counts"].items():
+            self.counts[name] += n
+        for n_sections, n_docs in other["sections_per_doc"].items():
+            n_sections = int(n_sections)
+            self.sections_per_doc[n_sections] = self.sections_per_doc.get(n_sections, 0) + n_docs
+
+    def to_dict(self):
+        return {
+            "docs": self.docs,
+            "stage_seconds": dict(self.stage_seconds),
+            "counts": dict(self.counts),
+            "sections_per_doc": dict(self.sections_per_doc),
+            "mean_sections_per_doc": self.counts["sections"] / self.docs if self.docs else 0.0,
+        }
+
+    def to_json(self, **kwargs):
+        "Return the stats as a JSON string. Keyword arguments are passed to json.dumps."
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def __repr__(self):
+        return "SectionizerStats({0})".format(self.to_dict())
+
+
+class _NullStats:
+    "Stand-in for SectionizerStats which records nothing, used when stats are disabled."
+
+    _null_timer = nullcontext()
+
+    def timer(self, stage):
+        return self._null_timer
+
+    def count(self, name, n):
+        pass
+
+    def add_doc(self, n_sections):
+        pass
+
+
+NULL_STATS = _NullStats()
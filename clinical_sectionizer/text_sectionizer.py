@@ -1,23 +1,132 @@
+import json
 import re
+import time
+import warnings
 
 # Filepath to default rules which are included in package
 from os import path
 from pathlib import Path
 
+from spacy.util import ensure_path, minibatch
+import srsly
+
+from . import util
+from .cache import make_key
+from .combined_matcher import CombinedPatternMatcher
+from .literal_matcher import LiteralMatcher
+from .pattern_profile import PatternProfile
+from .pattern_worker import PatternWorker
+from .regex_lint import lint_pattern
+from .text_sections import TextSections
+
 DEFAULT_RULES_FILEPATH = path.join(
     Path(__file__).resolve().parents[1],
     "resources",
     "text_section_patterns.jsonl",
 )
+PATRICK_RULES_FILEPATH = path.join(
+    Path(__file__).resolve().parents[1],
+    "resources",
+    "patrick_section_patterns.json",
+)
+
+TIMEOUT_ACTIONS = ("degrade", "raise")
+
+# Compiled patterns shared by every TextSectionizer in the process, keyed by (pattern, flags)
+_COMPILED_PATTERNS = dict()
+
+
+def compile_pattern(pattern, flags=0):
+    """Compile a regular expression, or return the same compiled pattern if it has already been
+    compiled with the same flags. Unlike the cache in the re module, which holds a few hundred
+    patterns, patterns stay cached for the life of the process.
+    """
+    key = (pattern, int(flags))
+    try:
+        return _COMPILED_PATTERNS[key]
+    except KeyError:
+        compiled = _COMPILED_PATTERNS[key] = re.compile(pattern, flags)
+        return compiled
 
 
 class TextSectionizer:
     name = "text_sectionizer"
 
-    def __init__(self, patterns="default"):
+    def __init__(
+        self,
+        patterns="default",
+        engine="regex",
+        cache=None,
+        profile=False,
+        time_budget=None,
+        on_timeout="degrade",
+    ):
+        """Create a new TextSectionizer.
+
+        Args:
+            patterns (str, list, or None): Where to read patterns from. Default is "default", which will
+                load the default patterns provided by medSpaCy. If a list, should be a list of pattern dicts
+                with the keys "section_title" and "pattern", where "pattern" is a regular expression.
+                If a string other than "default", should be a path to a jsonl file containing patterns,
+                or to a json file mapping section titles to lists of patterns (see load_patterns_from_json).
+            engine (str): How patterns are matched against the text. Patterns which start with a literal
+                header are always matched together with a single scan (see LiteralMatcher). For the
+                other patterns, "regex" (default) scans the text once for every pattern, and "combined"
+                compiles them into a single alternation and scans each text once, returning the same sections.
+            cache (MemoryCache, SqliteCache or None): Optional cache of the section headers found in each text,
+                keyed by a hash of the text and the patterns. Texts which have already been sectionized
+                with the same patterns are not matched again. Default None.
+            profile (bool or PatternProfile): Whether to record the matches and matching time of each pattern.
+                If True, a new PatternProfile is created, which is available as TextSectionizer.profile.
+                Texts found in the cache are not profiled. Default False.
+            time_budget (float or None): The maximum number of seconds to spend matching the patterns in each
+                text. If a budget is set, the patterns which can backtrack super-linearly (see lint_pattern) are
+                matched after all of the other patterns, in a worker process (see
+                PatternWorker) which is killed when the budget runs out, since Python regular expressions can't be
+                stopped in the middle of a search. Starting the worker process, and waiting for other threads to
+                finish using it, isn't counted against the budget.
+                The budget is not used while profiling. Default None, which matches every pattern in this process.
+            on_timeout (str): What to do when the time budget runs out. "degrade" (default) returns the sections
+                found by the patterns which were matched in time, skipping the rest, and warns with a RuntimeWarning.
+                get_section_offsets also sets timed_out on the TextSections it returns. "raise" raises a
+                TimeoutError. Texts which ran out of time are never cached.
+        """
+        if engine not in ("regex", "combined"):
+            raise ValueError(
+                "engine must be either 'regex' or 'combined', not {0}".format(engine)
+            )
+        if on_timeout not in TIMEOUT_ACTIONS:
+            raise ValueError(
+                "on_timeout must be one of {0}, not {1}".format(TIMEOUT_ACTIONS, on_timeout)
+            )
+        if time_budget is not None and time_budget <= 0:
+            raise ValueError("time_budget must be a positive number of seconds or None")
+        self.engine = engine
+        self.time_budget = time_budget
+        self.on_timeout = on_timeout
         self._patterns = []
         self._compiled_patterns = dict()
         self._section_titles = set()
+        # Section titles in the order they were added, which title ids refer to
+        self._titles = []
+        self._title_ids = dict()
+        # The compiled patterns in the order matches are returned, which ranks refer to
+        self._ranked_patterns = []
+        # The compiled patterns which lint_pattern flagged as able to backtrack super-linearly
+        self._risky_patterns = set()
+        # Their ranks, since they are matched on their own
+        self._risky_ranks = []
+        # The PatternWorker which matches them when there is a time budget
+        self._risky_worker = None
+        self._literal_matcher = LiteralMatcher([])
+        self._combined_matcher = None
+        self.cache = cache
+        self._patterns_fingerprint = None
+        if profile is True:
+            profile = PatternProfile()
+        elif profile is False:
+            profile = None
+        self.profile = profile
 
         if patterns is not None:
             if patterns == "default":
@@ -37,7 +146,10 @@ class TextSectionizer:
                 import os
 
                 assert os.path.exists(patterns)
-                self.add(self.load_patterns_from_jsonl(patterns))
+                if patterns.endswith(".json"):
+                    self.add(self.load_patterns_from_json(patterns))
+                else:
+                    self.add(self.load_patterns_from_jsonl(patterns))
 
     def add(self, patterns, cflags=None):
         """
@@ -49,26 +161,40 @@ class TextSectionizer:
         Keyword arguments:
         - cflags -- a list of regular expression compile flags
                  If cflags==None then cflags is set to [re.I]
-        """
 
-        def _mycomp(rex, flags=None):
+        Patterns are compiled with compile_pattern, so patterns which were compiled
+        by another TextSectionizer are not compiled again. A pattern which has already
+        been added for the same section title with the same flags is skipped.
 
-            if flags is None:
-                flags = [re.I]
-            cflags = 0
-            for f in flags:
-                if isinstance(f, re.RegexFlag):
-                    cflags = cflags | f
-            return re.compile(rex, flags=cflags)
+        Each pattern is checked with lint_pattern, and a RuntimeWarning is given for patterns
+        which can backtrack super-linearly on some texts.
+        """
+        if cflags is None:
+            cflags = [re.I]
+        flags = 0
+        for f in cflags:
+            if isinstance(f, re.RegexFlag):
+                flags = flags | f
 
         for pattern_dict in patterns:
             name = pattern_dict["section_title"]
             pattern = pattern_dict["pattern"]
             if isinstance(pattern, str):
+                compiled = compile_pattern(pattern, flags)
+                # A repeated pattern would only find the same headers again
+                if compiled in self._compiled_patterns.get(name, []):
+                    continue
+                problems = lint_pattern(compiled)
+                if problems:
+                    self._risky_patterns.add(compiled)
+                    warnings.warn(
+                        "The pattern {0!r} for section {1} can be very slow to match on some texts: {2}.".format(
+                            pattern, name, "; ".join(problems)
+                        ),
+                        RuntimeWarning,
+                    )
                 self._compiled_patterns.setdefault(name, [])
-                self._compiled_patterns[name].append(
-                    _mycomp(pattern, flags=cflags)
-                )
+                self._compiled_patterns[name].append(compiled)
             else:
                 # TODO: Change the default patterns
                 # continue
@@ -78,6 +204,37 @@ class TextSectionizer:
                 )
             self._patterns.append(pattern_dict)
             self._section_titles.add(name)
+            if name not in self._title_ids:
+                self._title_ids[name] = len(self._titles)
+                self._titles.append(name)
+        self._build_literal_matcher()
+        # Rebuild the combined matcher the next time it is needed
+        self._combined_matcher = None
+        self._patterns_fingerprint = None
+
+    def _build_literal_matcher(self):
+        # Split the patterns into literal headers, which are matched with a trie, and regular expressions
+        self._ranked_patterns = [
+            (name, pattern)
+            for (name, patterns) in self._compiled_patterns.items()
+            for pattern in patterns
+        ]
+        self._risky_ranks = [
+            rank
+            for (rank, (_, pattern)) in enumerate(self._ranked_patterns)
+            if pattern in self._risky_patterns
+        ]
+        if self._risky_worker is not None:
+            self._risky_worker.stop()
+        # The process is only started when a time budget is used
+        self._risky_worker = PatternWorker(
+            [self._ranked_patterns[rank][1] for rank in self._risky_ranks]
+        )
+        risky = set(self._risky_ranks)
+        self._literal_matcher = LiteralMatcher(
+            self._ranked_patterns,
+            [rank for rank in range(len(self._ranked_patterns)) if rank not in risky],
+        )
 
     @property
     def patterns(self):
@@ -99,39 +256,394 @@ class TextSectionizer:
 
         return patterns
 
-    def __call__(self, text):
+    @classmethod
+    def load_patterns_from_json(cls, filepath, merge=False):
+        """Load patterns from a json file mapping each section title to a list of regular expressions,
+        such as PATRICK_RULES_FILEPATH. Patterns which are repeated for a section title are removed.
+
+        Args:
+            filepath (str): The path to the json file.
+            merge (bool): Join the patterns for each section title into a single alternation, so that each
+                section title is matched with one regular expression. At each position the first alternative
+                which matches is used rather than the longest, so headers can differ when the patterns for a
+                title overlap, such as "history:" and "history: hpi". Patterns with backreferences, named groups
+                or inline flags are not merged. Default False.
+
+        Returns:
+            A list of pattern dicts with the keys "section_title" and "pattern", which can be passed to add.
+        """
+        with open(filepath) as f:
+            title_patterns = json.load(f)
+
+        patterns = []
+        for (name, regexes) in title_patterns.items():
+            regexes = list(dict.fromkeys(regexes))
+            if merge:
+                mergeable = [regex for regex in regexes if _can_merge(regex)]
+                if len(mergeable) > 1:
+                    merged = "|".join("(?:{0})".format(regex) for regex in mergeable)
+                    regexes = [merged] + [regex for regex in regexes if regex not in mergeable]
+            for regex in regexes:
+                patterns.append({"section_title": name, "pattern": regex})
+        return patterns
+
+    def get_matches(self, text, pos=0):
+        """Return a list of (section_title, match) tuples for every pattern match in text,
+        grouped by pattern in the order the patterns were added. The search starts at
+        index pos, but patterns can still look behind it.
+
+        If the time budget runs out and on_timeout is "degrade", only the matches of the
+        patterns which were matched in time are returned."""
+        return self._match(text, pos)[0]
+
+    def _match(self, text, pos=0):
+        # Return the matches in text, and whether the time budget ran out
+        deadline = None
+        if self.time_budget is not None:
+            deadline = time.perf_counter() + self.time_budget
+        found = [None] * len(self._ranked_patterns)
+        self._literal_matcher.scan(text, found, pos)
+        if self.engine == "combined":
+            if self._combined_matcher is None:
+                self._combined_matcher = CombinedPatternMatcher(
+                    self._ranked_patterns, self._literal_matcher.other_ranks
+                )
+            self._combined_matcher.scan(text, found, pos)
+        else:
+            for rank in self._literal_matcher.other_ranks:
+                found[rank] = list(self._ranked_patterns[rank][1].finditer(text, pos))
+        timed_out = self._match_risky_patterns(text, found, pos, deadline)
+
         matches = []
-        for (name, patterns) in self._compiled_patterns.items():
-            for pattern in patterns:
-                pattern_matches = list(pattern.finditer(text))
-                for match in pattern_matches:
-                    matches.append((name, match))
+        for (name, _), pattern_matches in zip(self._ranked_patterns, found):
+            for match in pattern_matches:
+                matches.append((name, match))
+        return matches, timed_out
+
+    def _match_risky_patterns(self, text, found, pos, deadline):
+        # Match the patterns which can backtrack super-linearly. With a deadline, they are matched in a
+        # worker process which is killed when it passes. Returns whether the deadline passed.
+        if len(self._risky_ranks) == 0:
+            return False
+        if deadline is None:
+            for rank in self._risky_ranks:
+                found[rank] = list(self._ranked_patterns[rank][1].finditer(text, pos))
+            return False
+
+        results = self._risky_worker.match(text, pos, deadline)
+        for rank in self._risky_ranks:
+            found[rank] = []
+        for rank, spans in zip(self._risky_ranks, results):
+            found[rank] = _matches_at(self._ranked_patterns[rank][1], text, spans)
+        if len(results) == len(self._risky_ranks):
+            return False
 
+        # The patterns which weren't matched in time are skipped
+        (name, pattern) = self._ranked_patterns[self._risky_ranks[len(results)]]
+        if self.on_timeout == "raise":
+            raise TimeoutError(
+                "Matching the pattern {0!r} for section {1} took longer than the time budget of {2}s.".format(
+                    pattern.pattern, name, self.time_budget
+                )
+            )
+        warnings.warn(
+            "The time budget of {0}s ran out, so {1} slow patterns were skipped, starting with {2!r}.".format(
+                self.time_budget, len(self._risky_ranks) - len(results), pattern.pattern
+            ),
+            RuntimeWarning,
+        )
+        return True
+
+    def get_headers(self, text):
+        """Return a list of non-overlapping (section_title, match) tuples for the section
+        headers in text, sorted by their position."""
+        return self._find_headers(text)[0]
+
+    def _find_headers(self, text):
+        # Return the headers in text, and whether the time budget ran out
+        if self.profile is not None:
+            return self._profile_headers(text), False
+        matches, timed_out = self._match(text)
         if len(matches) == 0:
-            return [(None, None, text)]
+            return matches, timed_out
+        matches = sorted(matches, key=lambda x: (x[1].start(), 0 - x[1].end()))
+        return self._dedup_matches(matches), timed_out
 
+    def _profile_headers(self, text):
+        # Match each pattern on its own to time it, then find the matches lost in _dedup_matches
+        profile = self.profile
+        matches = []
+        # The profile key of the pattern of each match, by the id of the match
+        keys = dict()
+        for (name, pattern) in self._ranked_patterns:
+            key = profile.key(name, pattern.pattern)
+            start_time = time.perf_counter()
+            pattern_matches = list(pattern.finditer(text))
+            profile.record(key, len(pattern_matches), time.perf_counter() - start_time)
+            for match in pattern_matches:
+                keys[id(match)] = key
+                matches.append((name, match))
+        profile.add_doc()
+        if len(matches) == 0:
+            return matches
         matches = sorted(matches, key=lambda x: (x[1].start(), 0 - x[1].end()))
-        matches = self._dedup_matches(matches)
+        headers = self._dedup_matches(matches)
+        for (_, match) in headers:
+            del keys[id(match)]
+        for key in keys.values():
+            profile.lose(key, "overlap")
+        return headers
+
+    def _get_header_offsets(self, text):
+        # Return a list of (section_title, start, end) tuples for the headers in text, and whether
+        # the time budget ran out, using the cache if there is one
+        if self.cache is None:
+            headers, timed_out = self._find_headers(text)
+            return (
+                [(section_title, match.start(), match.end()) for (section_title, match) in headers],
+                timed_out,
+            )
+
+        if self._patterns_fingerprint is None:
+            compiled = [
+                (name, pattern.pattern, int(pattern.flags))
+                for (name, patterns) in self._compiled_patterns.items()
+                for pattern in patterns
+            ]
+            self._patterns_fingerprint = make_key(srsly.msgpack_dumps(compiled))
+        key = make_key(self._patterns_fingerprint, text)
+        headers = self.cache.get(key)
+        if headers is not None:
+            return headers, False
+        headers, timed_out = self._find_headers(text)
+        headers = [(section_title, match.start(), match.end()) for (section_title, match) in headers]
+        # The headers found when the time ran out may be incomplete
+        if not timed_out:
+            self.cache.set(key, headers)
+        return headers, timed_out
+
+    def get_section_offsets(self, text):
+        """Sectionize a text without copying any of it. Returns the same sections as __call__,
+        as a TextSections object which stores the offsets of each header and section
+        in the text and only slices the text when a section is accessed.
+        """
+        headers, timed_out = self._get_header_offsets(text)
+        sections = TextSections(text, self._titles)
+        sections.timed_out = timed_out
+        if len(headers) == 0:
+            sections.append(-1, -1, -1, 0, len(text))
+            return sections
+
+        if headers[0][1] != 0:
+            sections.append(-1, -1, -1, 0, headers[0][1])
+        for i, (section_title, start, end) in enumerate(headers):
+            if i == len(headers) - 1:
+                section_end = len(text)
+            else:
+                section_end = headers[i + 1][1]
+            sections.append(self._title_ids[section_title], start, end, start, section_end)
+        return sections
+
+    def __call__(self, text):
+        headers, _ = self._get_header_offsets(text)
+
+        if len(headers) == 0:
+            return [(None, None, text)]
 
         sections = []
         # If the first section doesn't start at the very beginning,
         # add an unknown section at the beginning
-        if matches[0][1].start() != 0:
-            sections.append((None, None, text[: matches[0][1].start()]))
+        if headers[0][1] != 0:
+            sections.append((None, None, text[: headers[0][1]]))
 
-        for i, (section_title, match) in enumerate(matches):
-            section_header = match.group()
+        for i, (section_title, start, end) in enumerate(headers):
+            section_header = text[start:end]
             # If this is the final section, it should include the rest of the text
-            if i == len(matches) - 1:
-                section_text = text[match.start() :]
+            if i == len(headers) - 1:
+                section_text = text[start:]
                 sections.append((section_title, section_header, section_text))
             # Otherwise, it will include all of the text up until the next section header
             else:
-                next_match = matches[i + 1][1]
-                section_text = text[match.start() : next_match.start()]
+                next_start = headers[i + 1][1]
+                section_text = text[start:next_start]
                 sections.append((section_title, section_header, section_text))
         return sections
 
+    def stream(self, source, chunk_size=65536, max_header_length=200):
+        """Sectionize a text which is read in chunks, yielding each section as soon as
+        the header of the following section has been found. Only the current section
+        and the latest chunk are kept in memory.
+
+        The sections are the same as those returned by __call__ for the whole text, as long
+        as no section header is longer than max_header_length characters.
+
+        Args:
+            source: A file object opened in text mode, or an iterable of strings.
+            chunk_size (int): The number of characters to read at a time from a file object.
+            max_header_length (int): The maximum length of a section header. Matches are only
+                accepted once this many characters following their start have been read.
+
+        Yields:
+            (section_title, section_header, section_text) tuples, as returned by __call__.
+        """
+        if isinstance(source, str):
+            chunks = [source]
+        elif hasattr(source, "read"):
+            chunks = iter(lambda: source.read(chunk_size), "")
+        else:
+            chunks = source
+
+        buffer = ""
+        # The start of the section which is currently being read
+        section_start = 0
+        current_section = None
+        # The next index to search for section headers from
+        scan_pos = 0
+        # The end of the last header, since overlapping headers are skipped
+        last_end = 0
+
+        chunks = iter(chunks)
+        finished = False
+        while not finished:
+            chunk = next(chunks, None)
+            if chunk is None:
+                finished = True
+                limit = len(buffer)
+            else:
+                buffer += chunk
+                # Wait until there is enough new text to be worth searching
+                if len(buffer) - scan_pos < 2 * max_header_length:
+                    continue
+                limit = len(buffer) - max_header_length
+
+            matches = [
+                (name, match)
+                for (name, match) in self.get_matches(buffer, scan_pos)
+                if match.start() < limit
+            ]
+            matches = sorted(matches, key=lambda x: (x[1].start(), 0 - x[1].end()))
+            for (section_title, match) in matches:
+                if match.start() < last_end:
+                    continue
+                if current_section is not None:
+                    yield current_section + (buffer[section_start : match.start()],)
+                elif match.start() != 0:
+                    # Nothing is trimmed before the first header, so this starts the text
+                    yield (None, None, buffer[section_start : match.start()])
+                current_section = (section_title, match.group())
+                section_start = match.start()
+                last_end = match.end()
+            scan_pos = max(limit, last_end)
+
+            # Drop the text before the current section, keeping enough context for lookbehinds
+            trim = min(section_start, scan_pos - max_header_length)
+            if trim > 0:
+                buffer = buffer[trim:]
+                section_start -= trim
+                scan_pos -= trim
+                last_end = max(last_end - trim, 0)
+
+        if current_section is None:
+            yield (None, None, buffer[section_start:])
+        else:
+            yield current_section + (buffer[section_start:],)
+
+    def to_bytes(self, **kwargs):
+        """Serialize the patterns, compile flags and engine of the sectionizer to a bytestring.
+
+        Returns:
+            The serialized sectionizer as bytes.
+        """
+        compiled = [
+            (name, pattern.pattern, int(pattern.flags))
+            for (name, patterns) in self._compiled_patterns.items()
+            for pattern in patterns
+        ]
+        data = {"engine": self.engine, "patterns": self._patterns, "compiled": compiled}
+        return srsly.msgpack_dumps(data)
+
+    def from_bytes(self, bytes_data, **kwargs):
+        """Load the patterns of the sectionizer from a bytestring created by to_bytes.
+        Any patterns which were previously added are removed.
+
+        Returns:
+            The TextSectionizer.
+        """
+        data = srsly.msgpack_loads(bytes_data)
+        self.engine = data["engine"]
+        self._patterns = data["patterns"]
+        self._compiled_patterns = dict()
+        for (name, pattern, flags) in data["compiled"]:
+            self._compiled_patterns.setdefault(name, [])
+            self._compiled_patterns[name].append(compile_pattern(pattern, flags))
+        self._section_titles = set(self._compiled_patterns.keys())
+        self._titles = list(self._compiled_patterns.keys())
+        self._title_ids = {name: i for (i, name) in enumerate(self._titles)}
+        self._risky_patterns = set(
+            pattern
+            for patterns in self._compiled_patterns.values()
+            for pattern in patterns
+            if lint_pattern(pattern)
+        )
+        self._build_literal_matcher()
+        self._combined_matcher = None
+        self._patterns_fingerprint = None
+        return self
+
+    def to_disk(self, path, **kwargs):
+        """Write the sectionizer to a single bundle file which can be loaded with from_disk."""
+        path = ensure_path(path)
+        with path.open("wb") as f:
+            f.write(self.to_bytes())
+
+    def from_disk(self, path, **kwargs):
+        """Load the sectionizer from a bundle file written by to_disk.
+
+        Returns:
+            The TextSectionizer.
+        """
+        path = ensure_path(path)
+        with path.open("rb") as f:
+            return self.from_bytes(f.read())
+
+    def pipe(self, texts, batch_size=50, n_process=1):
+        """Sectionize a stream of texts, yielding the list of sections for each text in order.
+
+        Args:
+            texts: An iterable of strings.
+            batch_size (int): The number of texts sent to a worker process at a time.
+            n_process (int): The number of worker processes to sectionize with. Workers receive
+                a copy of this sectionizer once when they start. -1 will use one process per CPU.
+        """
+        if n_process == 1:
+            for text in texts:
+                yield self(text)
+            return
+
+        batches = ((None, batch) for batch in minibatch(texts, size=batch_size))
+        if self.profile is not None:
+            for _, (batch_sections, batch_profile) in util.map_batches(
+                self, "_profile_batch", batches, n_process
+            ):
+                self.profile.merge(batch_profile)
+                for sections in batch_sections:
+                    yield sections
+            return
+
+        for _, batch_sections in util.map_batches(
+            self, "_sectionize_batch", batches, n_process
+        ):
+            for sections in batch_sections:
+                yield sections
+
+    def _sectionize_batch(self, texts):
+        return [self(text) for text in texts]
+
+    def _profile_batch(self, texts):
+        # Workers profile each batch separately, and the profiles are added together by pipe
+        self.profile.reset()
+        return self._sectionize_batch(texts), self.profile.to_dict()
+
     def extract_sections(self, text):
         matches = []
         for name, sect_patterns in self.patterns.items():
@@ -175,3 +687,25 @@ class TextSectionizer:
             return True
         if b.start() <= a.start() < b.end():
             return True
+
+
+def _matches_at(pattern, text, spans):
+    # Recreate the match objects for the (start, end) offsets of matches found in another process.
+    # Each match is only attempted at the position where it was found.
+    matches = []
+    for (start, end) in spans:
+        match = pattern.match(text, start)
+        if match is None or match.end() != end:
+            # An empty match at start was already found, so finditer found a longer one
+            match = pattern.fullmatch(text, start, end)
+        if match is not None:
+            matches.append(match)
+    return matches
+
+
+def _can_merge(regex):
+    # Group numbers change and inline flags are only allowed at the start once a pattern is
+    # part of an alternation
+    if re.search(r"\\[1-9]|\(\?P=|\(\?\(|\(\?[aiLmsux]+\)", regex):
+        return False
+    return not compile_pattern(regex).groupindex
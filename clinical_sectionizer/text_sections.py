@@ -0,0 +1,131 @@
+from array import array
+
+import numpy
+
+OFFSET_FIELDS = (
+    "title_id",
+    "header_start",
+    "header_end",
+    "section_start",
+    "section_end",
+)
+
+
+class TextSection:
+    """A single section of a text, stored as offsets into the original text.
+    The title, header and text of the section are only created when they are accessed.
+    Sections without a header have a title_id, header_start and header_end of -1.
+
+    Unpacking a TextSection gives the same (section_title, section_header, section_text)
+    tuple as TextSectionizer.__call__.
+    """
+
+    __slots__ = ("_text", "_titles") + OFFSET_FIELDS
+
+    def __init__(
+        self, text, titles, title_id, header_start, header_end, section_start, section_end
+    ):
+        self._text = text
+        self._titles = titles
+        self.title_id = title_id
+        self.header_start = header_start
+        self.header_end = header_end
+        self.section_start = section_start
+        self.section_end = section_end
+
+    @property
+    def section_title(self):
+        if self.title_id < 0:
+            return None
+        return self._titles[self.title_id]
+
+    @property
+    def section_header(self):
+        if self.header_start < 0:
+            return None
+        return self._text[self.header_start : self.header_end]
+
+    @property
+    def section_text(self):
+        return self._text[self.section_start : self.section_end]
+
+    def __iter__(self):
+        yield self.section_title
+        yield self.section_header
+        yield self.section_text
+
+    def __repr__(self):
+        return "TextSection({0}, header=({1}, {2}), section=({3}, {4}))".format(
+            self.section_title,
+            self.header_start,
+            self.header_end,
+            self.section_start,
+            self.section_end,
+        )
+
+
+class TextSections:
+    """The sections of a text, stored as columns of integer offsets into the text.
+    Indexing or iterating creates TextSection records which slice the text lazily.
+
+    Attributes:
+        timed_out (bool): Whether the time budget of the TextSectionizer ran out, so that
+            some of the section headers may be missing.
+    """
+
+    def __init__(self, text, titles):
+        """Create an empty list of sections.
+
+        Args:
+            text (str): The text which was sectionized.
+            titles (list): The section titles which title ids refer to.
+        """
+        self.text = text
+        self.titles = titles
+        self.timed_out = False
+        self._columns = {field: array("l") for field in OFFSET_FIELDS}
+
+    def append(self, title_id, header_start, header_end, section_start, section_end):
+        self._columns["title_id"].append(title_id)
+        self._columns["header_start"].append(header_start)
+        self._columns["header_end"].append(header_end)
+        self._columns["section_start"].append(section_start)
+        self._columns["section_end"].append(section_end)
+
+    def __len__(self):
+        return len(self._columns["title_id"])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return TextSection(
+            self.text, self.titles, *(self._columns[field][i] for field in OFFSET_FIELDS)
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def to_tuples(self):
+        """Return the sections as a list of (section_title, section_header, section_text) tuples."""
+        return [tuple(section) for section in self]
+
+    def to_arrays(self):
+        """Return a dict mapping each offset field to a numpy integer array.
+        Title ids refer to the titles attribute."""
+        return {
+            field: numpy.array(column, dtype=column.typecode)
+            for (field, column) in self._columns.items()
+        }
+
+    def to_columns(self):
+        """Return the sections as a dict of equal length lists, with a section_title column
+        added, which can be loaded directly as a table (ie., pyarrow.table or pandas.DataFrame)."""
+        columns = {
+            "section_title": [
+                self.titles[i] if i >= 0 else None for i in self._columns["title_id"]
+            ]
+        }
+        for field, column in self._columns.items():
+            columns[field] = column.tolist()
+        return columns
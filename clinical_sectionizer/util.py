@@ -1,20 +1,163 @@
+from collections import deque
+import multiprocessing
+import re
+
+import numpy
+from spacy.attrs import IDX, IS_SPACE, LENGTH
+
 NEWLINE_PATTERN = r"[\n\r]+[\s]*$"
+NEWLINE_CHARS = re.compile(r"[\n\r]")
 
 
+# The Doc section attributes return new lists, as they did before sections were stored as columns.
+# Doc._.sections.titles and the other columns can be used to avoid building them.
 def get_section_titles(doc):
-    return [title for (title, _, _, _) in doc._.sections]
+    return list(doc._.sections.titles)
 
 
 def get_section_headers(doc):
-    return [header for (_, header, _, _) in doc._.sections]
+    return list(doc._.sections.headers)
 
 
 def get_section_parents(doc):
-    return [parent for (_, _, parent, _,) in doc._.sections]
+    return list(doc._.sections.parents)
 
 
 def get_section_spans(doc):
-    return [span for (_, _, _, span) in doc._.sections]
+    return list(doc._.sections.spans)
+
+
+def get_token_section(token):
+    """Return the section in Doc._.sections which contains a token, or None."""
+    sections = token.doc._.sections
+    i = sections.token_section(token.i)
+    if i is None:
+        return None
+    return sections[i]
+
+
+def get_token_section_title(token):
+    sections = token.doc._.sections
+    i = sections.token_section(token.i)
+    if i is None:
+        return None
+    return sections.title(i)
+
+
+def get_token_section_header(token):
+    sections = token.doc._.sections
+    i = sections.token_section(token.i)
+    if i is None:
+        return None
+    return sections.header(i)
+
+
+def get_token_section_parent(token):
+    sections = token.doc._.sections
+    i = sections.token_section(token.i)
+    if i is None:
+        return None
+    return sections.parent(i)
+
+
+def get_token_section_span(token):
+    sections = token.doc._.sections
+    i = sections.token_section(token.i)
+    if i is None:
+        return None
+    return sections.span(i)
+
+
+def align_char_spans(doc, spans):
+    """Align character offsets in doc.text to token offsets. Each span is expanded to the
+    tokens it overlaps, and whitespace tokens at its edges are then removed.
+
+    Args:
+        doc: A spaCy Doc.
+        spans: A list of (start_char, end_char) tuples.
+
+    Returns:
+        A list of (start, end) token offsets for each span, or None if a span only
+        contains whitespace.
+    """
+    if len(spans) == 0 or len(doc) == 0:
+        return [None] * len(spans)
+    array = doc.to_array([IDX, LENGTH, IS_SPACE]).reshape(-1, 3).astype("int64")
+    token_starts = array[:, 0]
+    token_ends = token_starts + array[:, 1]
+    is_space = array[:, 2].tolist()
+    chars = numpy.array(spans, dtype="int64").reshape(-1, 2)
+    # The first token ending after the span starts, and the first token starting after it ends
+    firsts = numpy.searchsorted(token_ends, chars[:, 0], side="right").tolist()
+    lasts = numpy.searchsorted(token_starts, chars[:, 1], side="left").tolist()
+    aligned = []
+    for first, last in zip(firsts, lasts):
+        while first < last and is_space[first]:
+            first += 1
+        while last > first and is_space[last - 1]:
+            last -= 1
+        aligned.append((first, last) if first < last else None)
+    return aligned
+
+
+class LineBoundaries:
+    """An index of the tokens in a doc which end a line, meaning that the text of the
+    token with its trailing whitespace matches a newline pattern.
+
+    With the default NEWLINE_PATTERN, only tokens containing a newline character can end
+    a line. These are found with a single pass over the doc text, so the pattern is only
+    searched for once per candidate token. With other patterns, each token is searched
+    for at most once, the first time it is looked up.
+    """
+
+    def __init__(self, doc, pattern):
+        self.doc = doc
+        self.pattern = pattern
+        self._line_ends = dict()
+        self._complete = False
+        if pattern.pattern == NEWLINE_PATTERN:
+            self._index_newlines()
+
+    def _index_newlines(self):
+        newline_offsets = [m.start() for m in NEWLINE_CHARS.finditer(self.doc.text)]
+        if newline_offsets:
+            token_offsets = self.doc.to_array([IDX]).reshape(-1)
+            token_indices = (
+                numpy.searchsorted(token_offsets, newline_offsets, side="right") - 1
+            )
+            for i in numpy.unique(token_indices).tolist():
+                self._line_ends[i] = (
+                    self.pattern.search(self.doc[i].text_with_ws) is not None
+                )
+        self._complete = True
+
+    def ends_line(self, idx):
+        "Return True if the token at idx is followed by a new line."
+        try:
+            return self._line_ends[idx]
+        except KeyError:
+            pass
+        if self._complete:
+            return False
+        ends_line = self.pattern.search(self.doc[idx].text_with_ws) is not None
+        self._line_ends[idx] = ends_line
+        return ends_line
+
+    def is_start_line(self, idx):
+        """Return True if the token at idx is the first token of a line.
+        Equivalent to util.is_start_line(idx, doc, pattern)."""
+        # If it's the start of the doc, return True
+        if idx == 0:
+            return True
+        return self.ends_line(idx - 1)
+
+    def is_end_line(self, idx):
+        """Return True if the token at idx is the last token of a line.
+        Equivalent to util.is_end_line(idx, doc, pattern)."""
+        # If it's the end of the doc, return True
+        if idx == len(self.doc) - 1:
+            return True
+        return self.ends_line(idx) or self.ends_line(idx + 1)
 
 
 def is_start_line(idx, doc, pattern):
@@ -38,3 +181,71 @@ def is_end_line(idx, doc, pattern):
         return True
     following_text = doc[idx + 1].text_with_ws
     return pattern.search(following_text) is not None
+
+
+# The component used by each worker process in map_batches
+_worker_component = None
+
+
+def _init_worker(component):
+    global _worker_component
+    _worker_component = component
+
+
+def _call_worker(method_name, payload):
+    return getattr(_worker_component, method_name)(payload)
+
+
+def get_context(allow_fork=True):
+    """Return the multiprocessing context used for worker processes. The "fork" start method
+    is used when it is available, so that workers inherit their component without pickling.
+
+    Args:
+        allow_fork (bool): Whether "fork" can be used. Forking a process which is running other
+            threads, such as an asyncio application, can deadlock, so if this is False the
+            "forkserver" start method is used when it is available, and otherwise "spawn".
+    """
+    methods = multiprocessing.get_all_start_methods()
+    if allow_fork and "fork" in methods:
+        return multiprocessing.get_context("fork")
+    if not allow_fork:
+        if "forkserver" in methods:
+            return multiprocessing.get_context("forkserver")
+        return multiprocessing.get_context("spawn")
+    return multiprocessing.get_context()
+
+
+def map_batches(component, method_name, batches, n_process, max_pending=2):
+    """Call a method of a component on batches of data in a pool of worker processes.
+
+    The component is sent to each worker once when the worker starts. When the
+    "fork" start method is available, the workers inherit it without pickling.
+
+    Args:
+        component: The object whose method will be called in the workers.
+        method_name (str): The name of the method to call with each payload.
+        batches: An iterable of (batch, payload) tuples. Only the payload is sent to the workers.
+        n_process (int): The number of worker processes. -1 will use one process per CPU.
+        max_pending (int): The maximum number of batches waiting on each worker,
+            which bounds how much of the input is read ahead.
+
+    Yields:
+        (batch, result) tuples in the same order as batches.
+    """
+    if n_process == -1:
+        n_process = multiprocessing.cpu_count()
+    context = get_context()
+    pending = deque()
+    with context.Pool(
+        n_process, initializer=_init_worker, initargs=(component,)
+    ) as pool:
+        for batch, payload in batches:
+            pending.append(
+                (batch, pool.apply_async(_call_worker, (method_name, payload)))
+            )
+            while len(pending) > n_process * max_pending:
+                batch, result = pending.popleft()
+                yield batch, result.get()
+        while pending:
+            batch, result = pending.popleft()
+            yield batch, result.get()
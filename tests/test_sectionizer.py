@@ -1,3 +1,5 @@
+import json
+import pytest
 import spacy
 import warnings
 
@@ -488,3 +490,682 @@ class TestSectionizer:
         assert parent is section_tup.section_parent
         assert section is section_tup.section_span
 
+
+    def test_pipe(self):
+        sectionizer = Sectionizer(nlp, patterns=None)
+        sectionizer.add(
+            [
+                {
+                    "section_title": "past_medical_history",
+                    "pattern": "Past Medical History:",
+                }
+            ]
+        )
+        texts = ["Past Medical History: PE", "This is separate. Past Medical History: PE"]
+        docs = list(sectionizer.pipe(nlp.pipe(texts), batch_size=1))
+        assert len(docs) == 2
+        assert docs[0]._.section_titles == ["past_medical_history"]
+        assert docs[1]._.section_titles == [None, "past_medical_history"]
+
+    def test_pipe_multiprocess(self):
+        sectionizer = Sectionizer(nlp, patterns=None)
+        sectionizer.add(
+            [
+                {
+                    "section_title": "past_medical_history",
+                    "pattern": "Past Medical History:",
+                }
+            ]
+        )
+        texts = ["Past Medical History: PE", "This is separate. Past Medical History: PE"] * 3
+        docs = list(sectionizer.pipe(nlp.pipe(texts), batch_size=2, n_process=2))
+        assert [doc.text for doc in docs] == texts
+        for doc in docs:
+            assert doc._.section_titles[-1] == "past_medical_history"
+            (_, header, _, section) = doc._.sections[-1]
+            assert header.text == "Past Medical History:"
+            assert section.text == "Past Medical History: PE"
+            assert doc[-1]._.section_title == "past_medical_history"
+
+    def test_token_attributes(self):
+        sectionizer = Sectionizer(nlp, patterns=None)
+        sectionizer.add(
+            [
+                {"section_title": "s1", "pattern": "section 1:"},
+                {
+                    "section_title": "s2",
+                    "pattern": "section 2:",
+                    "parents": ["s1"],
+                },
+            ]
+        )
+        doc = nlp("intro section 1: abc section 2: def")
+        sectionizer(doc)
+        assert [(span.start, span.end) for span in doc._.section_spans] == [(0, 1), (1, 5), (5, 9)]
+        assert doc[0]._.section_title is None
+        assert doc[0]._.section_span == doc._.sections[0].section_span
+        token = doc[-1]
+        assert token._.section_title == "s2"
+        assert token._.section_header.text == "section 2:"
+        assert token._.section_parent == "s1"
+        assert token._.section_span == doc._.sections[2].section_span
+        span = doc[6:9]
+        assert span._.section_title == "s2"
+        assert span._.section_parent == "s1"
+
+    def test_token_attributes_no_sections(self):
+        sectionizer = Sectionizer(nlp, patterns=None)
+        doc = nlp("There are no sections")
+        sectionizer(doc)
+        assert len(doc._.sections) == 1
+        assert doc[0]._.section_title is None
+        assert doc[0]._.section_span is None
+
+    def test_prune_overlapping_matches_longest(self):
+        from clinical_sectionizer.sectionizer import prune_overlapping_matches
+
+        matches = [(1, 0, 2), (2, 1, 4), (3, 3, 5), (4, 4, 6)]
+        assert prune_overlapping_matches(matches) == [(2, 1, 4), (4, 4, 6)]
+
+    def test_prune_overlapping_matches_greedy(self):
+        import random
+        from clinical_sectionizer.sectionizer import overlaps, prune_overlapping_matches
+
+        # A match is only dropped for a kept match it overlaps. The recursive implementation this
+        # replaced also dropped (1, 3, 5), which lost to (3, 4, 7) before (3, 4, 7) lost to (3, 5, 10).
+        matches = [(3, 4, 7), (3, 5, 10), (1, 3, 5), (1, 17, 22), (3, 5, 7), (2, 18, 23), (1, 15, 20), (3, 16, 17)]
+        assert prune_overlapping_matches(matches) == [(1, 3, 5), (3, 5, 10), (1, 15, 20)]
+
+        rng = random.Random(0)
+        for _ in range(500):
+            matches = []
+            for _ in range(rng.randint(0, 12)):
+                start = rng.randint(0, 30)
+                matches.append((rng.randint(1, 3), start, start + rng.randint(1, 6)))
+            pruned = prune_overlapping_matches(matches)
+            assert pruned == sorted(pruned, key=lambda x: x[1])
+            for i, match in enumerate(pruned):
+                assert not any(overlaps(match, other) for other in pruned[i + 1 :])
+            # Each dropped match overlaps a kept match which is at least as long
+            for match in matches:
+                if match not in pruned:
+                    assert any(
+                        overlaps(match, kept) and kept[2] - kept[1] >= match[2] - match[1]
+                        for kept in pruned
+                    )
+
+    def test_prune_overlapping_matches_many(self):
+        from clinical_sectionizer.sectionizer import prune_overlapping_matches
+
+        matches = [(1, i, i + 2) for i in range(10000)]
+        pruned = prune_overlapping_matches(matches)
+        assert pruned == [(1, i, i + 2) for i in range(0, 10000, 2)]
+
+    def test_prune_overlapping_matches_first(self):
+        from clinical_sectionizer.sectionizer import prune_overlapping_matches
+
+        matches = [(1, 0, 2), (2, 1, 4), (3, 3, 5)]
+        assert prune_overlapping_matches(matches, strategy="first") == [
+            (1, 0, 2),
+            (3, 3, 5),
+        ]
+
+    def test_prune_overlapping_matches_priority(self):
+        from clinical_sectionizer.sectionizer import prune_overlapping_matches
+
+        matches = [(1, 0, 2), (2, 1, 4), (3, 3, 5)]
+        pruned = prune_overlapping_matches(
+            matches, strategy="priority", priorities={1: 1}
+        )
+        assert pruned == [(1, 0, 2), (3, 3, 5)]
+
+    def test_prune_strategy_priority(self):
+        sectionizer = Sectionizer(nlp, patterns=None, prune_strategy="priority")
+        sectionizer.add(
+            [
+                {"section_title": "history", "pattern": "medical history:"},
+                {"section_title": "pmh", "pattern": "past medical", "priority": 1},
+            ]
+        )
+        doc = nlp("past medical history: none")
+        sectionizer(doc)
+        assert doc._.section_titles == ["pmh"]
+
+    def test_invalid_prune_strategy(self):
+        with pytest.raises(ValueError):
+            Sectionizer(nlp, patterns=None, prune_strategy="shortest")
+
+    def test_to_from_bytes(self):
+        sectionizer = Sectionizer(nlp, patterns=None, max_scope=3, require_start_line=True)
+        sectionizer.add(
+            [
+                {"section_title": "s1", "pattern": "section 1:"},
+                {
+                    "section_title": "s2",
+                    "pattern": [{"LOWER": "section"}, {"LOWER": "2"}, {"LOWER": ":"}],
+                    "parents": ["s1"],
+                    "parent_required": True,
+                },
+            ]
+        )
+        loaded = Sectionizer(nlp).from_bytes(sectionizer.to_bytes())
+        assert loaded.patterns == sectionizer.patterns
+        assert loaded.section_titles == {"s1", "s2"}
+        assert loaded.max_scope == 3
+        assert loaded.require_start_line is True
+        assert loaded._parent_sections == {"s1": set(), "s2": {"s1"}}
+        assert loaded._parent_required == {"s1": False, "s2": True}
+        doc = nlp("Section 1: abc\nsection 2: def")
+        loaded(doc)
+        assert doc._.section_titles == ["s1", "s2"]
+        assert doc._.section_parents == [None, "s1"]
+
+    def test_to_from_disk(self, tmp_path):
+        sectionizer = Sectionizer(nlp)
+        bundle_path = tmp_path / "sectionizer.msgpack"
+        sectionizer.to_disk(bundle_path)
+        loaded = Sectionizer(nlp, patterns=None).from_disk(bundle_path)
+        assert loaded.patterns == sectionizer.patterns
+        doc = nlp("Past Medical History: DM2\nAllergies: none")
+        titles = sectionizer(doc)._.section_titles
+        assert loaded(doc)._.section_titles == titles
+
+    def test_line_boundaries(self):
+        import re
+        from clinical_sectionizer import util
+
+        texts = [
+            "Past Medical History:\nDM2\n\n Allergies: none",
+            "Past Medical History: DM2 | Allergies: none\n",
+        ]
+        for text in texts:
+            doc = nlp(text)
+            for pattern in [util.NEWLINE_PATTERN, r"\n$", r"\|\s*$"]:
+                pattern = re.compile(pattern)
+                line_boundaries = util.LineBoundaries(doc, pattern)
+                # Only the default pattern is indexed up front
+                assert line_boundaries._complete == (pattern.pattern == util.NEWLINE_PATTERN)
+                for token in doc:
+                    assert line_boundaries.is_start_line(token.i) == util.is_start_line(
+                        token.i, doc, pattern
+                    )
+                    assert line_boundaries.is_end_line(token.i) == util.is_end_line(
+                        token.i, doc, pattern
+                    )
+
+        # Lines separated by "|" instead of newlines
+        sectionizer = Sectionizer(
+            nlp, patterns=None, require_start_line=True, newline_pattern=r"\|\s*$"
+        )
+        sectionizer.add(
+            [
+                {"section_title": "past_medical_history", "pattern": "Past Medical History:"},
+                {"section_title": "allergies", "pattern": "Allergies:"},
+            ]
+        )
+        doc = sectionizer(nlp("Allergies: none | Past Medical History: DM2\nAllergies: pcn"))
+        assert doc._.section_titles == ["allergies", "past_medical_history"]
+
+    def test_parent_section_many_siblings(self):
+        sectionizer = Sectionizer(nlp, patterns=None)
+        sectionizer.add(
+            [
+                {"section_title": "s1", "pattern": "section 1:"},
+                {"section_title": "s2", "pattern": "section 2:", "parents": ["s1"]},
+                {"section_title": "s3", "pattern": "section 3:", "parents": ["s2"]},
+                {"section_title": "s4", "pattern": "section 4:", "parents": ["s1"]},
+            ]
+        )
+        text = "section 1: abc " + "section 2: abc " * 2000 + "section 3: abc section 4: abc"
+        doc = nlp(text)
+        sectionizer(doc)
+        assert len(doc._.sections) == 2003
+        assert doc._.section_parents == [None] + ["s1"] * 2000 + ["s2", "s1"]
+
+    def test_stats(self):
+        sectionizer = Sectionizer(nlp, patterns=None, stats=True)
+        sectionizer.add(
+            [
+                {"section_title": "past_medical_history", "pattern": "Past Medical History:"},
+                {"section_title": "medical_history", "pattern": "Medical History:"},
+            ]
+        )
+        texts = ["Past Medical History: PE", "This is separate. Past Medical History: PE"]
+        list(sectionizer.pipe(nlp.pipe(texts)))
+        stats = sectionizer.stats.to_dict()
+        assert stats["docs"] == 2
+        assert stats["counts"]["matches"] == 4
+        assert stats["counts"]["matches_after_pruning"] == 2
+        assert stats["counts"]["sections"] == 3
+        assert stats["sections_per_doc"] == {1: 1, 2: 1}
+        assert stats["stage_seconds"]["matching"] > 0
+
+        sectionizer.stats.reset()
+        assert sectionizer.stats.docs == 0
+
+    def test_stats_multiprocess(self):
+        sectionizer = Sectionizer(nlp, patterns=None, stats=True)
+        sectionizer.add(
+            [{"section_title": "past_medical_history", "pattern": "Past Medical History:"}]
+        )
+        texts = ["Past Medical History: PE", "This is separate. Past Medical History: PE"] * 3
+        list(sectionizer.pipe(nlp.pipe(texts), batch_size=2, n_process=2))
+        assert sectionizer.stats.docs == 6
+        assert sectionizer.stats.counts["matches"] == 6
+        assert sectionizer.stats.counts["sections"] == 9
+
+    def test_stats_disabled(self):
+        sectionizer = Sectionizer(nlp, patterns=None)
+        assert sectionizer.stats is None
+        sectionizer(nlp("Past Medical History: PE"))
+
+    def test_cache(self):
+        from clinical_sectionizer.cache import MemoryCache
+
+        cache = MemoryCache(maxsize=10)
+        sectionizer = Sectionizer(nlp, patterns=None, cache=cache, stats=True)
+        sectionizer.add(
+            [{"section_title": "past_medical_history", "pattern": "Past Medical History:"}]
+        )
+        text = "This is separate. Past Medical History: PE"
+        first = sectionizer(nlp(text))
+        second = sectionizer(nlp(text))
+        assert cache.info()["hits"] == 1
+        assert cache.info()["misses"] == 1
+        assert sectionizer.stats.counts["cache_hits"] == 1
+        assert second._.section_titles == first._.section_titles
+        assert [span.start for span in second._.section_spans] == [0, 4]
+
+        # Adding patterns changes the key
+        sectionizer.add([{"section_title": "separate", "pattern": "separate"}])
+        third = sectionizer(nlp(text))
+        assert cache.info()["misses"] == 2
+        assert third._.section_titles == [None, "separate", "past_medical_history"]
+
+    def test_memory_cache_lru(self):
+        from clinical_sectionizer.cache import MemoryCache
+
+        cache = MemoryCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert len(cache) == 2
+
+    def test_prefilter_matches_full_path(self):
+        from os import path
+
+        example_filepath = path.join(
+            path.dirname(__file__), "..", "notebooks", "example_discharge_summary.txt"
+        )
+        with open(example_filepath) as f:
+            text = f.read()
+        default_patterns = Sectionizer(nlp).patterns
+        # Convert the default phrase patterns to token patterns so the prefilter is used
+        token_patterns = [
+            {
+                "section_title": pattern_dict["section_title"],
+                "pattern": [{"LOWER": token.lower_} for token in nlp.make_doc(pattern_dict["pattern"])],
+            }
+            for pattern_dict in default_patterns
+        ]
+        for patterns in [default_patterns, token_patterns]:
+            full = Sectionizer(nlp, patterns=patterns, require_start_line=True)
+            prefiltered = Sectionizer(nlp, patterns=patterns, require_start_line=True, prefilter=True)
+            doc = nlp.make_doc(text)
+            assert full.get_section_matches(doc) == prefiltered.get_section_matches(doc)
+            assert len(full.get_section_matches(doc)) > 10
+
+    def test_prefilter_windows(self):
+        from clinical_sectionizer.prefilter import HeaderPrefilter
+
+        prefilter = HeaderPrefilter(
+            nlp.vocab,
+            [
+                [{"LOWER": "past"}, {"LOWER": "medical", "OP": "?"}, {"LOWER": "history"}],
+                [{"LOWER": {"IN": ["hpi", "history"]}}],
+            ],
+        )
+        assert prefilter.enabled
+        doc = nlp.make_doc("Past Medical History: none. HPI: x y z past history")
+        assert prefilter.windows(doc) == [(0, 5), (6, 9), (11, 13)]
+
+        assert not HeaderPrefilter(nlp.vocab, [[{"IS_DIGIT": True}]]).enabled
+        assert not HeaderPrefilter(nlp.vocab, [[{"LOWER": "a"}, {"OP": "*"}]]).enabled
+
+    def test_update(self):
+        sectionizer = Sectionizer(nlp, patterns=None, require_start_line=True, keep_candidates=True)
+        sectionizer.add(
+            [
+                {"section_title": "past_medical_history", "pattern": "Past Medical History:"},
+                {"section_title": "allergies", "pattern": [{"LOWER": "allergies"}, {"ORTH": ":"}]},
+                {"section_title": "signature", "pattern": "Signed by:", "parents": ["allergies"]},
+            ]
+        )
+        text = "Past Medical History: DM2\nAllergies: none\n"
+        doc = sectionizer(nlp(text))
+        edits = [
+            # Append a section
+            (len(text), len(text), "Signed by: Dr. X"),
+            # Remove the allergies header
+            (len("Past Medical History: DM2\n"), len("Past Medical History: DM2\nAllergies:"), "Notes:"),
+            # Insert a header at the start
+            (0, 0, "Allergies: PCN\n"),
+        ]
+        for (start_char, end_char, replacement) in edits:
+            new_doc = sectionizer.update(doc, start_char, end_char, replacement)
+            expected = sectionizer(nlp.make_doc(new_doc.text))
+            assert new_doc.text == doc.text[:start_char] + replacement + doc.text[end_char:]
+            assert new_doc._.section_titles == expected._.section_titles
+            assert new_doc._.section_parents == expected._.section_parents
+            assert [span.text for span in new_doc._.section_spans] == [
+                span.text for span in expected._.section_spans
+            ]
+            doc = new_doc
+        assert doc._.section_titles == ["allergies", "past_medical_history", "signature"]
+
+    def test_update_without_candidates(self):
+        sectionizer = Sectionizer(nlp, patterns=None)
+        sectionizer.add([{"section_title": "allergies", "pattern": "Allergies:"}])
+        doc = nlp("Allergies: none")
+        new_doc = sectionizer.update(doc, 0, 0, "PMH: none\n")
+        assert new_doc._.section_titles == [None, "allergies"]
+
+        # Candidates are only stored if keep_candidates is set
+        doc = sectionizer(nlp("Allergies: none"))
+        assert doc._.section_candidates is None
+        new_doc = sectionizer.update(doc, 0, 0, "Allergies: PCN\n")
+        assert new_doc._.section_titles == ["allergies", "allergies"]
+        assert new_doc._.section_candidates is None
+
+    def test_doc_sections_view(self):
+        from clinical_sectionizer.doc_sections import DocSections, USER_DATA_KEY
+
+        sectionizer = Sectionizer(nlp, patterns=None)
+        sectionizer.add([{"section_title": "s1", "pattern": "section 1:"}])
+        doc = nlp("intro section 1: abc")
+        sectionizer(doc)
+        sections = doc._.sections
+        assert isinstance(sections, DocSections)
+        assert isinstance(doc.user_data[USER_DATA_KEY]["columns"], bytes)
+        assert len(sections) == 2
+        assert sections[-1].section_title == "s1"
+        assert sections[-1].section_header.text == "section 1:"
+        assert doc._.section_titles == [None, "s1"]
+        assert doc._.section_titles[1] == "s1"
+        assert len(doc._.section_spans) == 2
+        assert [span.text for span in doc._.section_spans] == ["intro", "section 1: abc"]
+        # The section attributes are plain lists, which can be concatenated and serialized
+        for attr in ("section_titles", "section_headers", "section_parents", "section_spans"):
+            assert type(getattr(doc._, attr)) is list
+        assert doc._.section_titles + ["s2"] == [None, "s1", "s2"]
+        assert json.dumps(doc._.section_titles) == '[null, "s1"]'
+        assert doc._.section_titles is not doc._.section_titles
+        assert sections.titles == [None, "s1"]
+
+        # Sections can still be set from a list of tuples
+        doc._.sections = [("s2", None, None, doc[0:2]), ("s3", doc[2:4], "s2", doc[2:])]
+        assert doc._.section_titles == ["s2", "s3"]
+        assert doc._.section_parents == [None, "s2"]
+        assert doc[3]._.section_header.text == doc[2:4].text
+
+    def test_serialize_sections(self):
+        import pickle
+        from spacy.tokens import Doc, DocBin
+        from clinical_sectionizer.doc_sections import sections_from_bytes, sections_to_bytes
+
+        sectionizer = Sectionizer(nlp, patterns=None, keep_candidates=True)
+        sectionizer.add(
+            [
+                {"section_title": "past_medical_history", "pattern": "Past Medical History:"},
+                {"section_title": "allergies", "pattern": "Allergies:"},
+            ]
+        )
+        doc = sectionizer(nlp("Past Medical History: DM2\nAllergies: none"))
+        expected = [(title, section.text) for (title, _, _, section) in doc._.sections]
+
+        loaded = [
+            Doc(nlp.vocab).from_bytes(doc.to_bytes()),
+            pickle.loads(pickle.dumps(doc)),
+        ]
+        doc_bin = DocBin(store_user_data=True)
+        doc_bin.add(doc)
+        loaded.extend(DocBin(store_user_data=True).from_bytes(doc_bin.to_bytes()).get_docs(nlp.vocab))
+        # Sections can also be stored separately from the doc
+        plain_doc = Doc(nlp.vocab).from_bytes(doc.to_bytes(exclude=["user_data"]))
+        assert len(plain_doc._.sections) == 0
+        loaded.append(sections_from_bytes(plain_doc, sections_to_bytes(doc)))
+
+        for loaded_doc in loaded:
+            assert [(title, section.text) for (title, _, _, section) in loaded_doc._.sections] == expected
+            assert loaded_doc[-1]._.section_title == "allergies"
+
+        # Docs loaded with their candidates can still be updated incrementally
+        new_doc = sectionizer.update(loaded[0], 0, 0, "Allergies: PCN\n")
+        assert new_doc._.section_titles == ["allergies", "past_medical_history", "allergies"]
+
+    def test_assertion_attributes(self):
+        from spacy.tokens import Span
+
+        Span.set_extension("in_family_history", default=False, force=True)
+        Span.set_extension("is_past", default=False, force=True)
+        sectionizer = Sectionizer(
+            nlp,
+            patterns=None,
+            add_attrs={
+                "family_history": {"in_family_history": True},
+                "past_medical_history": {"is_past": True},
+            },
+        )
+        sectionizer.add(
+            [
+                {"section_title": "past_medical_history", "pattern": "Past Medical History:"},
+                {"section_title": "family_history", "pattern": "Family History:"},
+            ]
+        )
+        doc = nlp("Stroke Past Medical History: stroke Family History: stroke and diabetes")
+        doc.ents = [Span(doc, 0, 1, label="PROBLEM"), Span(doc, 5, 6, label="PROBLEM")]
+        sectionizer(doc)
+        (before, past) = doc.ents
+        assert before._.is_past is False
+        assert past._.is_past is True
+        assert past._.in_family_history is False
+
+        # Spans which aren't entities can be passed in any order
+        spans = [Span(doc, 11, 12), Span(doc, 9, 10), Span(doc, 5, 6)]
+        sectionizer.set_assertion_attributes(spans)
+        assert [span._.in_family_history for span in spans] == [True, True, False]
+        assert [span._.section_title for span in spans] == [
+            "family_history",
+            "family_history",
+            "past_medical_history",
+        ]
+
+    def test_section_filter(self):
+        from spacy.pipeline import EntityRuler
+        from spacy.tokens import Span, Token
+        from clinical_sectionizer.section_filter import SectionFilter
+
+        Token.set_extension("is_checked", default=False, force=True)
+        Span.set_extension("is_checked", default=False, force=True)
+
+        def check(doc):
+            for token in doc:
+                token._.is_checked = True
+            for ent in doc.ents:
+                ent._.is_checked = True
+            # The sections of the range are available to the component
+            assert all(token._.section_title != "education" for token in doc)
+            return doc
+
+        ruler = EntityRuler(nlp)
+        ruler.add_patterns([{"label": "PROBLEM", "pattern": "stroke"}])
+        sectionizer = Sectionizer(nlp, patterns=None)
+        sectionizer.add(
+            [
+                {"section_title": "past_medical_history", "pattern": "Past Medical History:"},
+                {"section_title": "problem_list", "pattern": "Problem List:"},
+                {"section_title": "education", "pattern": "Education:"},
+            ]
+        )
+        filtered_ruler = SectionFilter(ruler, sections=["past_medical_history", "problem_list"])
+        filtered_check = SectionFilter(check, exclude=["education"])
+
+        text = "stroke Past Medical History: stroke Problem List: stroke Education: stroke"
+        doc = sectionizer(nlp(text))
+        doc.ents = [Span(doc, 0, 1, label="OTHER")]
+        doc = filtered_check(filtered_ruler(doc))
+        assert [(ent.text, ent.label_, ent._.section_title) for ent in doc.ents] == [
+            ("stroke", "OTHER", None),
+            ("stroke", "PROBLEM", "past_medical_history"),
+            ("stroke", "PROBLEM", "problem_list"),
+        ]
+        assert [ent._.is_checked for ent in doc.ents] == [True, True, True]
+        assert [token._.is_checked for token in doc] == [
+            token._.section_title != "education" for token in doc
+        ]
+
+        docs = [sectionizer(nlp(text)) for _ in range(3)]
+        for doc in filtered_ruler.pipe(docs, batch_size=2):
+            assert len(doc.ents) == 2
+
+        with pytest.raises(ValueError):
+            SectionFilter(ruler)
+        with pytest.raises(ValueError):
+            filtered_ruler(nlp(text))
+
+    def test_text_engine(self):
+        from clinical_sectionizer.util import align_char_spans
+
+        patterns = [
+            {"section_title": "past_medical_history", "pattern": "past medical history:"},
+            {"section_title": "problem_list", "pattern": r"problem\s+list:"},
+            {
+                "section_title": "medications",
+                "pattern": [{"LOWER": "medications"}, {"LOWER": ":"}],
+            },
+        ]
+        sectionizer = Sectionizer(nlp, patterns=None, engine="text")
+        sectionizer.add(patterns)
+        text = "Past Medical History: stroke\nProblem  List: htn\nMedications: asa"
+        doc = sectionizer(nlp(text))
+        assert doc._.section_titles == ["past_medical_history", "problem_list", "medications"]
+        assert [header.text for header in doc._.section_headers] == [
+            "Past Medical History:",
+            "Problem  List:",
+            "Medications:",
+        ]
+
+        # The same sections are found by both engines for literal headers
+        token_sectionizer = Sectionizer(nlp, patterns=None)
+        token_sectionizer.add([patterns[0], patterns[2]])
+        text_sectionizer = Sectionizer(nlp, patterns=None, engine="text")
+        text_sectionizer.add([patterns[0], patterns[2]])
+        text = "Past medical history: stroke\nmedications: asa"
+        assert (
+            token_sectionizer(nlp(text))._.sections.to_offsets()
+            == text_sectionizer(nlp(text))._.sections.to_offsets()
+        )
+
+        loaded = Sectionizer(nlp).from_bytes(sectionizer.to_bytes())
+        assert loaded.engine == "text"
+        doc = loaded(nlp("Problem List: htn"))
+        assert doc._.section_titles == ["problem_list"]
+
+        # Spans are expanded to the tokens they overlap, without whitespace at the edges
+        doc = nlp.make_doc("abc def  ghi")
+        assert align_char_spans(doc, [(1, 5), (3, 4), (4, 7), (7, 9)]) == [
+            (0, 2),
+            None,
+            (1, 2),
+            None,
+        ]
+
+        with pytest.raises(ValueError):
+            Sectionizer(nlp, patterns=None, engine="regex")
+
+    def test_text_engine_pipe(self):
+        # The titles are only found by the text engine, so the workers must not be the only
+        # processes to add them to the vocab
+        patterns = [
+            {"section_title": "text_engine_hospital_course", "pattern": r"hospital\s+course:"},
+            {"section_title": "text_engine_plan", "pattern": "plan:"},
+        ]
+        sectionizer = Sectionizer(nlp, patterns=None, engine="text")
+        sectionizer.add(patterns)
+        texts = ["Hospital  Course: stable\nPlan: discharge", "Plan: follow up"] * 3
+        docs = list(sectionizer.pipe(nlp.pipe(texts), batch_size=2, n_process=2))
+        assert [doc.text for doc in docs] == texts
+        for doc in docs[::2]:
+            assert doc._.section_titles == ["text_engine_hospital_course", "text_engine_plan"]
+            assert [header.text for header in doc._.section_headers] == ["Hospital  Course:", "Plan:"]
+        for doc in docs[1::2]:
+            assert doc._.section_titles == ["text_engine_plan"]
+
+        loaded = Sectionizer(nlp).from_bytes(sectionizer.to_bytes())
+        docs = list(loaded.pipe(nlp.pipe(texts[:2]), batch_size=1, n_process=2))
+        assert [doc._.section_titles for doc in docs] == [
+            ["text_engine_hospital_course", "text_engine_plan"],
+            ["text_engine_plan"],
+        ]
+        assert Sectionizer(nlp, patterns=None)._text_matcher is None
+
+    def test_profile(self):
+        patterns = [
+            {"section_title": "history", "pattern": "history:"},
+            {"section_title": "history", "pattern": [{"LOWER": "history"}, {"LOWER": ":"}]},
+            {"section_title": "history", "pattern": "medical history:"},
+            {
+                "section_title": "problem_list",
+                "pattern": "problem list:",
+                "parents": ["history"],
+                "parent_required": True,
+            },
+            {"section_title": "never", "pattern": "never matches"},
+        ]
+        text = "Problem List: htn\nMedical History: none\nProblem List: htn"
+        sectionizer = Sectionizer(nlp, patterns=None, profile=True)
+        sectionizer.add(patterns)
+        plain = Sectionizer(nlp, patterns=None)
+        plain.add(patterns)
+        doc = sectionizer(nlp(text))
+        assert doc._.sections.to_offsets() == plain(nlp(text))._.sections.to_offsets()
+
+        profile = sectionizer.profile
+        assert profile.docs == 1
+        rows = {row["pattern"]: row for row in profile.rows()}
+        assert rows["history:"]["hits"] == 1
+        assert rows["history:"]["lost"]["overlap"] == 1
+        # The token pattern finds the same span as the phrase
+        assert rows['[{"LOWER": "history"}, {"LOWER": ":"}]']["lost"]["duplicate"] == 1
+        assert rows["medical history:"]["kept"] == 1
+        # The first problem list has no parent
+        assert rows["problem list:"]["hits"] == 2
+        assert rows["problem list:"]["lost"]["parents"] == 1
+        assert profile.dead_patterns() == [("never", "never matches")]
+
+        docs = list(sectionizer.pipe([nlp(text) for _ in range(4)], batch_size=2, n_process=2))
+        assert all(doc._.section_titles == [None, "history", "problem_list"] for doc in docs)
+        assert profile.docs == 5
+        assert {row["pattern"]: row["hits"] for row in profile.rows()}["problem list:"] == 10
+
+    def test_profile_same_sections(self):
+        # Ties between overlapping headers are broken by the matcher order, which profiling keeps
+        patterns = [
+            {"section_title": "zeta", "pattern": "history:"},
+            {"section_title": "alpha", "pattern": "history:"},
+        ]
+        titles = []
+        for profile in (False, True):
+            sectionizer = Sectionizer(nlp, patterns=None, profile=profile)
+            sectionizer.add(patterns)
+            titles.append(sectionizer(nlp("x history: y"))._.section_titles)
+        assert titles[0] == titles[1]
+        rows = {row["section_title"]: row for row in sectionizer.profile.rows()}
+        assert rows["zeta"]["hits"] == rows["alpha"]["hits"] == 1
+        kept = titles[1][-1]
+        lost = "zeta" if kept == "alpha" else "alpha"
+        assert rows[kept]["kept"] == 1
+        assert rows[lost]["lost"]["overlap"] == 1
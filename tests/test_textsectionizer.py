@@ -1,6 +1,14 @@
+import json
+import warnings
 import pytest
+from os import path
 
 from clinical_sectionizer import TextSectionizer
+from clinical_sectionizer.text_sectionizer import PATRICK_RULES_FILEPATH
+
+EXAMPLE_FILEPATH = path.join(
+    path.dirname(__file__), "..", "notebooks", "example_discharge_summary.txt"
+)
 
 
 class TestTextSectionizer:
@@ -85,3 +93,497 @@ class TestTextSectionizer:
             assert section_title == "past_medical_history"
             assert header == "Past Medical History:"
             assert section == "Past Medical History: PE"
+
+    def test_combined_engine_string_match(self):
+        sectionizer = TextSectionizer(patterns=None, engine="combined")
+        sectionizer.add(
+            [
+                {
+                    "section_title": "past_medical_history",
+                    "pattern": "Past Medical History:",
+                }
+            ]
+        )
+        doc = "Past Medical History: PE"
+        sections = sectionizer(doc)
+        (section_title, header, section) = sections[0]
+        assert section_title == "past_medical_history"
+        assert header == "Past Medical History:"
+        assert section == "Past Medical History: PE"
+
+    def test_combined_engine_same_sections(self):
+        with open(EXAMPLE_FILEPATH) as f:
+            text = f.read()
+        sectionizer = TextSectionizer()
+        combined_sectionizer = TextSectionizer(engine="combined")
+        assert combined_sectionizer(text) == sectionizer(text)
+
+    def test_combined_engine_uncombinable_patterns(self):
+        patterns = [
+            {"section_title": "repeated", "pattern": r"(ab)\1:"},
+            {"section_title": "named", "pattern": r"(?P<word>note):"},
+            {"section_title": "alternation", "pattern": "plan:|a/p:"},
+            {"section_title": "optional", "pattern": "x?plan:"},
+        ]
+        text = "abab: one note: two a/p: three xplan: four plan: five"
+        sectionizer = TextSectionizer(patterns=patterns)
+        combined_sectionizer = TextSectionizer(patterns=patterns, engine="combined")
+        assert combined_sectionizer(text) == sectionizer(text)
+
+    def test_literal_patterns(self):
+        patterns = [
+            {"section_title": "past_medical_history", "pattern": "(past )?medical (history|hx):"},
+            {"section_title": "past_medical_history", "pattern": r"past\s*history:"},
+            {"section_title": "history", "pattern": "history:"},
+            {"section_title": "medications", "pattern": r"\bmedications?:"},
+            {"section_title": "keys", "pattern": "ask:"},
+            {"section_title": "plan", "pattern": "p[hm]+ plan:"},
+        ]
+        sectionizer = TextSectionizer(patterns=patterns)
+        assert len(sectionizer._literal_matcher.ranks) == 5
+        assert sectionizer._literal_matcher.other_ranks == [5]
+
+        # The long s and the Kelvin sign match "s" and "k" when ignoring case
+        text = "Medical Hx: DM2 PAST  HISTORY: none medication: asa premedications: no aſK: yes phm plan: f/u"
+        matches = [
+            (title, match.span())
+            for (title, patterns) in sectionizer._compiled_patterns.items()
+            for pattern in patterns
+            for match in pattern.finditer(text)
+        ]
+        assert [(title, match.span()) for (title, match) in sectionizer.get_matches(text)] == matches
+        assert [title for (title, _, _) in sectionizer(text)] == [
+            "past_medical_history",
+            "past_medical_history",
+            "medications",
+            "keys",
+            "plan",
+        ]
+
+    def test_load_patterns_from_json(self):
+        patterns = TextSectionizer.load_patterns_from_json(PATRICK_RULES_FILEPATH)
+        pmh_patterns = [p["pattern"] for p in patterns if p["section_title"] == "pmh"]
+        assert pmh_patterns.count("history:") == 1
+
+        sectionizer = TextSectionizer(patterns=PATRICK_RULES_FILEPATH)
+        assert sectionizer.patterns == patterns
+        (section_title, header, _) = sectionizer("Past medical history: DM2")[0]
+        assert section_title == "pmh"
+        assert header == "Past medical history:"
+
+    def test_load_patterns_from_json_merge(self, tmp_path):
+        filepath = str(tmp_path / "patterns.json")
+        with open(filepath, "w") as f:
+            json.dump({"pmh": ["history:", "pmh:", r"(hx)\1:", "history:"], "plan": ["plan:"]}, f)
+        patterns = TextSectionizer.load_patterns_from_json(filepath, merge=True)
+        assert patterns == [
+            {"section_title": "pmh", "pattern": "(?:history:)|(?:pmh:)"},
+            {"section_title": "pmh", "pattern": r"(hx)\1:"},
+            {"section_title": "plan", "pattern": "plan:"},
+        ]
+        sectionizer = TextSectionizer(patterns=patterns)
+        assert [title for (title, _, _) in sectionizer("PMH: DM2 hxhx: none plan: f/u")] == [
+            "pmh",
+            "pmh",
+            "plan",
+        ]
+
+    def test_compiled_patterns_shared(self):
+        patterns = [
+            {"section_title": "past_medical_history", "pattern": "past medical history:"},
+            {"section_title": "past_medical_history", "pattern": "past medical history:"},
+        ]
+        sectionizer = TextSectionizer(patterns=patterns)
+        assert len(sectionizer._compiled_patterns["past_medical_history"]) == 1
+        other = TextSectionizer(patterns=patterns[:1])
+        assert (
+            other._compiled_patterns["past_medical_history"][0]
+            is sectionizer._compiled_patterns["past_medical_history"][0]
+        )
+
+    def test_invalid_engine(self):
+        with pytest.raises(ValueError):
+            TextSectionizer(engine="other")
+
+    def test_pipe(self):
+        sectionizer = TextSectionizer()
+        texts = ["Past Medical History: PE", "Allergies: peanuts", "no sections"]
+        assert list(sectionizer.pipe(texts, batch_size=2)) == [
+            sectionizer(text) for text in texts
+        ]
+
+    def test_pipe_multiprocess(self):
+        sectionizer = TextSectionizer()
+        texts = ["Past Medical History: PE", "Allergies: peanuts", "no sections"] * 5
+        assert list(sectionizer.pipe(texts, batch_size=2, n_process=2)) == [
+            sectionizer(text) for text in texts
+        ]
+
+    def test_to_from_bytes(self):
+        sectionizer = TextSectionizer(patterns=None, engine="combined")
+        sectionizer.add(
+            [
+                {
+                    "section_title": "past_medical_history",
+                    "pattern": "PAST MEDICAL HISTORY:",
+                }
+            ],
+            cflags=[],
+        )
+        loaded = TextSectionizer(patterns=None).from_bytes(sectionizer.to_bytes())
+        assert loaded.engine == "combined"
+        assert loaded.patterns == sectionizer.patterns
+        assert loaded.section_titles == {"past_medical_history"}
+        assert loaded("Past Medical History: PE")[0][0] is None
+        assert loaded("PAST MEDICAL HISTORY: PE")[0][0] == "past_medical_history"
+
+    def test_to_from_disk(self, tmp_path):
+        sectionizer = TextSectionizer()
+        bundle_path = tmp_path / "text_sectionizer.msgpack"
+        sectionizer.to_disk(bundle_path)
+        loaded = TextSectionizer(patterns=None).from_disk(bundle_path)
+        with open(EXAMPLE_FILEPATH) as f:
+            text = f.read()
+        assert loaded(text) == sectionizer(text)
+
+    def test_stream_chunks(self):
+        sectionizer = TextSectionizer()
+        with open(EXAMPLE_FILEPATH) as f:
+            text = f.read()
+        chunks = [text[i : i + 50] for i in range(0, len(text), 50)]
+        sections = list(sectionizer.stream(chunks, max_header_length=60))
+        assert sections == sectionizer(text)
+
+    def test_stream_file(self):
+        sectionizer = TextSectionizer(engine="combined")
+        with open(EXAMPLE_FILEPATH) as f:
+            text = f.read()
+        with open(EXAMPLE_FILEPATH) as f:
+            sections = list(sectionizer.stream(f, chunk_size=100, max_header_length=60))
+        assert sections == sectionizer(text)
+
+    def test_stream_header_across_chunks(self):
+        sectionizer = TextSectionizer(patterns=None)
+        sectionizer.add(
+            [
+                {
+                    "section_title": "past_medical_history",
+                    "pattern": "Past Medical History:",
+                }
+            ]
+        )
+        text = "Intro. " * 10 + "Past Medical History: PE. " * 2
+        chunks = [text[i : i + 10] for i in range(0, len(text), 10)]
+        sections = list(sectionizer.stream(chunks, max_header_length=25))
+        section = (
+            "past_medical_history",
+            "Past Medical History:",
+            "Past Medical History: PE. ",
+        )
+        assert sections == [(None, None, "Intro. " * 10), section, section]
+
+    def test_get_section_offsets(self):
+        sectionizer = TextSectionizer()
+        with open(EXAMPLE_FILEPATH) as f:
+            text = f.read()
+        sections = sectionizer.get_section_offsets(text)
+        assert sections.to_tuples() == sectionizer(text)
+        assert len(sections) == len(sectionizer(text))
+        for section in sections:
+            assert text[section.section_start : section.section_end] == section.section_text
+            if section.section_title is not None:
+                assert sections.titles[section.title_id] == section.section_title
+
+    def test_get_section_offsets_no_header(self):
+        sectionizer = TextSectionizer()
+        sections = sectionizer.get_section_offsets("There are no headers")
+        (section_title, header, section_text) = sections[0]
+        assert section_title is None
+        assert header is None
+        assert section_text == "There are no headers"
+        assert sections[0].title_id == -1
+
+    def test_get_section_offsets_columns(self):
+        sectionizer = TextSectionizer(patterns=None)
+        sectionizer.add(
+            [
+                {
+                    "section_title": "past_medical_history",
+                    "pattern": "Past Medical History:",
+                }
+            ]
+        )
+        sections = sectionizer.get_section_offsets("Intro. Past Medical History: PE")
+        columns = sections.to_columns()
+        assert columns["section_title"] == [None, "past_medical_history"]
+        assert columns["header_start"] == [-1, 7]
+        assert columns["header_end"] == [-1, 28]
+        arrays = sections.to_arrays()
+        assert arrays["section_start"].tolist() == [0, 7]
+        assert arrays["section_end"].tolist() == [7, 31]
+
+    def test_sqlite_cache(self, tmp_path):
+        from clinical_sectionizer.cache import SqliteCache
+
+        cache_path = tmp_path / "cache.db"
+        text = "Past Medical History: PE\nAllergies: none"
+        expected = TextSectionizer()(text)
+        sectionizer = TextSectionizer(cache=SqliteCache(cache_path))
+        assert sectionizer(text) == expected
+
+        # A new sectionizer and cache reuse the results stored in the file
+        cache = SqliteCache(cache_path)
+        sectionizer = TextSectionizer(cache=cache)
+        assert sectionizer(text) == expected
+        assert sectionizer.get_section_offsets(text).to_tuples() == expected
+        assert cache.info()["hits"] == 2
+        assert cache.info()["misses"] == 0
+
+    def test_sqlite_cache_maxsize(self, tmp_path):
+        from clinical_sectionizer.cache import SqliteCache
+
+        cache = SqliteCache(tmp_path / "cache.db", maxsize=3)
+        for i in range(SqliteCache.PRUNE_INTERVAL):
+            cache.set(str(i), [i])
+        assert len(cache) == 3
+        assert cache.get(str(SqliteCache.PRUNE_INTERVAL - 1)) == [SqliteCache.PRUNE_INTERVAL - 1]
+
+    def test_run_corpus_resume(self, tmp_path):
+        from clinical_sectionizer.cli import run_corpus
+        import json
+
+        notes_path = tmp_path / "notes.jsonl"
+        texts = ["Past Medical History: DM{0}\nAllergies: none".format(i) for i in range(5)]
+        with notes_path.open("w") as f:
+            for i, text in enumerate(texts):
+                f.write(json.dumps({"id": "note{0}".format(i), "text": text}) + "\n")
+        sectionizer = TextSectionizer()
+
+        full_path = tmp_path / "full.jsonl"
+        assert run_corpus(notes_path, full_path, sectionizer, shard_size=2) == 5
+        lines = full_path.read_text().splitlines()
+        first = json.loads(lines[0])
+        assert first["id"] == "note0"
+        assert [s["section_title"] for s in first["sections"]] == ["past_medical_history", "allergy"]
+        assert first["sections"][1]["section_start"] == texts[0].index("Allergies")
+
+        # Simulate a job which was stopped while writing the second shard
+        partial_path = tmp_path / "partial.jsonl"
+        partial_path.write_text(lines[0] + "\n" + lines[1] + "\n" + lines[2][:10])
+        offset = len(lines[0]) + len(lines[1]) + 2
+        (tmp_path / "partial.jsonl.progress.json").write_text(
+            json.dumps({"notes": 2, "offset": offset})
+        )
+        assert run_corpus(notes_path, partial_path, sectionizer, shard_size=2, resume=True) == 3
+        assert partial_path.read_text() == full_path.read_text()
+
+    def test_run_corpus_columns(self, tmp_path):
+        from clinical_sectionizer.cli import run_corpus
+        import json
+
+        notes_dir = tmp_path / "notes"
+        notes_dir.mkdir()
+        for i in range(3):
+            (notes_dir / "{0}.txt".format(i)).write_text("Allergies: none")
+        output_dir = tmp_path / "sections"
+        run_corpus(notes_dir, output_dir, TextSectionizer(), output_format="columns", shard_size=2)
+        columns = json.loads((output_dir / "shard-000000002.json").read_text())
+        assert columns["id"] == ["2.txt"]
+        assert columns["section_title"] == ["allergy"]
+        assert columns["header_end"] == [len("Allergies:")]
+
+    def test_async_text_sectionizer(self):
+        import asyncio
+        from clinical_sectionizer.async_text_sectionizer import AsyncTextSectionizer
+
+        sectionizer = TextSectionizer()
+        texts = ["Past Medical History: DM{0}\nAllergies: none".format(i) for i in range(20)]
+        texts.append("No sections here")
+
+        async def sectionize_all(**kwargs):
+            async with AsyncTextSectionizer(sectionizer, max_batch_size=8, **kwargs) as async_sectionizer:
+                results = await asyncio.gather(*(async_sectionizer(text) for text in texts))
+            return results, async_sectionizer.n_batches
+
+        for kwargs in [{}, {"executor": "process", "n_workers": 2}]:
+            results, n_batches = asyncio.run(sectionize_all(**kwargs))
+            assert results == [sectionizer(text) for text in texts]
+            assert 3 <= n_batches < len(texts)
+
+    def test_async_text_sectionizer_backpressure(self):
+        import asyncio
+        from clinical_sectionizer.async_text_sectionizer import AsyncTextSectionizer
+
+        async def run():
+            async_sectionizer = AsyncTextSectionizer(max_queue_size=2, max_batch_size=1)
+            results = await asyncio.gather(*(async_sectionizer("Allergies: none") for _ in range(10)))
+            await async_sectionizer.close()
+            return results
+
+        results = asyncio.run(run())
+        assert results == [[("allergy", "Allergies:", "Allergies: none")]] * 10
+
+    def test_profile(self, tmp_path):
+        from clinical_sectionizer.pattern_profile import PatternProfile
+
+        patterns = [
+            {"section_title": "history", "pattern": "history:"},
+            {"section_title": "history", "pattern": "medical history:"},
+            {"section_title": "allergies", "pattern": "allergies:"},
+            {"section_title": "never", "pattern": "never matches:"},
+        ]
+        text = "Medical History: none\nAllergies: none\nHistory: none"
+        sectionizer = TextSectionizer(patterns=patterns, profile=True)
+        assert sectionizer(text) == TextSectionizer(patterns=patterns)(text)
+        sectionizer(text)
+
+        profile = sectionizer.profile
+        assert profile.docs == 2
+        rows = {row["pattern"]: row for row in profile.rows(sort_by="hits")}
+        assert rows["history:"]["hits"] == 4
+        # "history:" inside "Medical History:" is dropped by the longer header
+        assert rows["history:"]["lost"]["overlap"] == 2
+        assert rows["history:"]["kept"] == 2
+        assert rows["medical history:"]["kept"] == 2
+        assert rows["allergies:"]["kept"] == 2
+        assert rows["never matches:"]["hits"] == 0
+        assert profile.dead_patterns() == [("never", "never matches:")]
+        assert [row["pattern"] for row in profile.rows(sort_by="lost")][0] == "history:"
+
+        merged = PatternProfile()
+        merged.merge(profile)
+        merged.merge(json.loads(profile.to_json()))
+        assert merged.docs == 4
+        assert {row["pattern"]: row["hits"] for row in merged.rows()}["history:"] == 8
+
+        report = profile.report(sort_by="kept", top=2)
+        assert len(report.splitlines()) == 4
+        profile.write_report(tmp_path / "profile.txt")
+        assert (tmp_path / "profile.txt").read_text() == profile.report()
+        profile.write_report(tmp_path / "profile.json")
+        assert len(json.loads((tmp_path / "profile.json").read_text())["patterns"]) == 4
+        with pytest.raises(ValueError):
+            profile.rows(sort_by="pattern")
+
+        sections = list(sectionizer.pipe([text] * 4, batch_size=2, n_process=2))
+        assert sections == [sectionizer(text)] * 4
+        assert profile.docs == 7
+
+    def test_lint_patterns(self):
+        import re
+        from clinical_sectionizer.regex_lint import lint_pattern
+
+        for pattern in [r"(a+)+b", r"(\s*\w+)*:", r"past\s*\s*history:", r"assessment\s*.\s*plan:"]:
+            assert lint_pattern(re.compile(pattern, re.I)), pattern
+        for pattern in [r"past\s*history:", r"(\w+:)+", r"(\w+\s)+:", r"\s*:\s*", "allergies:"]:
+            assert lint_pattern(re.compile(pattern, re.I)) == (), pattern
+
+        # None of the default patterns are slow
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            sectionizer = TextSectionizer()
+        assert sectionizer._risky_ranks == []
+
+        with pytest.warns(RuntimeWarning):
+            TextSectionizer(patterns=[{"section_title": "history", "pattern": r"(\s*\w+)*:"}])
+
+    def test_time_budget(self):
+        from clinical_sectionizer.cache import MemoryCache
+
+        patterns = [
+            {"section_title": "allergies", "pattern": "allergies:"},
+            {"section_title": "history", "pattern": r"history\s*\s*:"},
+        ]
+        text = "History: none\nAllergies: none"
+        with pytest.warns(RuntimeWarning):
+            sectionizer = TextSectionizer(patterns=patterns, cache=MemoryCache())
+        expected = [
+            ("history", "History:", "History: none\n"),
+            ("allergies", "Allergies:", "Allergies: none"),
+        ]
+        assert sectionizer(text) == expected
+
+        # The slow pattern is skipped once the budget has run out
+        sectionizer = TextSectionizer(patterns=None, time_budget=1e-9, cache=MemoryCache())
+        with pytest.warns(RuntimeWarning):
+            sectionizer.add(patterns)
+        for _ in range(2):
+            with pytest.warns(RuntimeWarning):
+                assert sectionizer(text) == [
+                    (None, None, "History: none\n"),
+                    ("allergies", "Allergies:", "Allergies: none"),
+                ]
+        with pytest.warns(RuntimeWarning):
+            assert sectionizer.get_section_offsets(text).timed_out is True
+        # Results which ran out of time aren't cached
+        sectionizer.time_budget = None
+        assert sectionizer(text) == expected
+        assert sectionizer.get_section_offsets(text).timed_out is False
+
+        sectionizer.time_budget = 1e-9
+        sectionizer.on_timeout = "raise"
+        with pytest.raises(TimeoutError):
+            sectionizer.get_headers(text)
+        sectionizer.time_budget = 10.0
+        assert sectionizer(text) == expected
+
+        with pytest.raises(ValueError):
+            TextSectionizer(patterns=None, on_timeout="ignore")
+        with pytest.raises(ValueError):
+            TextSectionizer(patterns=None, time_budget=0)
+
+    def test_time_budget_exponential_pattern(self):
+        import time
+        from clinical_sectionizer.cache import MemoryCache
+
+        # Searching this pattern takes time exponential in the length of a run of whitespace
+        patterns = [
+            {"section_title": "allergies", "pattern": "allergies:"},
+            {"section_title": "history", "pattern": r"(\s+)+history:"},
+        ]
+        text = "Allergies: none" + " " * 40 + "x"
+        with pytest.warns(RuntimeWarning):
+            sectionizer = TextSectionizer(patterns=patterns, time_budget=0.2, cache=MemoryCache())
+        expected = [("allergies", "Allergies:", text)]
+        assert sectionizer("Allergies: none") == [("allergies", "Allergies:", "Allergies: none")]
+
+        start = time.perf_counter()
+        with pytest.warns(RuntimeWarning):
+            sections = sectionizer.get_section_offsets(text)
+        assert time.perf_counter() - start < 1.0
+        assert sections.timed_out is True
+        with pytest.warns(RuntimeWarning):
+            assert sectionizer(text) == expected
+
+        sectionizer.on_timeout = "raise"
+        start = time.perf_counter()
+        with pytest.raises(TimeoutError):
+            sectionizer.get_headers(text)
+        assert time.perf_counter() - start < 1.0
+
+        # The worker process is restarted after it was killed
+        assert sectionizer("Allergies: none\n History: none") == [
+            ("allergies", "Allergies:", "Allergies: none"),
+            ("history", "\n History:", "\n History: none"),
+        ]
+
+    def test_time_budget_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        patterns = [
+            {"section_title": "allergies", "pattern": "allergies:"},
+            {"section_title": "history", "pattern": r"(\s+)+history:"},
+        ]
+        with pytest.warns(RuntimeWarning):
+            sectionizer = TextSectionizer(patterns=patterns, time_budget=10.0)
+        # The header offsets are different in each text, so replies read by the wrong thread would lose them
+        texts = ["Allergies: {0}\n History: none".format("x" * i) for i in range(1, 201)]
+        expected = [
+            [
+                ("allergies", "Allergies:", text[: text.index("\n")]),
+                ("history", "\n History:", "\n History: none"),
+            ]
+            for text in texts
+        ]
+        with ThreadPoolExecutor(8) as pool:
+            assert list(pool.map(sectionizer, texts)) == expected